@@ -12,17 +12,102 @@ import logging
 from enum import Enum
 import re
 import threading
-from wsgiref.handlers import format_date_time
+from email.utils import parsedate_to_datetime
 import time
+import asyncio
+from typing import Callable
+from collections import OrderedDict, deque
+import os
+import mmap
+import json
+import hashlib
+import tempfile
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor
+import selectors
+import errno
+import select
+import fcntl
+import struct
+import multiprocessing
+import shutil
+import copy
+from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from urllib.parse import urljoin, urlsplit
 
-MAX_THREADS: int = 100
+MAX_THREADS: int = 100 # Worker threads of the threaded engine, unless --max-concurrency says otherwise
+MAX_ASYNC_CLIENTS: int = 10000 # Clients served at once by the async engine, unless --max-concurrency says otherwise
+DEFAULT_MAX_QUEUED: int = 1024 # Accepted clients waiting for a worker
+DEFAULT_MAX_QUEUE_TIME: float = 1.0 # Seconds a client may wait for a worker before it's turned away
+ADMISSION_SWEEP_INTERVAL: float = 0.1
+ADMISSION_LINGER: float = 1.0 # Seconds the async engine waits for a rejected client to finish sending
+RETRY_AFTER: int = 1 # Seconds overloaded clients are told to wait before retrying
+LISTEN_BACKLOG: int = 4096
+DEFAULT_CACHE_BYTES: int = 64 * 1024 * 1024
+DEFAULT_CACHE_ENTRIES: int = 10000
+HEURISTIC_FRESHNESS_FRACTION: float = 0.1 # Of the time since Last-Modified
+MAX_HEURISTIC_FRESHNESS: float = 24 * 60 * 60
+DEFAULT_STALE_WHILE_REVALIDATE: float = 0.0 # Seconds past expiry a response is served while it's refreshed, unless it says otherwise
+DEFAULT_STALE_IF_ERROR: float = 0.0 # Seconds past expiry a response stands in for a server error, unless it says otherwise
+DEFAULT_REFRESH_WORKERS: int = 4
+MAX_PENDING_REFRESHES: int = 256
+DEFAULT_PREFETCH_WORKERS: int = 4 # Prefetches run at once
+DEFAULT_PREFETCH_BUDGET: int = 16 # Resources prefetched per page
+MAX_PENDING_PREFETCHES: int = 256
+MAX_PREFETCH_SCAN: int = 512 * 1024 # Bytes of a page scanned for embedded resources
+MAX_PREFETCHED_TRACKED: int = 10000 # Prefetched keys remembered until they're requested
+RELAY_BUFFER_SIZE: int = 64 * 1024
+MAX_RESPONSE_HEAD: int = 64 * 1024
+MAX_REQUEST_HEAD: int = 16 * 1024
+REQUEST_RECV_SIZE: int = 4096
+DEFAULT_REQUEST_TIMEOUT: float = 10.0 # Seconds a client has to send its whole request head
+DEFAULT_DISK_CACHE_BYTES: int = 1024 * 1024 * 1024
+INDEX_SAVE_INTERVAL: int = 64 # Disk cache writes between index snapshots
+MAX_CHUNK_LINE: int = 4096
+DEFAULT_POOL_MAX_PER_HOST: int = 8
+DEFAULT_POOL_IDLE_TIMEOUT: float = 30.0
+DEFAULT_DNS_TTL: float = 60.0 # Seconds a resolved host is reused; getaddrinfo doesn't report record TTLs
+DEFAULT_DNS_NEGATIVE_TTL: float = 5.0 # Seconds a failed lookup is remembered
+DEFAULT_DNS_ENTRIES: int = 4096
+DNS_PREWARM_PARALLEL: int = 16 # Lookups run at once when pre-warming
+DNS_PREWARM_PATH: bytes = b'/proxy/dns/prewarm/' # Settings path that pre-warms the host:port after it
+HAPPY_EYEBALLS_DELAY: float = 0.25 # Seconds before trying the next address if a connection attempt hasn't finished
+TUNNEL_PIPE_SIZE: int = 1024 * 1024 # Kernel pipe capacity per tunnel direction, if the system allows it
+TUNNEL_PUMP_ROUNDS: int = 16 # Reads per direction before the other direction of a tunnel gets a turn
+TUNNEL_IDLE_TIMEOUT: float = 300.0 # Seconds a tunnel may carry nothing either way before it's closed
+TUNNEL_SWEEP_INTERVAL: float = 1.0 # Seconds between checks for idle tunnels
+CONNECT_RESPONSE: bytes = b'HTTP/1.0 200 Connection established\r\n\r\n'
+BLOCKLIST_PREFIX: int = 4 # Leading bytes of each blocked host that index it
+MAX_COALESCED_RESPONSE: int = 16 * 1024 * 1024 # Largest response buffered for requests waiting on the same fetch
+CREDENTIAL_HEADERS: frozenset[bytes] = frozenset((b'authorization', b'cookie')) # Requests with these aren't coalesced or shared
+REQUEST_METHODS: frozenset[bytes] = frozenset((b'GET', b'HEAD', b'OPTIONS', b'TRACE', b'PUT', b'DELETE',
+                                               b'POST', b'PATCH', b'CONNECT'))
+REQUEST_PATTERN = re.compile(rb'\s*(\S+)\s+(\S+)\s+(\S+)(?:\s+(\S.*)|\s*)', re.DOTALL) # Request line tokens, then headers
+URL_PATTERN = re.compile(rb"http:\/\/([^:]+?)(?::(\d+)|)(/.*)")
+AUTHORITY_PATTERN = re.compile(rb'([^:/\s]+):(\d+)') # CONNECT targets
+HEADER_PATTERN = re.compile(rb'\S+: .+')
+EMBED_TAG_PATTERN = re.compile(rb'<(img|script|link|source|embed)\b([^>]*)>', re.IGNORECASE) # Tags that embed resources
+TAG_ATTRIBUTE_PATTERN = re.compile(rb'([a-zA-Z-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))')
+EMBED_LINK_RELS: frozenset[bytes] = frozenset((b'stylesheet', b'icon', b'preload', b'modulepreload'))
+HOP_BY_HOP_HEADERS: frozenset[bytes] = frozenset((b'connection', b'keep-alive', b'proxy-connection', b'te',
+                                                  b'trailer', b'transfer-encoding', b'upgrade'))
 
-responseCache: dict[bytes, bytes] = dict()
 cacheEnabled: bool = False
+staleWhileRevalidate: float = DEFAULT_STALE_WHILE_REVALIDATE
+staleIfError: float = DEFAULT_STALE_IF_ERROR
+prefetchEnabled: bool = False
+
+requestTimeout: float = DEFAULT_REQUEST_TIMEOUT
+
+maxConcurrency: int | None = None # Engine default if None
+maxQueued: int = DEFAULT_MAX_QUEUED
+maxQueueTime: float = DEFAULT_MAX_QUEUE_TIME
 
-requestBlocklist: set[bytes] = set()
 blocklistEnabled: bool = False
 
+tunnelSplice: bool = hasattr(os, 'splice') # Relay tunnels with os.splice rather than recv_into
+
 def ctrl_c_pressed(signal, frame):
     '''Signal handler for pressing ctrl-c'''
     sys.exit(0)
@@ -31,56 +116,1952 @@ class ParseError(Enum):
     NOTIMPL = "501 Not Implemented"
     BADREQ = "400 Bad Request"
     FORBID = "403 Forbidden"
+    TIMEOUT = "408 Request Timeout"
+    TOOLARGE = "431 Request Header Fields Too Large"
+
+class CacheEntry:
+    '''A cached server response along with the metadata needed to judge its freshness
+    ([RFC 9111, 4.2](https://www.rfc-editor.org/rfc/rfc9111#section-4.2)).'''
+    def __init__(self, response: bytes, headers: dict[bytes, bytes], responseTime: float | None = None):
+        self.response = response
+        self.headers: dict[bytes, bytes] = {}
+        self.update(headers, responseTime)
+
+    def __len__(self) -> int:
+        return len(self.response)
+
+    def update(self, headers: dict[bytes, bytes], responseTime: float | None = None) -> None:
+        '''Refreshes the freshness metadata from server response ``headers``,
+        received at ``responseTime`` (now if not given).
+        Stored headers that ``headers`` doesn't mention (e.g. in a 304) are kept.'''
+        headers = self.headers = self.headers | headers
+        self.responseTime = time.time() if responseTime is None else responseTime
+        self.dateHeader = headers.get(b'date')
+        self.date = parse_http_date(self.dateHeader) or self.responseTime
+        self.lastModified = headers.get(b'last-modified')
+        age = headers.get(b'age', b'0')
+        self.initialAge = max(0.0, self.responseTime - self.date, float(age) if age.isdigit() else 0.0)
+
+        # Freshness lifetime, from most to least explicit source
+        cacheControl = parse_cache_control(headers.get(b'cache-control', b''))
+        maxAge = cacheControl.get(b's-maxage', cacheControl.get(b'max-age'))
+        if b'no-cache' in cacheControl:
+            self.lifetime = 0.0
+        elif maxAge is not None:
+            self.lifetime = float(maxAge) if maxAge.isdigit() else 0.0
+        elif (expires := headers.get(b'expires')) is not None:
+            expiresTime = parse_http_date(expires)
+            self.lifetime = expiresTime - self.date if expiresTime else 0.0
+        elif lastModifiedTime := parse_http_date(self.lastModified):
+            self.lifetime = min(max(0.0, self.date - lastModifiedTime) * HEURISTIC_FRESHNESS_FRACTION,
+                                MAX_HEURISTIC_FRESHNESS)
+        else:
+            self.lifetime = 0.0
+
+        # How long it may be served stale ([RFC 9111, 4.2.4](https://www.rfc-editor.org/rfc/rfc9111#section-4.2.4))
+        self.mustRevalidate = not cacheControl.keys().isdisjoint((b'no-cache', b'must-revalidate',
+                                                                  b'proxy-revalidate', b's-maxage'))
+        self.staleWhileRevalidate = parse_delta_seconds(cacheControl.get(b'stale-while-revalidate'))
+        self.staleIfError = parse_delta_seconds(cacheControl.get(b'stale-if-error'))
+
+    def age(self, now: float | None = None) -> float:
+        '''Current age of the response in seconds.'''
+        if now is None: now = time.time()
+        return self.initialAge + max(0.0, now - self.responseTime)
+
+    def is_fresh(self, now: float | None = None) -> bool:
+        '''Checks if the response can be served without contacting the server.'''
+        return self.lifetime > self.age(now)
+
+    def stale_within(self, window: float, now: float | None = None) -> bool:
+        '''Checks if the response may be served stale at all, and went stale less than ``window`` seconds ago.'''
+        return not self.mustRevalidate and self.age(now) - self.lifetime < window
+
+    def serves_while_revalidating(self, now: float | None = None) -> bool:
+        '''Checks if the stale response may be served while it's refreshed in the background
+        ([RFC 5861, 3](https://www.rfc-editor.org/rfc/rfc5861#section-3)). The response's own
+        ``stale-while-revalidate`` window takes precedence over ``staleWhileRevalidate``.'''
+        return self.stale_within(staleWhileRevalidate if self.staleWhileRevalidate is None
+                                 else self.staleWhileRevalidate, now)
+
+    def serves_on_error(self, now: float | None = None) -> bool:
+        '''Checks if the stale response may be served in place of a server error
+        ([RFC 5861, 4](https://www.rfc-editor.org/rfc/rfc5861#section-4)). The response's own
+        ``stale-if-error`` window takes precedence over ``staleIfError``.'''
+        return self.stale_within(staleIfError if self.staleIfError is None else self.staleIfError, now)
+
+    def validator(self) -> bytes | None:
+        '''Date to send as ``If-Modified-Since`` when revalidating the response.'''
+        return self.lastModified or self.dateHeader
+
+class ResponseCache:
+    '''Thread-safe LRU cache of server responses.
+    Bounded by ``maxBytes`` total (keys and responses) and by ``maxEntries`` entries;
+    the least recently used entries are evicted first.'''
+    def __init__(self, maxBytes: int = DEFAULT_CACHE_BYTES, maxEntries: int = DEFAULT_CACHE_ENTRIES):
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self.size = 0 # Bytes currently cached
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0 # Times the cache was cleared
+        self._entries: OrderedDict[bytes, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: bytes) -> CacheEntry | None:
+        '''Returns the response cached under ``key`` and marks it as recently used.'''
+        with self._lock:
+            obj = self._entries.get(key)
+            if obj is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return obj
+
+    def peek(self, key: bytes) -> CacheEntry | None:
+        '''Returns the response cached under ``key`` without counting a hit or marking it as used.'''
+        with self._lock: return self._entries.get(key)
+
+    def put(self, key: bytes, obj: CacheEntry) -> None:
+        '''Caches ``obj`` under ``key``, evicting entries until the cache is within its bounds.
+        Responses that could never fit are not cached.'''
+        objSize = len(key) + len(obj)
+        if objSize > self.maxBytes: return
+        with self._lock:
+            if (old := self._entries.pop(key, None)) is not None:
+                self.size -= len(key) + len(old)
+            self._entries[key] = obj
+            self.size += objSize
+            while self.size > self.maxBytes or len(self._entries) > self.maxEntries:
+                oldKey, oldObj = self._entries.popitem(last=False)
+                self.size -= len(oldKey) + len(oldObj)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        '''Removes every cached response.'''
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.flushes += 1
+
+    def stats(self) -> dict[str, int]:
+        '''Current cache counters.'''
+        return {'entries': len(self._entries), 'bytes': self.size, 'maxBytes': self.maxBytes,
+                'maxEntries': self.maxEntries, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+responseCache = ResponseCache()
+
+class DiskEntry(CacheEntry):
+    '''A response cached on disk by ``DiskCache``.
+    Its body is memory-mapped on demand rather than read into memory. Lookups hand out a
+    ``pin``ned copy whose body was mapped at lookup time, so it stays readable if the
+    entry is evicted while it's being served.'''
+    def __init__(self, cache: 'DiskCache', name: str, key: bytes, size: int,
+                 headers: dict[bytes, bytes], responseTime: float):
+        self.cache = cache
+        self.name = name
+        self.key = key
+        self.size = size
+        self.version: int | None = None # Modification time of the .meta file this entry was read from
+        self.source: DiskEntry | None = None # Entry in the cache's table, if this is a pinned copy of it
+        self._mapped: memoryview | None = None
+        self.headers = {}
+        CacheEntry.update(self, headers, responseTime)
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.cache.entryDirectory, self.name)
+
+    @property
+    def response(self) -> memoryview:
+        '''The cached response, mapped from its file without copying.'''
+        if self._mapped is not None: return self._mapped
+        if not self.size: return memoryview(b'')
+        with open(self.path, 'rb') as file:
+            return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def pin(self) -> 'DiskEntry':
+        '''A copy of the entry with its body mapped now. Raises ``FileNotFoundError`` if it's gone.'''
+        pinned = copy.copy(self)
+        pinned._mapped = self.response
+        pinned.source = self
+        return pinned
+
+    def update(self, headers: dict[bytes, bytes], responseTime: float | None = None) -> None:
+        super().update(headers, responseTime)
+        if self.source is not None: self.source.update(headers, self.responseTime)
+        else: self.cache.save_meta(self)
+
+    def record(self) -> list:
+        '''JSON-serializable form of the entry, as stored in ``.meta`` files and the index.'''
+        return [self.name, self.key.decode('latin-1'), self.size, self.responseTime,
+                {k.decode('latin-1'): v.decode('latin-1') for k, v in self.headers.items()}]
+
+class DiskWriter:
+    '''A response being spooled to a temporary file until ``DiskCache.commit``.'''
+    def __init__(self, cache: 'DiskCache', key: bytes):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        fd, self.tmpPath = tempfile.mkstemp(dir=cache.tmpDirectory)
+        self.file = os.fdopen(fd, 'wb')
+
+    def write(self, data: bytes | memoryview) -> bool:
+        '''Appends ``data`` to the file. Returns ``False`` (and discards the file)
+        once the response is too large for the cache.'''
+        self.size += len(data)
+        if self.size > self.cache.maxBytes:
+            self.abort()
+            return False
+        self.file.write(data)
+        return True
+
+    def abort(self) -> None:
+        '''Discards the spooled response.'''
+        self.file.close()
+        try:
+            os.unlink(self.tmpPath)
+        except FileNotFoundError:
+            pass
+
+class DiskCache:
+    '''Persistent cache tier that survives proxy restarts.
+    Each response is stored in a file named by the hash of its key, next to a small ``.meta``
+    file with its key and headers, in the ``entries`` subdirectory, which holds nothing else.
+    Files are written under a temporary name and renamed into place, so a crash never leaves
+    a partial entry behind. An ``index`` file snapshots every entry in LRU order so that a warm
+    start doesn't have to read each ``.meta`` file.
+    Without ``warm``, entries left in ``directory`` by a previous run are removed.
+    A ``shared`` cache is used by several processes at once: each lookup checks the entry's
+    ``.meta`` file, picking up entries the other processes wrote, updated or evicted.
+    The bytes cached by all of them are then counted in an anonymous shared mapping, created
+    before the processes are forked, and ``maxBytes`` applies to that total. A process over
+    it evicts its own least recently used entries first, then the oldest files of the others.'''
+    def __init__(self, directory: str, maxBytes: int = DEFAULT_DISK_CACHE_BYTES, warm: bool = False,
+                 shared: bool = False):
+        self.directory = directory
+        self.shared = shared
+        self.tmpDirectory = os.path.join(directory, 'tmp')
+        self.entryDirectory = os.path.join(directory, 'entries')
+        self.indexPath = os.path.join(directory, 'index')
+        self.maxBytes = maxBytes
+        self.size = 0 # Bytes currently cached
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, DiskEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._unsaved = 0 # Writes since the index was last saved
+        self._sharedSize = mmap.mmap(-1, 8) if shared else None # Bytes cached by every process
+        self._sharedLock = multiprocessing.Lock() if shared else nullcontext() # Taken after _lock
+
+        os.makedirs(self.tmpDirectory, exist_ok=True)
+        os.makedirs(self.entryDirectory, exist_ok=True)
+        for name in os.listdir(self.tmpDirectory): # Leftovers from interrupted writes
+            os.unlink(os.path.join(self.tmpDirectory, name))
+        if warm: self._load()
+        else: self.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def entry_name(key: bytes) -> str:
+        return hashlib.sha1(key).hexdigest()
+
+    def get(self, key: bytes) -> DiskEntry | None:
+        '''Returns the entry cached under ``key``, pinned, and marks it as recently used.
+        An entry evicted by another thread or process before its body could be mapped is a miss.'''
+        name = self.entry_name(key)
+        if self.shared: self._refresh(name)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None: self._entries.move_to_end(name)
+        if entry is not None:
+            try:
+                entry = entry.pin()
+            except FileNotFoundError:
+                with self._lock: self._discard(name, entry)
+                entry = None
+        with self._lock:
+            if entry is None: self.misses += 1
+            else: self.hits += 1
+        return entry
+
+    def begin(self, key: bytes) -> DiskWriter:
+        '''Starts spooling a response for ``key`` to disk.'''
+        return DiskWriter(self, key)
+
+    def commit(self, writer: DiskWriter, headers: dict[bytes, bytes]) -> None:
+        '''Moves a fully spooled response into the cache, evicting entries to stay within ``maxBytes``.'''
+        writer.file.flush()
+        os.fsync(writer.file.fileno())
+        writer.file.close()
+        entry = DiskEntry(self, self.entry_name(writer.key), writer.key, writer.size, headers, time.time())
+        with self._sharedLock:
+            replaced = self._file_size(entry.path)
+            os.replace(writer.tmpPath, entry.path) # Body first, so a .meta file always has a complete body
+            self._add_shared(entry.size - replaced)
+        self.save_meta(entry)
+        with self._lock:
+            self._insert(entry)
+            self._unsaved += 1
+            saveIndex = self._unsaved >= INDEX_SAVE_INTERVAL
+        if saveIndex: self.save_index()
+
+    def save_meta(self, entry: DiskEntry) -> None:
+        '''Atomically writes the ``.meta`` file of ``entry``.'''
+        self._write_atomic(entry.path + '.meta', json.dumps(entry.record()).encode())
+        if self.shared: entry.version = os.stat(entry.path + '.meta').st_mtime_ns
+
+    def save_index(self) -> None:
+        '''Atomically snapshots every entry to the index file.'''
+        with self._lock:
+            records = [entry.record() for entry in self._entries.values()]
+            self._unsaved = 0
+        self._write_atomic(self.indexPath, json.dumps(records, separators=(',', ':')).encode())
+
+    def clear(self) -> None:
+        '''Removes every cached response.'''
+        with self._lock, self._sharedLock:
+            for name in os.listdir(self.entryDirectory):
+                try:
+                    os.unlink(os.path.join(self.entryDirectory, name))
+                except FileNotFoundError: # Removed by another process
+                    pass
+            self._entries.clear()
+            self.size = 0
+            if self.shared: self._sharedSize[:] = bytes(8)
+        self.save_index()
+
+    def forget(self) -> None:
+        '''Drops every entry without touching the files, once another process has cleared the cache.'''
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def reload(self) -> None:
+        '''Rebuilds the entry table from the files, e.g. after other processes have written to the cache.'''
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self._load()
+
+    def total_size(self) -> int:
+        '''Bytes cached, by every process if the cache is shared.'''
+        if not self.shared: return self.size
+        with self._sharedLock: return struct.unpack('=q', self._sharedSize)[0]
+
+    def stats(self) -> dict[str, int]:
+        '''Current cache counters.'''
+        return {'entries': len(self._entries), 'bytes': self.total_size(), 'maxBytes': self.maxBytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def _insert(self, entry: DiskEntry) -> None:
+        '''Adds ``entry`` to the table, evicting entries to stay within ``maxBytes``. Call with the lock held.'''
+        if (old := self._entries.pop(entry.name, None)) is not None:
+            self.size -= old.size
+        self._entries[entry.name] = entry
+        self.size += entry.size
+        while self.total_size() > self.maxBytes:
+            if len(self._entries) > 1: self._evict(next(iter(self._entries)))
+            elif not (self.shared and self._evict_oldest_file(entry.name)): break
+
+    def _add_shared(self, delta: int) -> None:
+        '''Counts ``delta`` more bytes in the shared total. Call with the shared lock held.'''
+        if self.shared: struct.pack_into('=q', self._sharedSize, 0, struct.unpack('=q', self._sharedSize)[0] + delta)
+
+    @staticmethod
+    def _file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _remove_files(self, path: str) -> None:
+        '''Removes an entry's files, uncounting its body if this process removed it.'''
+        with self._sharedLock:
+            try:
+                os.unlink(path + '.meta') # .meta first, so a body never outlives it unnoticed
+            except FileNotFoundError:
+                pass
+            size = self._file_size(path)
+            try:
+                os.unlink(path)
+                self._add_shared(-size)
+            except FileNotFoundError: # Another process got there first
+                pass
+
+    def _evict_oldest_file(self, keep: str) -> bool:
+        '''Evicts the oldest entry on disk other than ``keep``, which may be another process's.
+        Returns ``False`` if there is none. Call with the lock held.'''
+        oldest, oldestTime = None, None
+        for name in os.listdir(self.entryDirectory):
+            if len(name) != 40 or name == keep: continue
+            try:
+                mtime = os.stat(os.path.join(self.entryDirectory, name)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if oldestTime is None or mtime < oldestTime: oldest, oldestTime = name, mtime
+        if oldest is None: return False
+        if oldest in self._entries: self._evict(oldest)
+        else:
+            self._remove_files(os.path.join(self.entryDirectory, oldest))
+            self.evictions += 1
+        return True
+
+    def _refresh(self, name: str) -> None:
+        '''Brings the entry ``name`` in line with its ``.meta`` file, which another process may have changed.'''
+        metaPath = os.path.join(self.entryDirectory, name + '.meta')
+        try:
+            version = os.stat(metaPath).st_mtime_ns
+        except FileNotFoundError:
+            version = None
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.version == version: return
+            if entry is not None: self._discard(name, entry)
+        if version is None: return
+        try:
+            with open(metaPath, 'rb') as file:
+                entry = self._from_record(json.load(file))
+            if os.path.getsize(entry.path) != entry.size: return
+        except (OSError, ValueError):
+            return
+        entry.version = version
+        with self._lock: self._insert(entry)
+
+    def _discard(self, name: str, entry: DiskEntry) -> None:
+        '''Drops ``entry`` from the table, unless it has been replaced already. Call with the lock held.'''
+        if self._entries.get(name) is entry:
+            del self._entries[name]
+            self.size -= entry.size
+
+    def _evict(self, name: str) -> None:
+        entry = self._entries.pop(name)
+        self.size -= entry.size
+        self.evictions += 1
+        self._remove_files(entry.path)
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, tmpPath = tempfile.mkstemp(dir=self.tmpDirectory)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmpPath, path)
+
+    def _from_record(self, record: list) -> DiskEntry:
+        name, key, size, responseTime, headers = record
+        return DiskEntry(self, name, key.encode('latin-1'), size,
+                         {k.encode('latin-1'): v.encode('latin-1') for k, v in headers.items()}, responseTime)
+
+    def _load(self) -> None:
+        '''Rebuilds the entry table from the index, then picks up entries written after the
+        index was last saved and removes bodies whose ``.meta`` was never written.'''
+        records = []
+        try:
+            with open(self.indexPath, 'rb') as file:
+                records = json.load(file)
+        except (OSError, ValueError):
+            logging.info("Disk cache index missing or unreadable, scanning entries")
+        names = set(os.listdir(self.entryDirectory))
+        for record in records:
+            if record[0] in names and record[0] + '.meta' in names:
+                self._entries[record[0]] = self._from_record(record)
+        for name in names:
+            if len(name) != 40 or name in self._entries: continue
+            try:
+                with open(os.path.join(self.entryDirectory, name + '.meta'), 'rb') as file:
+                    self._entries[name] = self._from_record(json.load(file))
+            except (OSError, ValueError):
+                os.unlink(os.path.join(self.entryDirectory, name)) # Body whose write never completed
+        for entry in list(self._entries.values()):
+            try:
+                if os.path.getsize(entry.path) != entry.size: raise OSError
+            except OSError:
+                del self._entries[entry.name]
+                continue
+            self.size += entry.size
+        while self.size > self.maxBytes:
+            self._evict(next(iter(self._entries)))
+        if self.shared:
+            with self._sharedLock: self._sharedSize[:] = struct.pack('=q', self.size)
+        logging.info(f"Loaded {len(self._entries)} responses ({self.size} bytes) from disk cache")
+
+diskCache: DiskCache | None = None
+
+class ChunkedDecoder:
+    '''Incrementally decodes a chunked response body
+    ([RFC 9112, 7.1](https://www.rfc-editor.org/rfc/rfc9112#section-7.1)).'''
+    def __init__(self):
+        self.done = False # Set once the last chunk and trailers have been read
+        self._line = bytearray() # Partial chunk size or trailer line
+        self._remaining = 0 # Data bytes left in the current chunk
+        self._crlf = 0 # Bytes of the CRLF after the current chunk left to skip
+        self._trailers = False
+
+    def feed(self, data: memoryview) -> list[memoryview]:
+        '''Decodes ``data``. Returns views of the chunk data it contains.
+        Raises ``ValueError`` if the body is malformed.'''
+        pieces = []
+        i = 0
+        while i < len(data) and not self.done:
+            if self._remaining:
+                piece = data[i:i + self._remaining]
+                pieces.append(piece)
+                i += len(piece)
+                self._remaining -= len(piece)
+                if not self._remaining: self._crlf = 2
+            elif self._crlf:
+                skipped = min(self._crlf, len(data) - i)
+                i += skipped
+                self._crlf -= skipped
+            else:
+                segment = bytes(data[i:i + MAX_CHUNK_LINE])
+                if (end := segment.find(b'\n')) < 0:
+                    self._line += segment
+                    i += len(segment)
+                    if len(self._line) > MAX_CHUNK_LINE: raise ValueError("Chunk size line too long")
+                    continue
+                line = (self._line + segment[:end]).rstrip(b'\r')
+                self._line.clear()
+                i += end + 1
+                if self._trailers:
+                    if not line: self.done = True
+                    continue
+                size = int(line.split(b';')[0].strip(), 16)
+                if size: self._remaining = size
+                else: self._trailers = True
+        return pieces
+
+class ResponseRelay:
+    '''Follows a server response as it's relayed to the client chunk by chunk.
+    The response is only copied aside while it may still be cached; anything else
+    passes straight through, so memory use is bounded by the relay buffer.
+    The response's framing (``Content-Length`` or chunked) is tracked so its end is known
+    without waiting for the server to close the connection. If the request was ``upgraded``
+    to HTTP/1.1, the response is converted back to HTTP/1.0 for the client. With ``staleOnError``,
+    a server error is replaced by ``cached`` if it may be served stale in its place. The response to
+    a ``credentialed`` request is only cached if it's marked as shareable. With ``offload``,
+    committing the response to the disk cache is handed to it rather than done in place.'''
+    def __init__(self, host: bytes, port: int, path: bytes, cached: CacheEntry | None, upgraded: bool = False,
+                 staleOnError: bool = True, offload: Callable[[Callable[[], object]], object] | None = None,
+                 credentialed: bool = False):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.cached = cached
+        self.upgraded = upgraded
+        self.staleOnError = staleOnError
+        self.offload = offload
+        self.credentialed = credentialed
+        self.done = False # Set once the rest of the server response isn't needed
+        self.revalidated = False # Set if the server confirmed ``cached`` is still valid
+        self.servedStale = False # Set if ``cached`` is served in place of a server error
+        self.complete = False # Set once the whole response has been received
+        self.keepAlive = False # Whether the server keeps the connection open after the response
+        self.received = 0 # Bytes received from the server
+        self._head: bytearray | None = bytearray() # Start of the response until its head is complete
+        self._headers: dict[bytes, bytes] = {}
+        self._remaining: int | None = None # Body bytes left, if the body has a known length
+        self._chunked: ChunkedDecoder | None = None
+        self._capture: bytearray | None = None # Copy of the response for the cache
+        self._spool: DiskWriter | None = None # Copy of the response for the disk cache
+
+    @property
+    def reusable(self) -> bool:
+        '''Whether the server connection can carry another request.'''
+        return self.complete and self.keepAlive
+
+    @property
+    def usesCached(self) -> bool:
+        '''Whether the client gets ``cached`` rather than the server response.'''
+        return self.revalidated or self.servedStale
+
+    def feed(self, data: memoryview) -> list[bytes | memoryview]:
+        '''Processes ``data`` received from the server.
+        Returns what should be forwarded to the client now.'''
+        self.received += len(data)
+        if self._head is None: return self._body(data)
+        self._head += data
+        if (end := self._head.find(b'\r\n\r\n')) < 0:
+            if len(self._head) < MAX_RESPONSE_HEAD: return []
+            logging.debug("Response head too large, relaying without caching")
+            head = bytes(self._head)
+            self._head = None
+            return [head]
+
+        head, rest = bytes(self._head[:end + 4]), memoryview(bytes(self._head[end + 4:]))
+        self._head = None
+        responseCode, self._headers = parse_response_headers(head)
+        logging.debug(f"Response code: {responseCode.decode()}")
+        self._frame(head, responseCode)
+        if cacheEnabled:
+            if responseCode == b'304' and self.cached:
+                self.cached.update(self._headers)
+                self.done = self.revalidated = True
+                return [self.cached.response]
+            if responseCode.startswith(b'5') and self.staleOnError and self.cached and self.cached.serves_on_error():
+                logging.info(f"Serving stale response in place of a {responseCode.decode()} from the server")
+                cacheRefresher.served_on_error()
+                self.done = self.servedStale = True
+                return [self.cached.response]
+            if responseCode == b'200' and is_cacheable(self._headers, self.credentialed):
+                self._capture = bytearray()
+                if diskCache is not None: self._spool = diskCache.begin(get_cache_key(self.host, self.port, self.path))
+        if self.upgraded: head = downgrade_response_head(head)
+        self._copy(head)
+        return [head, *self._body(rest)]
+
+    def finish(self) -> bytes:
+        '''Called once the response is complete or the server closed the connection.
+        Caches the response if possible. Returns whatever is left to forward to the client.'''
+        if self.usesCached: return b''
+        self.done = True
+        if self._head is not None:
+            head = bytes(self._head)
+            self._head = None
+            return head
+        if self._remaining is None and not self._chunked: self.complete = True # Closed by the server
+        if not self.complete:
+            logging.info(f"Response from {self.host.decode()}:{self.port} ended early")
+            self.abort()
+        elif self._capture is not None or self._spool is not None:
+            obj = bytes(self._capture) if self._capture is not None else None
+            spool, self._spool = self._spool, None
+            add_to_cache(self.host, self.port, self.path, obj, self._headers, spool, self.offload)
+        return b''
+
+    def abort(self) -> None:
+        '''Called if the relay fails before the response is complete.'''
+        self.done = True
+        self._capture = None
+        if self._spool: self._spool.abort()
+        self._spool = None
+
+    def _frame(self, head: bytes, responseCode: bytes) -> None:
+        '''Works out how the end of the response body will be marked.'''
+        connection = self._headers.get(b'connection', b'').lower()
+        self.keepAlive = (b'keep-alive' in connection if head.startswith(b'HTTP/1.0')
+                          else b'close' not in connection)
+        contentLength = self._headers.get(b'content-length', b'')
+        if responseCode in (b'204', b'304'):
+            self._remaining = 0
+        elif self.upgraded and b'chunked' in self._headers.get(b'transfer-encoding', b'').lower():
+            self._chunked = ChunkedDecoder()
+        elif contentLength.isdigit():
+            self._remaining = int(contentLength)
+        else:
+            self.keepAlive = False # Body ends when the server closes the connection
+        if self._remaining == 0: self.complete = self.done = True
+
+    def _body(self, data: memoryview) -> list[bytes | memoryview]:
+        if self.complete or not data: return []
+        if self._chunked:
+            pieces = self._chunked.feed(data)
+            self.complete = self._chunked.done
+        elif self._remaining is None:
+            pieces = [data]
+        else:
+            pieces = [data[:self._remaining]]
+            self._remaining -= len(pieces[0])
+            self.complete = not self._remaining
+        if self.complete: self.done = True
+        for piece in pieces: self._copy(piece)
+        return pieces
+
+    def _copy(self, data: bytes | memoryview) -> None:
+        if self._spool and not self._spool.write(data):
+            self._spool = None # Too large for the disk cache
+        if self._capture is None: return
+        if len(self._capture) + len(data) > responseCache.maxBytes:
+            self._capture = None # Too large to ever be cached
+            return
+        self._capture += data
+
+class TunnelDirection(ABC):
+    '''One direction of a CONNECT tunnel, passing on what ``src`` sends to ``dst``.
+    Both sockets must be non-blocking. Subclasses say how bytes are moved.'''
+    def __init__(self, src: socket, dst: socket):
+        self.src = src
+        self.dst = dst
+        self.moved = 0 # Bytes read from src
+        self.pending = 0 # Bytes read from src but not yet written to dst
+        self.eof = False # src has closed its side
+        self.done = False # ...and everything it sent has been passed on
+
+    def pump(self) -> tuple[socket, int] | None:
+        '''Moves what it can without blocking, for at most ``TUNNEL_PUMP_ROUNDS`` reads so the other
+        direction gets a turn. Returns the socket and ``poll`` event to wait for before pumping
+        again, or ``None`` once done.'''
+        try:
+            for _ in range(TUNNEL_PUMP_ROUNDS):
+                if self.pending:
+                    self.pending -= self._send()
+                elif self.eof:
+                    self.dst.shutdown(SHUT_WR) # Pass the close on; the other direction may carry on
+                    self.done = True
+                    return None
+                elif n := self._receive():
+                    self.pending = n
+                    self.moved += n
+                else:
+                    self.eof = True
+        except BlockingIOError:
+            pass
+        return (self.dst, select.POLLOUT) if self.pending else (self.src, select.POLLIN)
+
+    def close(self) -> None:
+        pass
+
+    @abstractmethod
+    def _receive(self) -> int:
+        '''Reads what ``src`` has sent, returning how many bytes, or 0 at the end of its stream.'''
+
+    @abstractmethod
+    def _send(self) -> int:
+        '''Writes pending bytes to ``dst``, returning how many.'''
+
+class TunnelPipe(TunnelDirection):
+    '''Moves bytes through a kernel pipe with ``os.splice``, so they're never copied into Python.'''
+    def __init__(self, src: socket, dst: socket):
+        super().__init__(src, dst)
+        self._pipeRead, self._pipeWrite = os.pipe()
+        try:
+            fcntl.fcntl(self._pipeWrite, fcntl.F_SETPIPE_SZ, TUNNEL_PIPE_SIZE)
+        except OSError:
+            pass # Over the system's limit, so keep the default size
+
+    def close(self) -> None:
+        os.close(self._pipeRead)
+        os.close(self._pipeWrite)
+
+    def _receive(self) -> int:
+        return os.splice(self.src.fileno(), self._pipeWrite, TUNNEL_PIPE_SIZE,
+                         flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+
+    def _send(self) -> int:
+        return os.splice(self._pipeRead, self.dst.fileno(), self.pending,
+                         flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+
+class TunnelBuffer(TunnelDirection):
+    '''Moves bytes through a reused buffer with ``recv_into``, where ``os.splice`` isn't available.'''
+    def __init__(self, src: socket, dst: socket):
+        super().__init__(src, dst)
+        self._buffer = bytearray(RELAY_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._start = 0 # Offset of the pending bytes
+
+    def _receive(self) -> int:
+        self._start = 0
+        return self.src.recv_into(self._buffer)
+
+    def _send(self) -> int:
+        sent = self.dst.send(self._view[self._start:self._start + self.pending])
+        self._start += sent
+        return sent
+
+class Tunnel:
+    '''An established CONNECT tunnel between a client and a server, relayed by ``tunnelRelay``.
+    Bytes go through a ``TunnelPipe`` each way if ``tunnelSplice`` is set, otherwise a ``TunnelBuffer``.
+    Once closed, ``finish`` is called with how many bytes came from the client and from the server.'''
+    def __init__(self, client_skt: socket, server_skt: socket, finish: Callable[[int, int], object]):
+        Direction = TunnelPipe if tunnelSplice else TunnelBuffer
+        client_skt.setblocking(False)
+        server_skt.setblocking(False)
+        self.client_skt = client_skt
+        self.server_skt = server_skt
+        self.fds = (client_skt.fileno(), server_skt.fileno())
+        self.finish = finish
+        self.lastMoved = time.monotonic()
+        self.directions = [Direction(client_skt, server_skt)]
+        try:
+            self.directions.append(Direction(server_skt, client_skt))
+        except OSError:
+            self.directions[0].close()
+            raise
+
+    def pump(self) -> dict[int, int] | None:
+        '''Moves what it can both ways without blocking. Returns the ``poll`` events to wait for on
+        each socket before pumping again, or ``None`` once both sides have closed.'''
+        before = [(direction.moved, direction.pending) for direction in self.directions]
+        events = dict.fromkeys(self.fds, 0)
+        for direction in self.directions:
+            if not direction.done and (wait := direction.pump()):
+                skt, event = wait
+                events[skt.fileno()] |= event
+        if before != [(direction.moved, direction.pending) for direction in self.directions]:
+            self.lastMoved = time.monotonic()
+        return events if any(events.values()) else None
+
+    def close(self) -> None:
+        for direction in self.directions: direction.close()
+        self.server_skt.close()
+        self.finish(self.directions[0].moved, self.directions[1].moved)
+
+class TunnelRelay:
+    '''Relays every established tunnel on one thread, polling all their sockets at once, so that
+    open tunnels don't hold the threads that serve requests. A tunnel is closed once both sides
+    have closed theirs, either fails, or nothing moves for ``TUNNEL_IDLE_TIMEOUT`` seconds.'''
+    def __init__(self):
+        self._added: deque[Tunnel] = deque() # Handed over but not yet polled
+        self._wakeup: socket | None = None # Started with the first tunnel, after any fork
+        self._lock = threading.Lock()
+
+    def add(self, tunnel: Tunnel) -> None:
+        '''Takes over ``tunnel``, which is closed once it's done.'''
+        with self._lock:
+            self._added.append(tunnel)
+            if self._wakeup is None:
+                woken, self._wakeup = socketpair()
+                woken.setblocking(False)
+                self._wakeup.setblocking(False)
+                threading.Thread(target=self._relay, args=[woken], daemon=True).start()
+            wakeup = self._wakeup
+        try:
+            wakeup.send(b'\0')
+        except BlockingIOError:
+            pass # Already due to wake up
+
+    def _relay(self, woken: socket) -> None:
+        poller = select.poll()
+        poller.register(woken, select.POLLIN)
+        owners: dict[int, Tunnel] = {} # Tunnel of each polled socket
+        lastSweep = time.monotonic()
+        while True:
+            ready = {owners.get(fd) for fd, _ in poller.poll(TUNNEL_SWEEP_INTERVAL * 1000)}
+            ready.discard(None)
+            with self._lock:
+                ready.update(self._added)
+                self._added.clear()
+            try:
+                woken.recv(4096)
+            except BlockingIOError:
+                pass
+            for tunnel in ready: self._pump(poller, owners, tunnel)
+            if (now := time.monotonic()) - lastSweep >= TUNNEL_SWEEP_INTERVAL:
+                lastSweep = now
+                for tunnel in {tunnel for tunnel in owners.values() if now - tunnel.lastMoved >= TUNNEL_IDLE_TIMEOUT}:
+                    logging.info("Closing idle tunnel")
+                    self._close(poller, owners, tunnel)
+
+    def _pump(self, poller: select.poll, owners: dict[int, Tunnel], tunnel: Tunnel) -> None:
+        try:
+            events = tunnel.pump()
+        except OSError as e:
+            logging.info(f"Tunnel closed: {e!r}")
+            events = None
+        if events is None:
+            self._close(poller, owners, tunnel)
+            return
+        for fd, mask in events.items():
+            if mask:
+                poller.register(fd, mask)
+                owners[fd] = tunnel
+            elif owners.pop(fd, None): # Nothing to wait for, and a hung up socket would wake every poll
+                poller.unregister(fd)
+
+    def _close(self, poller: select.poll, owners: dict[int, Tunnel], tunnel: Tunnel) -> None:
+        for fd in tunnel.fds: # Before closing, since the descriptors may then be reused
+            if owners.pop(fd, None): poller.unregister(fd)
+        try:
+            tunnel.close()
+        except Exception as e:
+            logging.info(f"Closing tunnel failed: {e!r}")
+
+tunnelRelay = TunnelRelay()
+
+class ConnectionPool:
+    '''Idle persistent server connections, kept per (host, port) for reuse.
+    At most ``maxPerHost`` idle connections are kept for each server, each for at most
+    ``idleTimeout`` seconds.'''
+    def __init__(self, maxPerHost: int = DEFAULT_POOL_MAX_PER_HOST, idleTimeout: float = DEFAULT_POOL_IDLE_TIMEOUT):
+        self.maxPerHost = maxPerHost
+        self.idleTimeout = idleTimeout
+        self.opened = 0 # New connections made
+        self.reused = 0 # Requests sent over a pooled connection
+        self.connectTime = 0.0 # Total seconds spent opening connections
+        self._idle: dict[tuple[bytes, int], list[tuple[socket, float]]] = {}
+        self._lock = threading.Lock()
+        self._lastSweep = time.monotonic()
+
+    def take(self, host: bytes, port: int) -> socket | None:
+        '''Returns an idle connection to ``host``:``port``, or ``None`` if there isn't a usable one.'''
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                idle = self._idle.get((host, port))
+                if not idle: return None
+                skt, idleSince = idle.pop() # Most recently used first
+            if now - idleSince < self.idleTimeout and connection_alive(skt):
+                with self._lock: self.reused += 1
+                return skt
+            skt.close()
+
+    def give(self, host: bytes, port: int, skt: socket) -> None:
+        '''Returns a connection to the pool once its response has been fully read.'''
+        now = time.monotonic()
+        with self._lock:
+            idle = self._idle.setdefault((host, port), [])
+            keep = len(idle) < self.maxPerHost
+            if keep: idle.append((skt, now))
+            expired = self._sweep(now) if now - self._lastSweep > 1 else []
+        if not keep: skt.close()
+        for old in expired: old.close()
+
+    def record_connect(self, elapsed: float) -> None:
+        '''Accounts for a newly opened connection that took ``elapsed`` seconds.'''
+        with self._lock:
+            self.opened += 1
+            self.connectTime += elapsed
+
+    def stats(self) -> dict[str, int | float]:
+        '''Current pool counters. Time saved assumes each reuse avoided an average handshake.'''
+        with self._lock:
+            requests = self.opened + self.reused
+            averageConnect = self.connectTime / self.opened if self.opened else 0.0
+            return {'idle': sum(len(idle) for idle in self._idle.values()), 'opened': self.opened,
+                    'reused': self.reused, 'reuseRatio': round(self.reused / requests, 4) if requests else 0.0,
+                    'averageConnectMs': round(averageConnect * 1000, 3),
+                    'handshakeSavedMs': round(averageConnect * self.reused * 1000, 3)}
+
+    def _sweep(self, now: float) -> list[socket]:
+        '''Removes connections idle for too long. Returns them so they can be closed outside the lock.'''
+        self._lastSweep = now
+        expired = []
+        for key, idle in list(self._idle.items()):
+            expired += [skt for skt, idleSince in idle if now - idleSince >= self.idleTimeout]
+            idle[:] = [(skt, idleSince) for skt, idleSince in idle if now - idleSince < self.idleTimeout]
+            if not idle: del self._idle[key]
+        return expired
+
+connectionPool: ConnectionPool | None = None
+
+class ResolverCache:
+    '''Resolved server addresses, kept per (host, port) for ``ttl`` seconds, and failed lookups,
+    kept for ``negativeTtl`` seconds. At most ``maxEntries`` are kept, least recently used evicted first.
+    Concurrent lookups of the same host share one ``getaddrinfo`` call, like ``RequestCoalescer``.
+    Addresses are returned in the order connections should be attempted (see ``order_addresses``).'''
+    def __init__(self, ttl: float = DEFAULT_DNS_TTL, negativeTtl: float = DEFAULT_DNS_NEGATIVE_TTL,
+                 maxEntries: int = DEFAULT_DNS_ENTRIES):
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.maxEntries = maxEntries
+        self.hits = 0 # Lookups answered from the cache
+        self.negativeHits = 0 # Lookups answered with a remembered failure
+        self.misses = 0 # Lookups that called getaddrinfo
+        self.coalesced = 0 # Lookups that waited for another's getaddrinfo call
+        self.failures = 0 # getaddrinfo calls that failed
+        self.lookupTime = 0.0 # Total seconds spent in getaddrinfo
+        self._entries: OrderedDict[tuple[bytes, int], tuple[list[tuple[int, tuple]] | OSError, float]] = OrderedDict()
+        self._pending: dict[tuple[bytes, int], Future] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def resolve(self, host: bytes, port: int) -> list[tuple[int, tuple]]:
+        '''Returns the ``(family, sockaddr)`` pairs for ``host``:``port``.
+        Raises ``gaierror`` if the host doesn't resolve.'''
+        result, future, leading = self._lookup(host, port)
+        if result is None and not leading: result = future.result()
+        elif leading:
+            start = time.perf_counter()
+            try:
+                result = order_addresses(getaddrinfo(host.decode(), port, 0, SOCK_STREAM))
+            except OSError as e:
+                result = e
+            finally:
+                self._land(host, port, future, result, time.perf_counter() - start)
+        return self._answer(result)
+
+    async def resolve_async(self, host: bytes, port: int) -> list[tuple[int, tuple]]:
+        '''Returns the ``(family, sockaddr)`` pairs for ``host``:``port`` without blocking the event loop.
+        Mirrors ``resolve``.'''
+        result, future, leading = self._lookup(host, port)
+        if result is None and not leading: result = await asyncio.wrap_future(future)
+        elif leading:
+            start = time.perf_counter()
+            try:
+                loop = asyncio.get_running_loop() # Same call as resolve, in the default executor
+                result = order_addresses(await loop.run_in_executor(None, getaddrinfo, host.decode(), port, 0, SOCK_STREAM))
+            except OSError as e:
+                result = e
+            finally:
+                self._land(host, port, future, result, time.perf_counter() - start)
+        return self._answer(result)
+
+    def prewarm(self, hosts: list[tuple[bytes, int]]) -> int:
+        '''Resolves ``hosts`` ahead of their first request, several at a time.
+        Returns how many resolved.'''
+        def resolves(hostPort: tuple[bytes, int]) -> bool:
+            try:
+                return bool(self.resolve(*hostPort))
+            except OSError:
+                return False
+        with ThreadPoolExecutor(DNS_PREWARM_PARALLEL) as pool:
+            return sum(pool.map(resolves, hosts))
+
+    async def prewarm_async(self, hosts: list[tuple[bytes, int]]) -> int:
+        '''Resolves ``hosts`` without blocking the event loop. Mirrors ``prewarm``.'''
+        parallel = asyncio.Semaphore(DNS_PREWARM_PARALLEL)
+        async def resolves(hostPort: tuple[bytes, int]) -> bool:
+            async with parallel:
+                try:
+                    return bool(await self.resolve_async(*hostPort))
+                except OSError:
+                    return False
+        return sum(await asyncio.gather(*map(resolves, hosts)))
+
+    def clear(self) -> None:
+        '''Forgets every resolved host.'''
+        with self._lock: self._entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        '''Current resolver counters. The hit ratio counts remembered failures as hits.'''
+        with self._lock:
+            lookups = self.hits + self.negativeHits + self.misses + self.coalesced
+            return {'entries': len(self._entries), 'hits': self.hits, 'negativeHits': self.negativeHits,
+                    'misses': self.misses, 'coalesced': self.coalesced, 'failures': self.failures,
+                    'hitRatio': round((self.hits + self.negativeHits) / lookups, 4) if lookups else 0.0,
+                    'averageLookupMs': round(self.lookupTime / self.misses * 1000, 3) if self.misses else 0.0}
+
+    def _lookup(self, host: bytes, port: int) -> tuple[list[tuple[int, tuple]] | OSError | None, Future | None, bool]:
+        '''Returns the cached result if there is a live one, otherwise the future of the lookup
+        to wait for and whether the caller has to make that lookup itself.'''
+        key = (host, port)
+        with self._lock:
+            if (entry := self._entries.get(key)) is not None:
+                result, expires = entry
+                if time.monotonic() < expires:
+                    self._entries.move_to_end(key)
+                    if isinstance(result, OSError): self.negativeHits += 1
+                    else: self.hits += 1
+                    return result, None, False
+                del self._entries[key]
+            if (future := self._pending.get(key)) is not None:
+                self.coalesced += 1
+                return None, future, False
+            self.misses += 1
+            future = self._pending[key] = Future()
+            return None, future, True
+
+    def _land(self, host: bytes, port: int, future: Future, result: list[tuple[int, tuple]] | OSError | None,
+              elapsed: float) -> None:
+        '''Records the outcome of a lookup and hands it to the lookups waiting on it.
+        A ``None`` result means the lookup was abandoned; it isn't cached.'''
+        key = (host, port)
+        abandoned = result is None
+        if abandoned: result = gaierror(EAI_AGAIN, "Lookup abandoned")
+        with self._lock:
+            del self._pending[key]
+            self.lookupTime += elapsed
+            failed = isinstance(result, OSError)
+            if failed: self.failures += 1
+            ttl = self.negativeTtl if failed else self.ttl
+            if ttl > 0 and not abandoned:
+                self._entries[key] = (result, time.monotonic() + ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxEntries: self._entries.popitem(last=False)
+        future.set_result(result)
+
+    @staticmethod
+    def _answer(result: list[tuple[int, tuple]] | OSError) -> list[tuple[int, tuple]]:
+        if isinstance(result, OSError): raise type(result)(*result.args) # A fresh error for each caller
+        return result
+
+resolverCache = ResolverCache()
+
+class Blocklist:
+    '''Set of blocked hosts that matches any of them as a substring of a host.
+    Each blocked host is indexed by its first ``BLOCKLIST_PREFIX`` bytes, which map to a bit mask
+    of the lengths of the blocked hosts starting with them. Matching looks the prefix up at each
+    position of the host and checks only those lengths against the set, so it takes about one
+    dictionary lookup per byte of the host however long the list is, and adding a host is a set
+    and a dictionary update. The few hosts shorter than the prefix are checked one by one.
+    A removed host's length bit stays until the next ``replace`` or ``clear``, costing at most
+    a failed set lookup. Matching doesn't lock; ``replace`` builds the new index first and
+    swaps it in whole.'''
+    def __init__(self):
+        self._index = self._build(())
+        self._lock = threading.Lock()
+        self.version = 0 # Changes made so far
+
+    def __len__(self) -> int:
+        return len(self._index[0])
+
+    def __contains__(self, host: bytes) -> bool:
+        return host in self._index[0]
+
+    def __iter__(self):
+        return iter(set(self._index[0]))
+
+    def add(self, host: bytes) -> None:
+        with self._lock:
+            self._insert(host)
+            self.version += 1
+
+    def update(self, hosts) -> None:
+        '''Adds many ``hosts`` at once.'''
+        with self._lock:
+            for host in hosts: self._insert(host)
+            self.version += 1
+
+    def replace(self, hosts) -> None:
+        '''Blocks exactly ``hosts`` from now on.'''
+        index = self._build(hosts)
+        with self._lock:
+            self._index = index
+            self.version += 1
+
+    def remove(self, host: bytes) -> None:
+        with self._lock:
+            hosts, prefixes, short = self._index
+            hosts.discard(host)
+            if host in short: self._index = hosts, prefixes, short - {host}
+            self.version += 1
+
+    def clear(self) -> None:
+        self.replace(())
+
+    def matches(self, host: bytes) -> bool:
+        '''Checks if any blocked host is a substring of ``host``.'''
+        hosts, prefixes, short = self._index
+        for blockedHost in short:
+            if blockedHost in host: return True
+        end = len(host)
+        for start in range(end - BLOCKLIST_PREFIX + 1):
+            lengths = prefixes.get(host[start:start + BLOCKLIST_PREFIX])
+            if lengths is None: continue
+            lengths &= (2 << (end - start)) - 1 # Only those that fit in the rest of the host
+            while lengths:
+                bit = lengths & -lengths
+                lengths ^= bit
+                if host[start:start + bit.bit_length() - 1] in hosts: return True
+        return False
+
+    def _insert(self, host: bytes) -> None:
+        '''Adds ``host`` to the current index. Call with the lock held.'''
+        hosts, prefixes, short = self._index
+        hosts.add(host)
+        if len(host) < BLOCKLIST_PREFIX:
+            if host not in short: self._index = hosts, prefixes, short | {host} # Swapped, as matching iterates it
+        else:
+            prefix = host[:BLOCKLIST_PREFIX]
+            prefixes[prefix] = prefixes.get(prefix, 0) | 1 << len(host)
+
+    @staticmethod
+    def _build(hosts) -> tuple[set[bytes], dict[bytes, int], frozenset[bytes]]:
+        '''A new index of ``hosts``: the set of them, the length masks by prefix, and the short ones.'''
+        hostSet = set(hosts)
+        prefixes: dict[bytes, int] = {}
+        for host in hostSet:
+            if len(host) >= BLOCKLIST_PREFIX:
+                prefix = host[:BLOCKLIST_PREFIX]
+                prefixes[prefix] = prefixes.get(prefix, 0) | 1 << len(host)
+        return hostSet, prefixes, frozenset(host for host in hostSet if len(host) < BLOCKLIST_PREFIX)
+
+requestBlocklist = Blocklist()
+
+class Flight:
+    '''A server fetch in progress that other requests for the same resource wait on.
+    The leader relays the response to its own client and copies it aside with ``capture``,
+    but only if someone joined before the response started arriving, and only up to what the
+    memory cache could hold. Once the fetch lands, ``result`` holds the response for the
+    followers, or ``None`` if they have to get it themselves: if it wasn't captured, or it's
+    not a cacheable 200. If the fetch fails, ``result`` raises its error instead.'''
+    def __init__(self):
+        self.result: Future[bytes | None] = Future()
+        self.followers = 0
+        self._chunks: list[bytes] | None = []
+        self._size = 0
+
+    @property
+    def shareable(self) -> bool:
+        '''Whether the response is still small enough to be handed to the followers.'''
+        return self._chunks is not None
+
+    def capture(self, data: bytes | memoryview) -> None:
+        if self._chunks is None: return
+        if not self._size and not self.followers: # Nobody to share with; later followers can't have the start
+            self._chunks = None
+            return
+        self._size += len(data)
+        if self._size > min(MAX_COALESCED_RESPONSE, responseCache.maxBytes): self._chunks = None
+        else: self._chunks.append(bytes(data))
+
+    def discard(self) -> None:
+        '''Drops the captured response, so the followers fetch it themselves.'''
+        self._chunks = None
+
+    def response(self) -> bytes | None:
+        '''The captured response, if it can be given to other clients.'''
+        if self._chunks is None or not self.followers: return None
+        response = b''.join(self._chunks)
+        responseCode, headers = parse_response_headers(response)
+        return response if responseCode == b'200' and is_cacheable(headers) else None
+
+class RequestCoalescer:
+    '''Lets concurrent requests for the same cache key share a single server fetch.
+    The first request becomes the leader of a ``Flight``; the rest follow it until it lands.'''
+    def __init__(self):
+        self.leaders = 0 # Fetches made on behalf of possibly several requests
+        self.coalesced = 0 # Requests that waited on another request's fetch
+        self.fallbacks = 0 # Of those, requests that had to fetch the response themselves
+        self._flights: dict[bytes, Flight] = {}
+        self._lock = threading.Lock()
+
+    def join(self, key: bytes) -> tuple[Flight, bool]:
+        '''Returns the flight for ``key`` and whether the caller leads it.'''
+        with self._lock:
+            if (flight := self._flights.get(key)) is not None:
+                flight.followers += 1
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+            return flight, True
+
+    def lead(self, key: bytes) -> Flight | None:
+        '''Returns a new flight for ``key`` led by the caller, or ``None`` if one is already in the air.'''
+        with self._lock:
+            if key in self._flights: return None
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+            return flight
+
+    def land(self, key: bytes, flight: Flight, error: BaseException | None = None) -> None:
+        '''Ends ``flight``, handing its response or ``error`` to every follower.'''
+        with self._lock:
+            del self._flights[key]
+        if error is not None:
+            flight.result.set_exception(error)
+            return
+        response = flight.response()
+        if response is None and flight.followers:
+            with self._lock: self.fallbacks += flight.followers
+        flight.result.set_result(response)
+
+    def stats(self) -> dict[str, int]:
+        '''Current coalescing counters.'''
+        with self._lock:
+            return {'inflight': len(self._flights), 'leaders': self.leaders,
+                    'coalesced': self.coalesced, 'coalesceFallbacks': self.fallbacks}
+
+requestCoalescer = RequestCoalescer()
+
+class StatusSink:
+    '''Stands in for a client when a response is only fetched to fill the cache.
+    Keeps the response's status code and discards the rest.'''
+    def __init__(self):
+        self._statusLine = bytearray()
+
+    def __call__(self, data: bytes | memoryview) -> None:
+        if len(self._statusLine) < 12: self._statusLine.extend(data[:12 - len(self._statusLine)])
+
+    @property
+    def ok(self) -> bool:
+        '''Whether the server sent the response or confirmed the cached one.'''
+        return self._statusLine[9:12] in (b'200', b'304')
+
+class CacheRefresher:
+    '''Refreshes stale cached responses on a small pool of background threads, so that clients
+    served them in the meantime don't wait for the server. Only one refresh per cache key is
+    pending at a time, and at most ``maxPending`` overall. Also counts stale responses served.'''
+    def __init__(self, workers: int = DEFAULT_REFRESH_WORKERS, maxPending: int = MAX_PENDING_REFRESHES):
+        self.workers = workers
+        self.maxPending = maxPending
+        self.servedStale = 0 # Stale responses served while they were refreshed
+        self.servedOnError = 0 # Stale responses served in place of a server error
+        self.refreshed = 0 # Refreshes the server answered
+        self.failed = 0 # Refreshes that failed, leaving the stale response cached
+        self.deduplicated = 0 # Refreshes skipped because one was pending for the same key
+        self.dropped = 0 # Refreshes skipped because too many were pending
+        self._pending: set[bytes] = set()
+        self._pool: ThreadPoolExecutor | None = None # Started on first use, after any fork
+        self._lock = threading.Lock()
+
+    def refresh(self, host: bytes, port: int, path: bytes, headers: dict[bytes, bytes], cached: CacheEntry) -> None:
+        '''Accounts for ``cached`` being served stale, and revalidates it in the background
+        with the request ``headers`` unless a refresh is already pending.'''
+        key = get_cache_key(host, port, path)
+        with self._lock:
+            self.servedStale += 1
+            if key in self._pending:
+                self.deduplicated += 1
+                return
+            if len(self._pending) >= self.maxPending:
+                self.dropped += 1
+                return
+            self._pending.add(key)
+            if self._pool is None: self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='refresh')
+        self._pool.submit(self._refresh, key, host, port, path, headers, cached)
+
+    def served_on_error(self) -> None:
+        '''Accounts for a stale response served in place of a server error.'''
+        with self._lock: self.servedOnError += 1
+
+    def stats(self) -> dict[str, int]:
+        '''Current refresh counters.'''
+        with self._lock:
+            return {'servedStale': self.servedStale, 'servedOnError': self.servedOnError,
+                    'pending': len(self._pending), 'refreshed': self.refreshed, 'failed': self.failed,
+                    'deduplicated': self.deduplicated, 'dropped': self.dropped}
+
+    def _refresh(self, key: bytes, host: bytes, port: int, path: bytes, headers: dict[bytes, bytes],
+                 cached: CacheEntry) -> None:
+        sink = StatusSink() # The relay updates the cache itself
+        try:
+            fetch_server_response(sink, host, port, path, headers, cached, staleOnError=False)
+            refreshed = sink.ok
+        except Exception as e:
+            logging.info(f"Refreshing {key.decode()} failed: {e!r}")
+            refreshed = False
+        with self._lock:
+            self._pending.discard(key)
+            if refreshed: self.refreshed += 1
+            else: self.failed += 1
+
+cacheRefresher = CacheRefresher()
+
+class Prefetcher:
+    '''Fetches the resources embedded in cached HTML pages into the cache in the background,
+    before the client asks for them. At most ``budget`` resources are prefetched per page, by
+    ``workers`` threads, with at most ``maxPending`` waiting. Resources already cached and fresh,
+    or being fetched, are skipped. Prefetched keys are remembered so that requests finding them
+    in the cache can be counted as hits.'''
+    def __init__(self, workers: int = DEFAULT_PREFETCH_WORKERS, budget: int = DEFAULT_PREFETCH_BUDGET,
+                 maxPending: int = MAX_PENDING_PREFETCHES):
+        self.workers = workers
+        self.budget = budget
+        self.maxPending = maxPending
+        self.pages = 0 # Pages scanned
+        self.found = 0 # Embedded same-origin resources found in them
+        self.fetched = 0 # Resources prefetched
+        self.skipped = 0 # Resources already cached or being fetched
+        self.dropped = 0 # Resources over a page's budget or the pending limit
+        self.failed = 0 # Prefetches that failed
+        self.hits = 0 # Prefetched resources later requested from the cache
+        self._pending = 0
+        self._prefetched: OrderedDict[bytes, None] = OrderedDict() # Keys prefetched but not yet requested
+        self._pool: ThreadPoolExecutor | None = None # Started on first use, after any fork
+        self._local = threading.local() # Set in prefetching threads, whose pages aren't scanned
+        self._lock = threading.Lock()
+
+    def scan(self, host: bytes, port: int, path: bytes, response: bytes, headers: dict[bytes, bytes]) -> None:
+        '''Schedules prefetches of the resources embedded in ``response``, if it's an HTML page.'''
+        contentType = headers.get(b'content-type', b'').lower()
+        if b'text/html' not in contentType or b'content-encoding' in headers: return
+        if getattr(self._local, 'prefetching', False): return # Don't follow prefetched pages
+        bodyStart = response.find(b'\r\n\r\n') + 4
+        resources = find_embedded_resources(host, port, path, response[bodyStart:bodyStart + MAX_PREFETCH_SCAN])
+        with self._lock:
+            self.pages += 1
+            self.found += len(resources)
+            scheduled = resources[:max(0, min(self.budget, self.maxPending - self._pending))]
+            self.dropped += len(resources) - len(scheduled)
+            self._pending += len(scheduled)
+            if scheduled and self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='prefetch')
+        for resource in scheduled: self._pool.submit(self._prefetch, host, port, resource)
+
+    def claim(self, key: bytes) -> None:
+        '''Accounts for a request finding ``key`` in the cache, which is a hit if it was prefetched.'''
+        with self._lock:
+            if key in self._prefetched:
+                del self._prefetched[key]
+                self.hits += 1
+
+    def stats(self) -> dict[str, int | float]:
+        '''Current prefetch counters.'''
+        with self._lock:
+            return {'pages': self.pages, 'found': self.found, 'pending': self._pending, 'fetched': self.fetched,
+                    'skipped': self.skipped, 'dropped': self.dropped, 'failed': self.failed, 'hits': self.hits,
+                    'hitRatio': round(self.hits / self.fetched, 4) if self.fetched else 0.0,
+                    'workers': self.workers, 'budget': self.budget}
+
+    def _prefetch(self, host: bytes, port: int, path: bytes) -> None:
+        key = get_cache_key(host, port, path)
+        fetched = None # Skipped, unless a fetch is led
+        try:
+            cached = responseCache.peek(key)
+            if cacheEnabled and not (cached and cached.is_fresh()) and (flight := requestCoalescer.lead(key)):
+                sink = StatusSink()
+                self._local.prefetching = True
+                try:
+                    lead_flight(key, flight, sink, host, port, path, {}, cached)
+                finally:
+                    self._local.prefetching = False
+                fetched = sink.ok
+        except Exception as e:
+            logging.info(f"Prefetching {key.decode()} failed: {e!r}")
+            fetched = False
+        with self._lock:
+            self._pending -= 1
+            if fetched is None: self.skipped += 1
+            elif not fetched: self.failed += 1
+            else:
+                self.fetched += 1
+                self._prefetched[key] = None
+                self._prefetched.move_to_end(key)
+                while len(self._prefetched) > MAX_PREFETCHED_TRACKED: self._prefetched.popitem(last=False)
+
+prefetcher = Prefetcher()
+
+class SharedSettings:
+    '''Proxy settings shared by the processes of ``--workers`` mode, so that a settings request
+    takes effect in every worker, not only the one that received it.
+    The flags and a generation counter for the cache and the blocklist are kept in an anonymous
+    shared mapping, created before the workers are forked, behind a generation counter of its own
+    that every change bumps. Clearing the cache bumps its generation; changing the blocklist writes
+    it to ``blocklistFile`` and bumps its generation. Each worker calls ``apply`` before handling a
+    request to catch up with changes made elsewhere; unless the mapping changed, that's a single read.
+    A new blocklist is loaded on a background thread and swapped in when it's ready, while requests
+    go on being checked against the previous one.'''
+    LAYOUT = struct.Struct('=QQQ???dd') # Generation, cache generation, blocklist generation, cache, blocklist
+                                       # and prefetch enabled, stale-while-revalidate and stale-if-error windows
+    GENERATION = struct.Struct('=Q')
 
-def receive_request(client_skt: socket) -> bytes:
-    '''Receives a complete HTTP request from ``client_skt``.'''
-    request: bytes = b''
-    while b'\r\n\r\n' not in request:
-        request += client_skt.recv(2048)
-    return request
+    def __init__(self, directory: str):
+        self.blocklistFile = os.path.join(directory, 'blocklist')
+        self.generation = 0 # Generations this process has caught up with
+        self.cacheGeneration = 0
+        self.blocklistGeneration = 0
+        self._segment = mmap.mmap(-1, self.LAYOUT.size) # Shared with forked children
+        self._reloadLock = threading.Lock() # Serializes changes to the blocklist; taken first
+        self._lock = threading.RLock() # Guards the generations this process has caught up with; taken next
+        self._processLock = multiprocessing.RLock() # Guards the mapping; taken last
+        self._reloading = False # Whether a blocklist reload thread is running
+        self.LAYOUT.pack_into(self._segment, 0, 0, 0, 0, cacheEnabled, blocklistEnabled, prefetchEnabled,
+                              staleWhileRevalidate, staleIfError)
 
-def parse_request(message: bytes) -> tuple[ParseError, bytes, int, bytes, dict[bytes, bytes]]:
+    def apply(self) -> None:
+        '''Adopts the settings most recently published by any worker.'''
+        global cacheEnabled, blocklistEnabled, prefetchEnabled, staleWhileRevalidate, staleIfError
+        if self.GENERATION.unpack_from(self._segment)[0] == self.generation: return # Nothing new
+        with self._lock:
+            (generation, cacheGeneration, blocklistGeneration, cacheEnabled, blocklistEnabled, prefetchEnabled,
+             staleWhileRevalidate, staleIfError) = self._read()
+            self.generation = generation
+            if cacheGeneration != self.cacheGeneration:
+                responseCache.clear()
+                if diskCache is not None: diskCache.forget()
+                self.cacheGeneration = cacheGeneration
+            if blocklistGeneration != self.blocklistGeneration and not self._reloading:
+                self._reloading = True
+                threading.Thread(target=self._reload_blocklist, daemon=True).start()
+
+    @contextmanager
+    def update(self):
+        '''Publishes the settings changes made in this process while the context is active.
+        Changes from different workers are serialized, so none of them is lost.'''
+        with self._reloadLock, self._lock, self._processLock:
+            self.apply()
+            self._catch_up_blocklist() # Changes must start from the latest blocklist
+            flushes, blocklistVersion = responseCache.flushes, requestBlocklist.version
+            yield
+            generation, cacheGeneration, blocklistGeneration, *_ = self._read()
+            if responseCache.flushes != flushes:
+                cacheGeneration = self.cacheGeneration = cacheGeneration + 1
+            if requestBlocklist.version != blocklistVersion:
+                write_blocklist(self.blocklistFile)
+                blocklistGeneration = self.blocklistGeneration = blocklistGeneration + 1
+            self.generation = generation + 1
+            self.LAYOUT.pack_into(self._segment, 0, self.generation, cacheGeneration, blocklistGeneration,
+                                  cacheEnabled, blocklistEnabled, prefetchEnabled, staleWhileRevalidate, staleIfError)
+
+    def _read(self) -> tuple:
+        with self._processLock: return self.LAYOUT.unpack_from(self._segment)
+
+    def _reload_blocklist(self) -> None:
+        with self._reloadLock: self._catch_up_blocklist()
+
+    def _catch_up_blocklist(self) -> None:
+        '''Reloads the blocklist until it's the latest published one. Call with ``_reloadLock`` held.'''
+        while True:
+            with self._lock:
+                blocklistGeneration = self._read()[2]
+                if blocklistGeneration == self.blocklistGeneration:
+                    self._reloading = False
+                    return
+            requestBlocklist.replace(read_blocklist(self.blocklistFile))
+            with self._lock: self.blocklistGeneration = blocklistGeneration
+
+sharedSettings: SharedSettings | None = None
+
+class LatencyHistogram:
+    '''Latencies counted in buckets whose upper bounds are powers of two microseconds,
+    so recording one is a single increment and percentiles are exact to within a factor of two.'''
+    BUCKETS = 32 # The last bucket takes everything over half an hour
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0 # Seconds
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        bucket = min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max: self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        '''Upper bound in seconds of the bucket holding the ``pct`` percentile, capped at the maximum.'''
+        rank = self.count * pct / 100
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count: return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def summary(self) -> dict[str, int | float]:
+        with self._lock:
+            mean = self.total / self.count if self.count else 0.0
+            return {'count': self.count, 'meanMs': round(mean * 1000, 3),
+                    'p50Ms': round(self.percentile(50) * 1000, 3), 'p90Ms': round(self.percentile(90) * 1000, 3),
+                    'p99Ms': round(self.percentile(99) * 1000, 3), 'maxMs': round(self.max * 1000, 3)}
+
+class Metrics:
+    '''Counters and per-stage latency histograms of the requests handled, served at ``/proxy/stats``.
+    Stages are timed where they happen: ``receive`` and ``parse`` (which includes ``blocklist``)
+    once per request received, ``cache`` per lookup, ``connect`` per new server connection, ``transfer``
+    as the time spent waiting on the server per fetch and ``send`` as the time spent writing to
+    the client per request.'''
+    STAGES = ('receive', 'parse', 'blocklist', 'cache', 'connect', 'transfer', 'send')
+
+    def __init__(self):
+        self.stages = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.started = time.monotonic()
+        self.connections = 0 # Clients accepted
+        self.active = 0 # Clients currently being served
+        self.tunnels = 0 # CONNECT tunnels closed
+        self.bytesFromClients = 0
+        self.bytesFromServers = 0
+        self.bytesToClients = 0
+        self.rejections: dict[str, int] = {} # Error responses by status
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.stages[stage].record(seconds)
+
+    def opened(self) -> None:
+        '''Accounts for a client connection being accepted.'''
+        with self._lock:
+            self.connections += 1
+            self.active += 1
+
+    def closed(self, fromClient: int, toClient: int, sendTime: float) -> None:
+        '''Accounts for a client connection being done, after reading ``fromClient`` bytes from it
+        and spending ``sendTime`` seconds writing ``toClient`` bytes to it.'''
+        with self._lock:
+            self.active -= 1
+            self.bytesFromClients += fromClient
+            self.bytesToClients += toClient
+        if toClient: self.record('send', sendTime)
+
+    def fetched(self, received: int, seconds: float) -> None:
+        '''Accounts for a server fetch that received ``received`` bytes, waiting ``seconds`` for the server.'''
+        with self._lock: self.bytesFromServers += received
+        self.record('transfer', seconds)
+
+    def tunneled(self, fromClient: int, fromServer: int) -> None:
+        '''Accounts for a CONNECT tunnel that relayed ``fromClient`` bytes to the server and ``fromServer`` back.'''
+        with self._lock:
+            self.tunnels += 1
+            self.bytesFromClients += fromClient
+            self.bytesFromServers += fromServer
+            self.bytesToClients += fromServer
+
+    def reject(self, status: str) -> None:
+        '''Accounts for a request answered with the error ``status``.'''
+        with self._lock: self.rejections[status] = self.rejections.get(status, 0) + 1
+
+    def snapshot(self) -> dict:
+        '''Every counter and stage summary, in a JSON-serializable form.'''
+        cacheStats = responseCache.stats()
+        hits, misses = cacheStats['hits'], cacheStats['misses']
+        if diskCache is not None: # Memory misses go on to the disk tier
+            hits, misses = hits + diskCache.hits, diskCache.misses
+        with self._lock:
+            counters = {'uptime': round(time.monotonic() - self.started, 3), 'connections': self.connections,
+                        'active': self.active, 'tunnels': self.tunnels, 'bytesFromClients': self.bytesFromClients,
+                        'bytesFromServers': self.bytesFromServers, 'bytesToClients': self.bytesToClients,
+                        'cacheHitRatio': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+                        'rejections': {status.split()[0]: count for status, count in self.rejections.items()}}
+        return counters | {'stages': {stage: histogram.summary() for stage, histogram in self.stages.items()}}
+
+    def text(self) -> str:
+        '''The snapshot as ``name: value`` lines.'''
+        snapshot = self.snapshot()
+        rejections, stages = snapshot.pop('rejections'), snapshot.pop('stages')
+        lines = [f"{name}: {value}" for name, value in snapshot.items()]
+        lines += [f"rejected {status}: {count}" for status, count in rejections.items()]
+        lines += [f"{stage} {name}: {value}" for stage, summary in stages.items() for name, value in summary.items()]
+        return ''.join(line + '\r\n' for line in lines)
+
+metrics = Metrics()
+
+class MeteredSend:
+    '''Wraps the function that sends to a client, counting the bytes sent and the time it took.'''
+    def __init__(self, send: Callable[[bytes], object]):
+        self.send = send
+        self.sent = 0
+        self.seconds = 0.0
+
+    def __call__(self, data: bytes | memoryview) -> None:
+        start = time.perf_counter()
+        self.send(data)
+        self.seconds += time.perf_counter() - start
+        self.sent += len(data)
+
+class MeteredWriter:
+    '''Wraps a client ``StreamWriter``, counting the bytes written and the time spent draining them.
+    Mirrors ``MeteredSend``.'''
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.sent = 0
+        self.seconds = 0.0
+
+    def __getattr__(self, name: str):
+        return getattr(self.writer, name)
+
+    def write(self, data: bytes) -> None:
+        self.writer.write(data)
+        self.sent += len(data)
+
+    async def drain(self) -> None:
+        start = time.perf_counter()
+        await self.writer.drain()
+        self.seconds += time.perf_counter() - start
+
+    async def sendfile(self, file, count: int) -> None:
+        '''Sends the first ``count`` bytes of ``file`` without copying them through Python.'''
+        await self.drain()
+        start = time.perf_counter()
+        await asyncio.get_running_loop().sendfile(self.writer.transport, file, 0, count)
+        self.seconds += time.perf_counter() - start
+        self.sent += count
+
+class AdmissionQueue:
+    '''Accepted clients waiting for a worker, taken round-robin by client address so that one
+    client opening many connections can't starve the others. At most ``maxQueued`` clients wait
+    at once. When full, a newcomer displaces the newest client of the address with the most
+    clients waiting, if that address has more waiting than the newcomer's would; otherwise
+    the newcomer is turned away. Not thread-safe by itself.'''
+    def __init__(self, maxQueued: int = DEFAULT_MAX_QUEUED):
+        self.maxQueued = maxQueued
+        self.size = 0
+        self._waiting: OrderedDict[str, deque[tuple[object, float]]] = OrderedDict() # In turn order
+
+    def __len__(self) -> int:
+        return self.size
+
+    def put(self, address: str, client: object) -> object | None:
+        '''Queues ``client``, connected from ``address``.
+        Returns the client turned away to keep the queue bounded, if any, which may be ``client``.'''
+        displaced = None
+        if self.size >= self.maxQueued:
+            heaviest = max(self._waiting, key=lambda waiting: len(self._waiting[waiting]), default=None)
+            if heaviest is None or len(self._waiting[heaviest]) <= len(self._waiting.get(address, ())) + 1:
+                return client
+            displaced, _ = self._waiting[heaviest].pop()
+            if not self._waiting[heaviest]: del self._waiting[heaviest]
+            self.size -= 1
+        self._waiting.setdefault(address, deque()).append((client, time.monotonic()))
+        self.size += 1
+        return displaced
+
+    def pop(self) -> tuple[object, float] | None:
+        '''Takes the longest waiting client of the next address in turn.
+        Returns it with the time it was queued, or ``None`` if no client is waiting.'''
+        if not self._waiting: return None
+        address, waiting = next(iter(self._waiting.items()))
+        item = waiting.popleft()
+        if waiting: self._waiting.move_to_end(address)
+        else: del self._waiting[address]
+        self.size -= 1
+        return item
+
+    def expire(self, maxAge: float) -> list[object]:
+        '''Removes and returns the clients that have been waiting longer than ``maxAge`` seconds.'''
+        cutoff = time.monotonic() - maxAge
+        expired = []
+        for address, waiting in list(self._waiting.items()):
+            while waiting and waiting[0][1] < cutoff:
+                expired.append(waiting.popleft()[0])
+            if not waiting: del self._waiting[address]
+        self.size -= len(expired)
+        return expired
+
+class Admission:
+    '''Admission control in front of the client handlers: at most ``maxConcurrency`` clients are
+    handled at once and the rest wait in an ``AdmissionQueue``. Clients that can't be queued, or
+    that wait longer than ``maxQueueTime`` seconds, are promptly sent a 503 with ``Retry-After``
+    rather than piling up, so overload shows as fast rejections instead of ever growing latency.'''
+    def __init__(self, maxConcurrency: int, maxQueued: int = DEFAULT_MAX_QUEUED,
+                 maxQueueTime: float = DEFAULT_MAX_QUEUE_TIME):
+        self.maxConcurrency = maxConcurrency
+        self.maxQueueTime = maxQueueTime
+        self.queue = AdmissionQueue(maxQueued)
+        self.active = 0 # Clients being handled
+        self.admitted = 0
+        self.shedFull = 0 # Turned away because the queue was full
+        self.shedLate = 0 # Turned away after waiting too long
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict[str, int | float]:
+        '''Current admission counters.'''
+        with self._lock:
+            return {'active': self.active, 'queued': len(self.queue), 'admitted': self.admitted,
+                    'shedQueueFull': self.shedFull, 'shedQueueTime': self.shedLate,
+                    'maxConcurrency': self.maxConcurrency, 'maxQueued': self.queue.maxQueued,
+                    'maxQueueTimeMs': round(self.maxQueueTime * 1000, 3)}
+
+    def _shed(self, count: int, late: bool) -> None:
+        '''Accounts for ``count`` clients turned away. Call with the lock held.'''
+        if late: self.shedLate += count
+        else: self.shedFull += count
+        for _ in range(count): metrics.reject("503 Service Unavailable")
+
+class ThreadAdmission(Admission):
+    '''``Admission`` for the threaded engine, handing clients to a fixed pool of worker threads.'''
+    def __init__(self, maxConcurrency: int = MAX_THREADS, maxQueued: int = DEFAULT_MAX_QUEUED,
+                 maxQueueTime: float = DEFAULT_MAX_QUEUE_TIME):
+        super().__init__(maxConcurrency, maxQueued, maxQueueTime)
+        self._ready = threading.Semaphore(0) # Released once per client queued
+        self._lastSweep = time.monotonic()
+
+    def start(self, handle: Callable[[socket], None]) -> None:
+        '''Starts the worker threads, which pass each admitted client to ``handle``.'''
+        for _ in range(self.maxConcurrency):
+            threading.Thread(target=self._work, args=[handle], daemon=True).start()
+
+    def submit(self, address: str, client_skt: socket) -> None:
+        '''Queues a newly accepted client for the next free worker.'''
+        with self._lock:
+            turnedAway = self.queue.put(address, client_skt)
+            if turnedAway is not None: self._shed(1, late=False)
+        if turnedAway is None: self._ready.release()
+        else: reject_overloaded(turnedAway)
+
+    def sweep(self) -> None:
+        '''Turns away clients that have waited too long, without waiting for a worker to free up.
+        Does nothing if the last sweep was less than ``ADMISSION_SWEEP_INTERVAL`` ago.'''
+        now = time.monotonic()
+        if now - self._lastSweep < ADMISSION_SWEEP_INTERVAL: return
+        self._lastSweep = now
+        with self._lock:
+            expired = self.queue.expire(self.maxQueueTime)
+            self._shed(len(expired), late=True)
+        for client_skt in expired: reject_overloaded(client_skt)
+
+    def _work(self, handle: Callable[[socket], None]) -> None:
+        while True:
+            self._ready.acquire()
+            with self._lock:
+                if (item := self.queue.pop()) is None: continue # Already swept
+                client_skt, queuedAt = item
+                late = time.monotonic() - queuedAt > self.maxQueueTime
+                if late: self._shed(1, late=True)
+                else:
+                    self.active += 1
+                    self.admitted += 1
+            if late:
+                reject_overloaded(client_skt)
+                continue
+            try:
+                handle(client_skt)
+            except Exception:
+                logging.exception("Client handler failed")
+            finally:
+                with self._lock: self.active -= 1
+
+class AsyncAdmission(Admission):
+    '''``Admission`` for the async engine, bounding how many client handler tasks run at once.
+    Only driven from the event loop, but the counters and queue are still changed under the lock,
+    since ``stats`` may be read from other threads.'''
+    def __init__(self, maxConcurrency: int = MAX_ASYNC_CLIENTS, maxQueued: int = DEFAULT_MAX_QUEUED,
+                 maxQueueTime: float = DEFAULT_MAX_QUEUE_TIME):
+        super().__init__(maxConcurrency, maxQueued, maxQueueTime)
+        self.handle: Callable[[asyncio.StreamReader, asyncio.StreamWriter], object] | None = None
+        self._sweeper: asyncio.Task | None = None
+
+    def start(self, handle: Callable[[asyncio.StreamReader, asyncio.StreamWriter], object]) -> None:
+        '''Passes each admitted client to the coroutine function ``handle`` from now on.
+        Call from the event loop.'''
+        self.handle = handle
+        self._sweeper = asyncio.get_running_loop().create_task(self._sweep_forever())
+
+    def submit(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        '''Starts handling a newly accepted client, or queues it if too many are being handled.
+        Used as the ``asyncio.start_server`` callback.'''
+        with self._lock:
+            admitted = self.active < self.maxConcurrency
+            if admitted: self._admit()
+            else:
+                turnedAway = self.queue.put(writer.get_extra_info('peername')[0], (reader, writer))
+                if turnedAway is not None: self._shed(1, late=False)
+        if admitted: self._start(reader, writer)
+        elif turnedAway is not None: reject_overloaded_async(*turnedAway)
+
+    async def _sweep_forever(self) -> None:
+        '''Turns away clients that have waited too long, without waiting for a handler to finish.'''
+        while True:
+            await asyncio.sleep(ADMISSION_SWEEP_INTERVAL)
+            with self._lock:
+                expired = self.queue.expire(self.maxQueueTime)
+                self._shed(len(expired), late=True)
+            for reader, writer in expired: reject_overloaded_async(reader, writer)
+
+    def _admit(self) -> None:
+        '''Accounts for a client about to be handled. Call with the lock held.'''
+        self.active += 1
+        self.admitted += 1
+
+    def _start(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        asyncio.get_running_loop().create_task(self._run(reader, writer))
+
+    async def _run(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            await self.handle(reader, writer)
+        finally:
+            late, admitted = [], None
+            with self._lock:
+                self.active -= 1
+                while (item := self.queue.pop()) is not None: # Hand the slot to the next waiting client
+                    client, queuedAt = item
+                    if time.monotonic() - queuedAt <= self.maxQueueTime:
+                        self._admit()
+                        admitted = client
+                        break
+                    self._shed(1, late=True)
+                    late.append(client)
+            for client in late: reject_overloaded_async(*client)
+            if admitted is not None: self._start(*admitted)
+
+admission: Admission | None = None
+
+class RequestReader:
+    '''Accumulates an HTTP request head as it arrives.
+    Each piece is scanned for the end of the head once, resuming where the last scan stopped
+    (less the three bytes a split ``\\r\\n\\r\\n`` could start with), rather than rescanning
+    everything received so far. Heads over ``maxSize`` bytes are refused.'''
+    def __init__(self, maxSize: int = MAX_REQUEST_HEAD):
+        self.maxSize = maxSize
+        self.buffer = bytearray()
+        self.end = -1 # Offset just past the head, once it's complete
+
+    @property
+    def complete(self) -> bool:
+        return self.end >= 0
+
+    @property
+    def overflowed(self) -> bool:
+        return len(self.buffer) > self.maxSize if self.end < 0 else self.end > self.maxSize
+
+    def feed(self, data: bytes | memoryview) -> bool:
+        '''Adds ``data`` received from the client. Returns ``True`` once no more is needed:
+        the head is complete or too large.'''
+        scanFrom = max(0, len(self.buffer) - 3)
+        self.buffer += data
+        if (end := self.buffer.find(b'\r\n\r\n', scanFrom)) >= 0: self.end = end + 4
+        return self.complete or self.overflowed
+
+    def head(self) -> memoryview:
+        '''The complete request head, without anything the client sent after it.'''
+        return memoryview(self.buffer)[:self.end]
+
+    def rest(self) -> memoryview:
+        '''Whatever the client sent after the complete request head.'''
+        return memoryview(self.buffer)[self.end:]
+
+def receive_request(client_skt: socket, timeout: float | None = None,
+                    reader: RequestReader | None = None) -> tuple[ParseError | None, memoryview]:
+    '''Receives a complete HTTP request head from ``client_skt``, into ``reader`` if one is given.
+    Returns ``ParseError.TIMEOUT`` if it takes longer than ``timeout`` seconds (``requestTimeout``
+    by default) and ``ParseError.TOOLARGE`` if it's over ``MAX_REQUEST_HEAD`` bytes.
+    Raises ``ConnectionError`` if the client closes the connection first.'''
+    deadline = time.monotonic() + (requestTimeout if timeout is None else timeout)
+    if reader is None: reader = RequestReader()
+    buffer = bytearray(REQUEST_RECV_SIZE)
+    view = memoryview(buffer)
+    try:
+        while True:
+            if (remaining := deadline - time.monotonic()) <= 0: return ParseError.TIMEOUT, view[:0]
+            client_skt.settimeout(remaining)
+            if not (n := client_skt.recv_into(buffer)):
+                raise ConnectionError("Client closed the connection before completing its request")
+            if reader.feed(view[:n]): break
+    except TimeoutError:
+        return ParseError.TIMEOUT, view[:0]
+    finally:
+        client_skt.settimeout(None)
+    if reader.overflowed: return ParseError.TOOLARGE, view[:0]
+    return None, reader.head()
+
+def parse_request(message: bytes | memoryview) -> tuple[ParseError, bytes, int, bytes, dict[bytes, bytes]]:
     '''Parses a received HTTP request and extracts host, port, path, and headers.
+    The path is ``None`` for a ``CONNECT`` request, which asks for a tunnel to host:port.
     Returns a ``ParseError`` if the request is malformed or can't be processed.'''
     host, port, path, headers = None, None, None, None
 
     try:
         # Parse header into basic tokens
-        message_tokens = message.split(maxsplit=3)
-        assert len(message_tokens) >= 3
+        message_match = REQUEST_PATTERN.fullmatch(message)
+        assert message_match
+        message_tokens = message_match.groups()
 
         # Check method
         method = message_tokens[0]
-        assert method in [b'GET', b'HEAD', b'OPTIONS', b'TRACE', b'PUT', b'DELETE', b'POST', b'PATCH', b'CONNECT']
-        if method != b'GET':
+        assert method in REQUEST_METHODS
+        if method != b'GET' and method != b'CONNECT':
             return ParseError.NOTIMPL, None, None, None, None
         # logging.debug("Parsed method")
         
         # Parse URL
         url = message_tokens[1]
-        url_match = re.fullmatch(rb"http:\/\/([^:]+?)(?::(\d+)|)(/.*)", url)
-        assert url_match
-        host = url_match[1]
-        port = int(url_match[2]) if url_match[2] else 80
-        path = url_match[3]
+        if method == b'CONNECT': # Tunnel to host:port; there's no path
+            url_match = AUTHORITY_PATTERN.fullmatch(url)
+            assert url_match
+            host, port, path = url_match[1], int(url_match[2]), None
+        else:
+            url_match = URL_PATTERN.fullmatch(url)
+            assert url_match
+            host = url_match[1]
+            port = int(url_match[2]) if url_match[2] else 80
+            path = url_match[3]
         if host_blocked(host):
             return ParseError.FORBID, None, None, None, None
         # logging.debug("Parsed URL")
 
         # Check protocol
-        assert message_tokens[2] == b'HTTP/1.0'
+        assert message_tokens[2] == b'HTTP/1.0' or method == b'CONNECT' and message_tokens[2] == b'HTTP/1.1' # Clients tunnel with either
         # logging.debug("Parsed protocol")
 
         # Parse headers
         headers = {}
-        if len(message_tokens) == 4: # Additional headers exist
+        if message_tokens[3]: # Additional headers exist
             # logging.debug("Detected headers")
-            message_headers = message_tokens[-1].split(b'\r\n')
+            message_headers = message_tokens[3].split(b'\r\n')
             for header_line in message_headers:
                 if not header_line: break # ignore trailing empty string
-                assert re.match(rb'\S+: .+', header_line)
-                mh_key, mh_value = (i.strip() for i in header_line.split(b': ', maxsplit=1))
-                headers[mh_key] = mh_value
+                assert HEADER_PATTERN.match(header_line)
+                mh_key, _, mh_value = header_line.partition(b': ')
+                headers[mh_key.strip()] = mh_value.strip()
         # logging.debug("Parsed headers")
 
     except AssertionError:
@@ -88,93 +2069,499 @@ def parse_request(message: bytes) -> tuple[ParseError, bytes, int, bytes, dict[b
     else:
         return None, host, port, path, headers
     
-def parse_settings(path: bytes) -> bool:
+def parse_settings(path: bytes) -> bytes | None:
     '''Parses proxy settings request from the request path.
-    Returns ``True`` if settings were modified.'''
-    global cacheEnabled, blocklistEnabled
+    Returns the response for the client if ``path`` is a settings request, otherwise ``None``.'''
+    global cacheEnabled, blocklistEnabled, staleWhileRevalidate, staleIfError, prefetchEnabled
     
-    if path == b'/proxy/cache/enable': cacheEnabled = True
-    elif path == b'/proxy/cache/disable': cacheEnabled = False
-    elif path == b'/proxy/cache/flush': responseCache.clear()
-    elif path == b'/proxy/blocklist/enable': blocklistEnabled = True
-    elif path == b'/proxy/blocklist/disable': blocklistEnabled = False
-    elif path == b'/proxy/blocklist/flush': requestBlocklist.clear()
-    elif path.startswith(b'/proxy/blocklist/add/'): 
-        blockedHost = path.removeprefix(b'/proxy/blocklist/add/')
-        add_to_blocklist(blockedHost)
-    elif path.startswith(b'/proxy/blocklist/remove/'):
-        blockedHost = path.removeprefix(b'/proxy/blocklist/remove/')
-        remove_from_blocklist(blockedHost)
-    else: return False
+    if path == b'/proxy/cache/stats':
+        stats = ''.join(f"{name}: {value}\r\n" for name, value in responseCache.stats().items())
+        if diskCache is not None: stats += ''.join(f"disk {name}: {value}\r\n" for name, value in diskCache.stats().items())
+        stats += f"staleWhileRevalidate: {staleWhileRevalidate:g}\r\nstaleIfError: {staleIfError:g}\r\n"
+        stats += ''.join(f"stale {name}: {value}\r\n" for name, value in cacheRefresher.stats().items())
+        return status_code_response("200 OK", stats.encode())
+    elif path == b'/proxy/stats':
+        return status_code_response("200 OK", metrics.text().encode())
+    elif path == b'/proxy/stats/json':
+        return status_code_response("200 OK", json.dumps(metrics.snapshot()).encode(), 'application/json')
+    elif path == b'/proxy/admission/stats':
+        if admission is None: return status_code_response("200 OK", b"admission: disabled\r\n")
+        stats = ''.join(f"{name}: {value}\r\n" for name, value in admission.stats().items())
+        return status_code_response("200 OK", stats.encode())
+    elif path == b'/proxy/coalesce/stats':
+        stats = ''.join(f"{name}: {value}\r\n" for name, value in requestCoalescer.stats().items())
+        return status_code_response("200 OK", stats.encode())
+    elif path == b'/proxy/pool/stats':
+        if connectionPool is None: return status_code_response("200 OK", b"pool: disabled\r\n")
+        stats = ''.join(f"{name}: {value}\r\n" for name, value in connectionPool.stats().items())
+        return status_code_response("200 OK", stats.encode())
+    elif path == b'/proxy/prefetch/stats':
+        stats = f"prefetch: {'enabled' if prefetchEnabled else 'disabled'}\r\n"
+        stats += ''.join(f"{name}: {value}\r\n" for name, value in prefetcher.stats().items())
+        return status_code_response("200 OK", stats.encode())
+    elif path == b'/proxy/dns/stats':
+        stats = ''.join(f"{name}: {value}\r\n" for name, value in resolverCache.stats().items())
+        return status_code_response("200 OK", stats.encode())
+    elif path == b'/proxy/dns/flush': # Resolved hosts are per process, even with --workers
+        resolverCache.clear()
+        return status_code_response("200 OK")
+    elif path.startswith(DNS_PREWARM_PATH):
+        try:
+            hostPort = parse_host_port(path.removeprefix(DNS_PREWARM_PATH))
+        except ValueError:
+            return status_code_response(ParseError.BADREQ.value)
+        return status_code_response("200 OK", f"resolved: {resolverCache.prewarm([hostPort])}\r\n".encode())
+    elif not path.startswith(b'/proxy/'): return None
+
+    with sharedSettings.update() if sharedSettings is not None else nullcontext(): # Reach every worker
+        if path == b'/proxy/cache/enable': cacheEnabled = True
+        elif path == b'/proxy/cache/disable': cacheEnabled = False
+        elif path == b'/proxy/cache/flush': clear_cache()
+        elif path.startswith(b'/proxy/cache/stale-while-revalidate/'):
+            seconds = parse_delta_seconds(path.removeprefix(b'/proxy/cache/stale-while-revalidate/'))
+            if seconds is None: return status_code_response(ParseError.BADREQ.value)
+            staleWhileRevalidate = seconds
+        elif path.startswith(b'/proxy/cache/stale-if-error/'):
+            seconds = parse_delta_seconds(path.removeprefix(b'/proxy/cache/stale-if-error/'))
+            if seconds is None: return status_code_response(ParseError.BADREQ.value)
+            staleIfError = seconds
+        elif path == b'/proxy/prefetch/enable': prefetchEnabled = True
+        elif path == b'/proxy/prefetch/disable': prefetchEnabled = False
+        elif path == b'/proxy/blocklist/enable': blocklistEnabled = True
+        elif path == b'/proxy/blocklist/disable': blocklistEnabled = False
+        elif path == b'/proxy/blocklist/flush': requestBlocklist.clear()
+        elif path.startswith(b'/proxy/blocklist/add/'): 
+            blockedHost = path.removeprefix(b'/proxy/blocklist/add/')
+            add_to_blocklist(blockedHost)
+        elif path.startswith(b'/proxy/blocklist/remove/'):
+            blockedHost = path.removeprefix(b'/proxy/blocklist/remove/')
+            remove_from_blocklist(blockedHost)
+        else: return None
     logging.info(f"Settings updated: {path.decode()}")
-    return True
+    return status_code_response("200 OK")
 
-def request_server(host: bytes, port: int, path: bytes, headers: dict[bytes, bytes]) -> bytes:
-    '''Fetches the requested resource from the server.
-    If caching is enabled, reads from and updates cache appropriately.'''
+def build_server_request(host: bytes, port: int, path: bytes, headers: dict[bytes, bytes], cached: CacheEntry | None,
+                         keepAlive: bool = False) -> bytes:
+    '''Constructs the GET request sent to the server.
+    If ``cached`` is given, the request revalidates it. With ``keepAlive``, the request
+    is sent as HTTP/1.1 and asks the server to keep the connection open.'''
     # Construct headers
-    headers[b'Host'] = host
-    headers[b'Connection'] = b'close'
-    if cached_obj := fetch_from_cache(host, port, path):
-        headers[b'If-Modified-Since'] = get_modified_date()
+    headers = {headkey: headval for headkey, headval in headers.items() if headkey.lower() not in HOP_BY_HOP_HEADERS}
+    headers[b'Host'] = host if port == 80 else b'%s:%d' % (host, port)
+    headers[b'Connection'] = b'keep-alive' if keepAlive else b'close'
+    if cached and (validator := cached.validator()):
+        headers[b'If-Modified-Since'] = validator
     
     # Construct GET header string
-    header_str = f"GET {path.decode()} HTTP/1.0\r\n"
+    header_str = f"GET {path.decode()} HTTP/1.{int(keepAlive)}\r\n"
     for headkey, headval in headers.items():
         header_str += f"{headkey.decode()}: {headval.decode()}\r\n"
     header_str += "\r\n"
     # logging.debug(header_str)
-    
-    # Connect to server and receive response
-    with socket(AF_INET, SOCK_STREAM) as server_skt:
+    return header_str.encode()
+
+def downgrade_response_head(head: bytes) -> bytes:
+    '''Rewrites an HTTP/1.1 response head for an HTTP/1.0 client, dropping hop-by-hop
+    headers such as ``Transfer-Encoding`` (the body is relayed decoded).'''
+    lines = head.split(b'\r\n')
+    statusLine = b'HTTP/1.0' + lines[0][8:] if lines[0].startswith(b'HTTP/1.1') else lines[0]
+    kept = [header_line for header_line in lines[1:]
+            if header_line and header_line.split(b':', 1)[0].strip().lower() not in HOP_BY_HOP_HEADERS]
+    return b'\r\n'.join([statusLine, *kept]) + b'\r\n\r\n'
+
+def connection_alive(skt: socket) -> bool:
+    '''Checks that an idle server connection hasn't been closed by the server.'''
+    try:
+        skt.recv(1, MSG_PEEK | MSG_DONTWAIT) # Closed, or unsolicited data that makes it unusable
+        return False
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+
+def order_addresses(addrinfo: list[tuple]) -> list[tuple[int, tuple]]:
+    '''Orders ``getaddrinfo`` results for connection attempts, alternating between address
+    families starting with the first one returned
+    ([RFC 8305, 4](https://www.rfc-editor.org/rfc/rfc8305#section-4)). Duplicates are dropped.'''
+    byFamily: dict[int, list[tuple[int, tuple]]] = {}
+    for family, _, _, _, sockaddr in addrinfo:
+        addresses = byFamily.setdefault(family, [])
+        if (family, sockaddr) not in addresses: addresses.append((family, sockaddr))
+    ordered = []
+    for i in range(max(map(len, byFamily.values()), default=0)):
+        ordered += [addresses[i] for addresses in byFamily.values() if i < len(addresses)]
+    return ordered
+
+def open_connection(addresses: list[tuple[int, tuple]], delay: float = HAPPY_EYEBALLS_DELAY) -> socket:
+    '''Connects to whichever of ``addresses`` accepts first, Happy Eyeballs style
+    ([RFC 8305, 5](https://www.rfc-editor.org/rfc/rfc8305#section-5)): the next address is tried
+    ``delay`` seconds after the last attempt started, or as soon as it fails, while earlier
+    attempts keep going. Returns a blocking socket; raises the first error if every attempt fails.'''
+    if len(addresses) == 1: # Nothing to race
+        family, sockaddr = addresses[0]
+        skt = socket(family, SOCK_STREAM)
         try:
-            server_skt.connect((host, port))
+            skt.connect(sockaddr)
         except:
-            logging.info(f"Unable to connect to {host.decode()}:{port}")
-            return status_code_response(ParseError.BADREQ.value)
-        server_skt.send(header_str.encode())
+            skt.close()
+            raise
+        return skt
+    errors: list[OSError] = []
+    remaining = deque(addresses)
+    nextAttempt = 0.0
+    with selectors.DefaultSelector() as selector:
+        try:
+            while True:
+                now = time.monotonic()
+                if remaining and (now >= nextAttempt or not selector.get_map()):
+                    family, sockaddr = remaining.popleft()
+                    try:
+                        skt = socket(family, SOCK_STREAM)
+                    except OSError as e: # Family not supported here
+                        errors.append(e)
+                        continue
+                    skt.setblocking(False)
+                    if (err := skt.connect_ex(sockaddr)) not in (0, errno.EINPROGRESS):
+                        errors.append(OSError(err, os.strerror(err)))
+                        skt.close()
+                        continue
+                    selector.register(skt, selectors.EVENT_WRITE)
+                    nextAttempt = now + delay
+                    continue
+                if not selector.get_map(): raise errors[0]
+                for key, _ in selector.select(max(0.0, nextAttempt - now) if remaining else None):
+                    skt = key.fileobj
+                    selector.unregister(skt)
+                    if err := skt.getsockopt(SOL_SOCKET, SO_ERROR):
+                        errors.append(OSError(err, os.strerror(err)))
+                        skt.close()
+                        continue
+                    skt.setblocking(True)
+                    return skt
+        finally:
+            for key in list(selector.get_map().values()): key.fileobj.close() # Attempts that lost
+
+def connect_server(host: bytes, port: int) -> tuple[socket, bool]:
+    '''Opens a connection to the server, or reuses an idle pooled one.
+    Returns the connection and whether it was reused.'''
+    if connectionPool is not None and (server_skt := connectionPool.take(host, port)):
+        server_skt.setblocking(True)
+        return server_skt, True
+    start = time.perf_counter()
+    server_skt = open_connection(resolverCache.resolve(host, port))
+    elapsed = time.perf_counter() - start
+    metrics.record('connect', elapsed)
+    if connectionPool is not None: connectionPool.record_connect(elapsed)
+    return server_skt, False
+
+def release_server(host: bytes, port: int, server_skt: socket, relay: 'ResponseRelay') -> None:
+    '''Returns a server connection to the pool if it can carry another request, otherwise closes it.'''
+    if connectionPool is not None and relay.reusable: connectionPool.give(host, port, server_skt)
+    else: server_skt.close()
 
-        response = b''
-        while chunk := server_skt.recv(2048): # Returns None on connection close and breaks loop
-            response += chunk
+def relay_server_response(send: Callable[[bytes], object], host: bytes, port: int, path: bytes,
+                          headers: dict[bytes, bytes]) -> None:
+    '''Fetches the requested resource from the server, passing the response to ``send``
+    as it arrives. ``send`` may be given views into a reused buffer, so it must be done
+    with the data when it returns. If caching is enabled, reads from and updates cache appropriately,
+    and concurrent misses for the same resource share a single fetch.'''
+    cached = fetch_from_cache(host, port, path)
+    if cached and cached.is_fresh():
+        logging.debug("Serving fresh response from cache")
+        send(cached.response)
+        return
+    if cached and cached.serves_while_revalidating():
+        logging.debug("Serving stale response from cache while it's refreshed")
+        cacheRefresher.refresh(host, port, path, headers, cached)
+        send(cached.response)
+        return
+    if not cacheEnabled or carries_credentials(headers):
+        fetch_server_response(send, host, port, path, headers, cached)
+        return
+    key = get_cache_key(host, port, path)
+    flight, leading = requestCoalescer.join(key)
+    if leading:
+        lead_flight(key, flight, send, host, port, path, headers, cached)
+    elif (response := flight.result.result()) is not None:
+        logging.debug("Serving response fetched for a concurrent request")
+        send(response)
+    elif (cached := fetch_from_cache(host, port, path)) and cached.is_fresh(): # The leader may have cached it
+        send(cached.response)
+    else:
+        fetch_server_response(send, host, port, path, headers, cached)
+
+def lead_flight(key: bytes, flight: Flight, send: Callable[[bytes], object], host: bytes, port: int, path: bytes,
+                headers: dict[bytes, bytes], cached: CacheEntry | None) -> None:
+    '''Fetches the resource for ``flight``'s leader, capturing the response for its followers.
+    A failure of the fetch is passed on to the followers; if only the leader's client went away,
+    they fall back to fetching the resource themselves.'''
+    clientError = None
+    def tee(data: bytes | memoryview) -> None:
+        nonlocal clientError
+        flight.capture(data)
+        try:
+            send(data)
+        except OSError as e:
+            clientError = e
+            raise
+    try:
+        fetch_server_response(tee, host, port, path, headers, cached)
+    except BaseException as e:
+        if e is clientError: flight.discard()
+        requestCoalescer.land(key, flight, None if e is clientError else e)
+        raise
+    requestCoalescer.land(key, flight)
+
+def fetch_server_response(send: Callable[[bytes], object], host: bytes, port: int, path: bytes,
+                          headers: dict[bytes, bytes], cached: CacheEntry | None, staleOnError: bool = True) -> None:
+    '''Relays the response from the server to ``send``, revalidating ``cached`` if given.
+    With ``staleOnError``, ``cached`` is sent instead if the server fails and it may be served stale.'''
+    keepAlive = connectionPool is not None
+    request = build_server_request(host, port, path, headers, cached, keepAlive)
+    buffer = bytearray(RELAY_BUFFER_SIZE)
+    view = memoryview(buffer)
     
-    # Consult cache
-    if cacheEnabled:
-        responseCode = response.split(b' ')[1]
-        logging.debug(f"Response code: {responseCode.decode()}")
-        if responseCode == b'304': return cached_obj
-        elif responseCode == b'200': add_to_cache(host, port, path, response)
-    return response
+    # Connect to server and relay response
+    while True:
+        try:
+            server_skt, reused = connect_server(host, port)
+        except OSError:
+            logging.info(f"Unable to connect to {host.decode()}:{port}")
+            if staleOnError and cached and cached.serves_on_error():
+                cacheRefresher.served_on_error()
+                send(cached.response)
+                return
+            metrics.reject(ParseError.BADREQ.value)
+            send(status_code_response(ParseError.BADREQ.value))
+            return
+        relay = ResponseRelay(host, port, path, cached, keepAlive, staleOnError,
+                              credentialed=carries_credentials(headers))
+        waited = 0.0 # Seconds spent waiting on the server
+        try:
+            start = time.perf_counter()
+            server_skt.sendall(request)
+            while not relay.done:
+                n = server_skt.recv_into(buffer)
+                waited += time.perf_counter() - start
+                if not n: break # Returns 0 on connection close
+                for data in relay.feed(view[:n]): send(data)
+                start = time.perf_counter()
+            if reused and not relay.received: # Server closed the idle connection, retry on a new one
+                server_skt.close()
+                continue
+            if data := relay.finish(): send(data)
+        except OSError:
+            server_skt.close()
+            if reused and not relay.received: continue
+            relay.abort()
+            raise
+        except BaseException:
+            server_skt.close()
+            relay.abort()
+            raise
+        finally:
+            if relay.received: metrics.fetched(relay.received, waited)
+        release_server(host, port, server_skt, relay)
+        return
+
+def open_tunnel(client_skt: socket, send: Callable[[bytes], object], host: bytes, port: int,
+                early: bytes | memoryview, finish: Callable[[], object]) -> bool:
+    '''Serves a ``CONNECT`` request: connects to the server, tells the client the tunnel is open
+    and hands both sockets to ``tunnelRelay``, which calls ``finish`` once the tunnel is closed.
+    ``early`` is anything the client sent after its request head, which is passed on first.
+    Returns whether the tunnel was handed over; if not, the caller still owns the client.'''
+    start = time.perf_counter()
+    try:
+        server_skt = open_connection(resolverCache.resolve(host, port))
+    except OSError:
+        logging.info(f"Unable to connect to {host.decode()}:{port}")
+        metrics.reject(ParseError.BADREQ.value)
+        send(status_code_response(ParseError.BADREQ.value))
+        return False
+    metrics.record('connect', time.perf_counter() - start)
+    earlyBytes = len(early)
+    def closed(fromClient: int, fromServer: int) -> None:
+        metrics.tunneled(earlyBytes + fromClient, fromServer)
+        finish()
+    try:
+        send(CONNECT_RESPONSE)
+        if early: server_skt.sendall(early)
+        tunnelRelay.add(Tunnel(client_skt, server_skt, closed))
+    except BaseException:
+        server_skt.close()
+        raise
+    return True
 
-def send_client_response(client_skt: socket, response: bytes) -> None:
-    '''Sends a server response back to the client and closes the connection.'''
-    client_skt.send(response)
-    client_skt.close()
+def status_code_response(responseMsg: str, body: bytes = b'', contentType: str = 'text/plain') -> bytes:
+    '''Constructs a client response with the provided response code and message.
+    A non-empty ``body`` is sent as ``contentType``.'''
+    if not body: return f"HTTP/1.0 {responseMsg}\r\n\r\n".encode()
+    return f"HTTP/1.0 {responseMsg}\r\nContent-Type: {contentType}\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
 
-def status_code_response(responseMsg: str) -> None:
-    '''Constructs a client response with the provided response code and message.'''
-    return f"HTTP/1.0 {responseMsg}\r\n\r\n".encode()
+def overload_response() -> bytes:
+    '''Response for clients turned away by admission control.'''
+    return f"HTTP/1.0 503 Service Unavailable\r\nRetry-After: {RETRY_AFTER}\r\n\r\n".encode()
+
+def reject_overloaded(client_skt: socket) -> None:
+    '''Sends an overload response without blocking on the client, and closes the connection.
+    Whatever part of the request has already arrived is discarded first, since closing with
+    unread data makes the kernel reset the connection, which can destroy the response in flight.'''
+    try:
+        client_skt.setblocking(False)
+        client_skt.send(overload_response())
+        client_skt.shutdown(SHUT_WR)
+        while client_skt.recv(REQUEST_RECV_SIZE): pass
+    except OSError:
+        pass
+    finally:
+        client_skt.close()
+
+def reject_overloaded_async(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    '''Sends an overload response and closes the connection in the background.
+    Unlike ``reject_overloaded``, the connection lingers until the client has finished sending
+    (or ``ADMISSION_LINGER`` seconds pass), so a request arriving just after the response
+    can't make the kernel reset the connection.'''
+    async def linger() -> None:
+        try:
+            writer.write(overload_response())
+            writer.write_eof()
+            async def drain_request() -> None:
+                while await reader.read(REQUEST_RECV_SIZE): pass
+            await asyncio.wait_for(drain_request(), ADMISSION_LINGER)
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+    asyncio.get_running_loop().create_task(linger())
 
 def get_cache_key(host: bytes, port: int, path: bytes) -> bytes:
-    return host + b':' + bytes(port) + path
+    return b'%s:%d%s' % (host, port, path)
+
+def parse_http_date(value: bytes | None) -> float | None:
+    '''Parses an HTTP-date ([RFC 1945, 3.3](https://www.rfc-editor.org/rfc/rfc1945#section-3.3))
+    into a timestamp. Returns ``None`` if ``value`` is missing or malformed.'''
+    if not value: return None
+    try:
+        return parsedate_to_datetime(value.decode('latin-1')).timestamp()
+    except (TypeError, ValueError):
+        return None
 
-def get_modified_date() -> bytes:
-    '''Gets the current time as HTTP-date
-    ([RFC 1945, 3.3](https://www.rfc-editor.org/rfc/rfc1945#section-3.3)).'''
-    return format_date_time(time.time()).encode()
+def parse_response_headers(response: bytes) -> tuple[bytes, dict[bytes, bytes]]:
+    '''Extracts the status code and headers from a server response.
+    Header names are lowercased; repeated headers are joined with commas.'''
+    head = response.split(b'\r\n\r\n', 1)[0].split(b'\r\n')
+    statusLine = head[0].split(b' ', 2)
+    responseCode = statusLine[1] if len(statusLine) > 1 else b''
+    headers = {}
+    for header_line in head[1:]:
+        name, sep, value = header_line.partition(b':')
+        if not sep: continue
+        name = name.strip().lower()
+        value = value.strip()
+        headers[name] = headers[name] + b', ' + value if name in headers else value
+    return responseCode, headers
 
-def fetch_from_cache(host: bytes, port: int, path: bytes) -> bytes | None:
+def parse_cache_control(value: bytes) -> dict[bytes, bytes | None]:
+    '''Parses a ``Cache-Control`` header into lowercase directives and their arguments.'''
+    directives = {}
+    for directive in value.split(b','):
+        name, sep, arg = directive.strip().partition(b'=')
+        if name: directives[name.lower()] = arg.strip(b'"') if sep else None
+    return directives
+
+def parse_delta_seconds(value: bytes | None) -> float | None:
+    '''Parses a number of seconds as given to ``Cache-Control`` directives. Returns ``None``
+    if ``value`` is missing or malformed.'''
+    return float(value) if value and value.isdigit() else None
+
+def find_embedded_resources(host: bytes, port: int, path: bytes, html: bytes) -> list[bytes]:
+    '''Finds the resources embedded in the page at ``host``:``port``/``path`` (images, scripts,
+    stylesheets and the like) that are served from the same origin.
+    Returns their paths in the order they appear, without duplicates.'''
+    base = 'http://%s:%d%s' % (host.decode('latin-1'), port, path.decode('latin-1'))
+    resources = {}
+    for tag, attributes in EMBED_TAG_PATTERN.findall(html):
+        attributes = {name.lower(): quoted or singleQuoted or bare for name, quoted, singleQuoted, bare
+                      in TAG_ATTRIBUTE_PATTERN.findall(attributes)}
+        if tag.lower() == b'link':
+            if EMBED_LINK_RELS.isdisjoint(attributes.get(b'rel', b'').lower().split()): continue
+            link = attributes.get(b'href')
+        else:
+            link = attributes.get(b'src')
+        if not link: continue
+        try:
+            url = urlsplit(urljoin(base, link.strip().decode('latin-1')))
+            sameOrigin = url.scheme == 'http' and url.hostname == host.decode('latin-1').lower() and (url.port or 80) == port
+        except ValueError: # Malformed port, for one
+            continue
+        if sameOrigin: resources[((url.path or '/') + (f'?{url.query}' if url.query else '')).encode('latin-1')] = None
+    resources.pop(path, None)
+    return list(resources)
+
+def fetch_from_cache(host: bytes, port: int, path: bytes) -> CacheEntry | None:
     '''If the resource is cached and caching is enabled, returns the cached resource. If not, returns ``None``.'''
     if not cacheEnabled: return None
     logging.debug(f"Fetching from cache")
+    start = time.perf_counter()
     key = get_cache_key(host, port, path)
-    return responseCache.get(key, None)
+    if (cached := responseCache.get(key)) is None and diskCache is not None:
+        cached = diskCache.get(key)
+    metrics.record('cache', time.perf_counter() - start)
+    if cached is not None: prefetcher.claim(key)
+    return cached
+
+async def fetch_from_cache_async(host: bytes, port: int, path: bytes) -> CacheEntry | None:
+    '''Mirrors ``fetch_from_cache``, but looks in the disk cache on the event loop's default executor,
+    so the loop isn't blocked on its file I/O.'''
+    if not cacheEnabled: return None
+    start = time.perf_counter()
+    key = get_cache_key(host, port, path)
+    if (cached := responseCache.get(key)) is None and diskCache is not None:
+        cached = await asyncio.get_running_loop().run_in_executor(None, diskCache.get, key)
+    metrics.record('cache', time.perf_counter() - start)
+    if cached is not None: prefetcher.claim(key)
+    return cached
+
+def offload_to_executor(work: Callable[[], object]) -> None:
+    '''Runs ``work`` on the event loop's default executor without waiting for it, logging any failure.'''
+    def done(future: asyncio.Future) -> None:
+        if (e := future.exception()) is not None: logging.info(f"Background work failed: {e!r}")
+    asyncio.get_running_loop().run_in_executor(None, work).add_done_callback(done)
+
+def carries_credentials(headers: dict[bytes, bytes]) -> bool:
+    '''Checks if request ``headers`` identify the client, so its response mustn't go to other clients.'''
+    return any(name.lower() in CREDENTIAL_HEADERS for name in headers)
 
-def add_to_cache(host: bytes, port: int, path: bytes, obj: bytes) -> None:
-    '''Caches the resouce at ``host``:``port``/``path``.'''
+def is_cacheable(headers: dict[bytes, bytes], credentialed: bool = False) -> bool:
+    '''Checks if a response with ``headers`` may be stored in the (shared) cache. The response to a
+    ``credentialed`` request may only be if it's marked ``public`` or has an ``s-maxage``
+    ([RFC 9111, 3.5](https://www.rfc-editor.org/rfc/rfc9111#section-3.5)).'''
+    cacheControl = parse_cache_control(headers.get(b'cache-control', b''))
+    if credentialed and b'public' not in cacheControl and b's-maxage' not in cacheControl: return False
+    return b'no-store' not in cacheControl and b'private' not in cacheControl
+
+def add_to_cache(host: bytes, port: int, path: bytes, obj: bytes | None, headers: dict[bytes, bytes],
+                 spool: DiskWriter | None = None, offload: Callable[[Callable[[], object]], object] | None = None) -> None:
+    '''Caches the resouce at ``host``:``port``/``path`` along with the freshness metadata
+    from its response ``headers``. Responses marked ``no-store`` or ``private`` aren't cached.
+    ``obj`` goes to the in-memory cache; ``spool``, the same response already written out
+    by ``DiskCache.begin``, is committed to the disk cache, by ``offload`` if given. If prefetching
+    is enabled, the resources embedded in an HTML ``obj`` are then fetched into the cache.'''
+    if not is_cacheable(headers):
+        if spool: spool.abort()
+        return
     logging.info(f"Adding {host.decode()}:{port}{path.decode()} to cache")
     key = get_cache_key(host, port, path)
-    responseCache[key] = obj
+    if obj is not None: responseCache.put(key, CacheEntry(obj, headers))
+    if spool:
+        if offload: offload(lambda: diskCache.commit(spool, headers))
+        else: diskCache.commit(spool, headers)
+    if prefetchEnabled and obj is not None: prefetcher.scan(host, port, path, obj, headers)
+
+def clear_cache() -> None:
+    '''Removes every cached response from all cache tiers.'''
+    responseCache.clear()
+    if diskCache is not None: diskCache.clear()
     
 def add_to_blocklist(host: bytes) -> None:
     '''Adds ``host`` to the blocklist.'''
@@ -187,25 +2574,440 @@ def remove_from_blocklist(host: bytes) -> None:
     logging.debug(f"Removing {host.decode()} from blocklist")
     requestBlocklist.remove(host)
     
+def read_blocklist(filename: str) -> list[bytes]:
+    '''Reads the hosts listed in ``filename``, one per line. ``#`` starts a comment.'''
+    with open(filename, 'rb') as file:
+        hosts = [line.split(b'#', 1)[0].strip().split(b':')[0] for line in file]
+    return [host for host in hosts if host]
+
+def write_blocklist(filename: str) -> None:
+    '''Atomically writes the blocked hosts to ``filename``, in the format ``read_blocklist`` reads.'''
+    fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(filename))
+    with os.fdopen(fd, 'wb') as file:
+        file.write(b''.join(host + b'\n' for host in requestBlocklist))
+    os.replace(tmpPath, filename)
+
+def load_blocklist(filename: str) -> None:
+    '''Adds every host listed in ``filename`` to the blocklist.'''
+    requestBlocklist.update(read_blocklist(filename))
+    logging.info(f"Loaded {len(requestBlocklist)} hosts into blocklist from {filename}")
+    
+def parse_host_port(entry: bytes) -> tuple[bytes, int]:
+    '''Splits ``host[:port]`` into the host and the port, 80 if none is given.
+    Raises ``ValueError`` if the port isn't a number.'''
+    host, _, port = entry.partition(b':')
+    return host, int(port) if port else 80
+
+def read_prewarm_hosts(filename: str) -> list[tuple[bytes, int]]:
+    '''Reads the ``host[:port]`` entries listed in ``filename``, one per line. ``#`` starts a comment.'''
+    with open(filename, 'rb') as file:
+        entries = [line.split(b'#', 1)[0].strip() for line in file]
+    return [parse_host_port(entry) for entry in entries if entry]
+
 def host_blocked(host: bytes) -> bool:
     '''Checks if ``host`` is currently blocked.'''
     if not blocklistEnabled: return False
-    for blockedHost in requestBlocklist:
-        if blockedHost in host: return True
-    return False
+    start = time.perf_counter()
+    blocked = requestBlocklist.matches(host)
+    metrics.record('blocklist', time.perf_counter() - start)
+    return blocked
 
 def handle_client(client_skt: socket) -> None:
     '''Manages a request from a single client.'''
-    message = receive_request(client_skt)
-    error, host, port, path, headers = parse_request(message)
-    if not error:
-        if parse_settings(path):
-            response = status_code_response("200 OK")
+    metrics.opened()
+    send = MeteredSend(client_skt.sendall)
+    reader = RequestReader()
+    message = b''
+    handedOver = False
+    def finish() -> None:
+        metrics.closed(len(message), send.sent, send.seconds) # Before closing, so the client can't outrun it
+        client_skt.close()
+    try:
+        start = time.perf_counter()
+        error, message = receive_request(client_skt, reader=reader)
+        metrics.record('receive', time.perf_counter() - start)
+        if sharedSettings is not None: sharedSettings.apply()
+        if not error:
+            start = time.perf_counter()
+            error, host, port, path, headers = parse_request(message)
+            metrics.record('parse', time.perf_counter() - start)
+        if not error:
+            if path is None:
+                handedOver = open_tunnel(client_skt, send, host, port, reader.rest(), finish)
+            elif settings_response := parse_settings(path):
+                send(settings_response)
+            else:
+                relay_server_response(send, host, port, path, headers)
+        else:
+            metrics.reject(error.value)
+            send(status_code_response(error.value))
+    except OSError as e:
+        logging.info(f"Dropped client: {e!r}")
+    finally:
+        if not handedOver: finish()
+
+async def receive_request_async(reader: asyncio.StreamReader) -> tuple[ParseError | None, bytes]:
+    '''Receives a complete HTTP request head from ``reader``. Mirrors ``receive_request``;
+    the head is limited to the ``limit`` the reader was created with.'''
+    try:
+        return None, await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), requestTimeout)
+    except TimeoutError:
+        return ParseError.TIMEOUT, b''
+    except asyncio.LimitOverrunError:
+        return ParseError.TOOLARGE, b''
+
+async def relay_server_response_async(writer: MeteredWriter, host: bytes, port: int, path: bytes,
+                                      headers: dict[bytes, bytes]) -> None:
+    '''Fetches the requested resource from the server without blocking the event loop,
+    writing the response to ``writer`` as it arrives. Mirrors ``relay_server_response``.'''
+    cached = await fetch_from_cache_async(host, port, path)
+    if cached and cached.is_fresh():
+        logging.debug("Serving fresh response from cache")
+        await send_cached_async(writer, cached)
+        return
+    if cached and cached.serves_while_revalidating():
+        logging.debug("Serving stale response from cache while it's refreshed")
+        cacheRefresher.refresh(host, port, path, headers, cached)
+        await send_cached_async(writer, cached)
+        return
+    if not cacheEnabled or carries_credentials(headers):
+        await fetch_server_response_async(writer, host, port, path, headers, cached)
+        return
+    key = get_cache_key(host, port, path)
+    flight, leading = requestCoalescer.join(key)
+    if leading:
+        await lead_flight_async(key, flight, writer, host, port, path, headers, cached)
+    elif (response := await asyncio.wrap_future(flight.result)) is not None:
+        logging.debug("Serving response fetched for a concurrent request")
+        writer.write(response)
+    elif (cached := await fetch_from_cache_async(host, port, path)) and cached.is_fresh(): # The leader may have cached it
+        await send_cached_async(writer, cached)
+    else:
+        await fetch_server_response_async(writer, host, port, path, headers, cached)
+
+async def lead_flight_async(key: bytes, flight: Flight, writer: MeteredWriter, host: bytes, port: int,
+                            path: bytes, headers: dict[bytes, bytes], cached: CacheEntry | None) -> None:
+    '''Fetches the resource for ``flight``'s leader without blocking the event loop. Mirrors ``lead_flight``.'''
+    try:
+        await fetch_server_response_async(writer, host, port, path, headers, cached, flight)
+    except BaseException as e:
+        clientGone = writer.is_closing()
+        if clientGone: flight.discard()
+        requestCoalescer.land(key, flight, None if clientGone else e)
+        raise
+    requestCoalescer.land(key, flight)
+
+async def fetch_server_response_async(writer: MeteredWriter, host: bytes, port: int, path: bytes,
+                                      headers: dict[bytes, bytes], cached: CacheEntry | None,
+                                      flight: Flight | None = None) -> None:
+    '''Relays the response from the server to ``writer``, revalidating ``cached`` if given,
+    or sending it instead if the server fails and it may be served stale.
+    If this fetch leads a ``flight``, the response is also captured for its followers.'''
+    def write(data: bytes | memoryview) -> None:
+        if flight: flight.capture(data)
+        writer.write(bytes(data)) # The transport may keep what it's given past this iteration
+
+    keepAlive = connectionPool is not None
+    request = build_server_request(host, port, path, headers, cached, keepAlive)
+    buffer = bytearray(RELAY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    
+    # Connect to server and relay response
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            server_skt, reused = await connect_server_async(host, port)
+        except OSError:
+            logging.info(f"Unable to connect to {host.decode()}:{port}")
+            if cached and cached.serves_on_error():
+                cacheRefresher.served_on_error()
+                if flight: flight.capture(cached.response)
+                await send_cached_async(writer, cached)
+                return
+            metrics.reject(ParseError.BADREQ.value)
+            write(status_code_response(ParseError.BADREQ.value))
+            return
+        relay = ResponseRelay(host, port, path, cached, keepAlive, offload=offload_to_executor,
+                              credentialed=carries_credentials(headers))
+        waited = 0.0 # Seconds spent waiting on the server
+        try:
+            start = time.perf_counter()
+            await loop.sock_sendall(server_skt, request)
+            while not relay.done:
+                n = await loop.sock_recv_into(server_skt, buffer)
+                waited += time.perf_counter() - start
+                if not n: break
+                pieces = relay.feed(view[:n])
+                if relay.usesCached: # Send the cached response instead
+                    if flight: flight.capture(cached.response)
+                    await send_cached_async(writer, cached)
+                    break
+                for data in pieces: write(data)
+                await writer.drain()
+                start = time.perf_counter()
+            if reused and not relay.received: # Server closed the idle connection, retry on a new one
+                server_skt.close()
+                continue
+            if data := relay.finish(): write(data)
+        except OSError:
+            server_skt.close()
+            if reused and not relay.received: continue
+            relay.abort()
+            raise
+        except BaseException:
+            server_skt.close()
+            relay.abort()
+            raise
+        finally:
+            if relay.received: metrics.fetched(relay.received, waited)
+        release_server(host, port, server_skt, relay)
+        return
+
+async def open_connection_async(addresses: list[tuple[int, tuple]], delay: float = HAPPY_EYEBALLS_DELAY) -> socket:
+    '''Connects to whichever of ``addresses`` accepts first. Mirrors ``open_connection``,
+    but returns a non-blocking socket.'''
+    loop = asyncio.get_running_loop()
+    async def attempt(family: int, sockaddr: tuple) -> socket:
+        skt = socket(family, SOCK_STREAM)
+        skt.setblocking(False)
+        try:
+            await loop.sock_connect(skt, sockaddr)
+        except BaseException:
+            skt.close()
+            raise
+        return skt
+    if len(addresses) == 1: return await attempt(*addresses[0]) # Nothing to race
+    errors: list[BaseException] = []
+    remaining = deque(addresses)
+    attempts: set[asyncio.Task] = set()
+    try:
+        while True:
+            if remaining: attempts.add(loop.create_task(attempt(*remaining.popleft())))
+            elif not attempts: raise errors[0]
+            done, attempts = await asyncio.wait(attempts, timeout=delay if remaining else None,
+                                                return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            for task in done:
+                if task.exception() is not None: errors.append(task.exception())
+                elif winner is None: winner = task.result()
+                else: task.result().close()
+            if winner is not None: return winner
+    finally:
+        for task in attempts: # Attempts that lost
+            if task.done() and not task.cancelled() and task.exception() is None: task.result().close()
+            else: task.cancel() # Closes its socket
+
+async def connect_server_async(host: bytes, port: int) -> tuple[socket, bool]:
+    '''Opens a non-blocking connection to the server, or reuses an idle pooled one.
+    Mirrors ``connect_server``.'''
+    if connectionPool is not None and (server_skt := connectionPool.take(host, port)):
+        server_skt.setblocking(False)
+        return server_skt, True
+    start = time.perf_counter()
+    server_skt = await open_connection_async(await resolverCache.resolve_async(host, port))
+    elapsed = time.perf_counter() - start
+    metrics.record('connect', elapsed)
+    if connectionPool is not None: connectionPool.record_connect(elapsed)
+    return server_skt, False
+
+async def open_tunnel_async(reader: asyncio.StreamReader, writer: MeteredWriter, host: bytes, port: int,
+                            finish: Callable[[], object]) -> bool:
+    '''Serves a ``CONNECT`` request on the event loop. Mirrors ``open_tunnel``, except that the tunnel
+    is relayed by a task of its own, through the streams' buffers since the event loop owns the
+    client socket. Anything the client sent early is still in ``reader``.'''
+    start = time.perf_counter()
+    try:
+        server_skt = await open_connection_async(await resolverCache.resolve_async(host, port))
+    except OSError:
+        logging.info(f"Unable to connect to {host.decode()}:{port}")
+        metrics.reject(ParseError.BADREQ.value)
+        writer.write(status_code_response(ParseError.BADREQ.value))
+        return False
+    metrics.record('connect', time.perf_counter() - start)
+    serverReader, serverWriter = await asyncio.open_connection(sock=server_skt, limit=TUNNEL_PIPE_SIZE)
+    try:
+        writer.write(CONNECT_RESPONSE)
+        await writer.drain()
+    except BaseException:
+        serverWriter.close()
+        raise
+    asyncio.get_running_loop().create_task(relay_tunnel_async(reader, writer, serverReader, serverWriter, finish))
+    return True
+
+async def relay_tunnel_async(reader: asyncio.StreamReader, writer: MeteredWriter, serverReader: asyncio.StreamReader,
+                             serverWriter: asyncio.StreamWriter, finish: Callable[[], object]) -> None:
+    '''Relays bytes both ways between a client and a server until both have closed their side,
+    either fails, or nothing moves for ``TUNNEL_IDLE_TIMEOUT`` seconds, then calls ``finish``.'''
+    for transport in (writer.transport, serverWriter.transport): transport.set_write_buffer_limits(TUNNEL_PIPE_SIZE)
+    moved = [0, 0] # From the client, from the server
+    lastMoved = time.monotonic()
+    pending: set[asyncio.Task] = set()
+    async def pump(src: asyncio.StreamReader, dst: asyncio.StreamWriter, direction: int) -> None:
+        nonlocal lastMoved
+        while data := await src.read(TUNNEL_PIPE_SIZE):
+            lastMoved = time.monotonic()
+            moved[direction] += len(data)
+            dst.write(data)
+            await dst.drain()
+        dst.write_eof() # Pass the close on; the other direction may carry on
+    try:
+        loop = asyncio.get_running_loop()
+        pending = {loop.create_task(pump(reader, serverWriter, 0)), loop.create_task(pump(serverReader, writer.writer, 1))}
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=TUNNEL_IDLE_TIMEOUT, return_when=asyncio.FIRST_EXCEPTION)
+            if failed := [task.exception() for task in done if task.exception() is not None]:
+                logging.info(f"Tunnel closed: {failed[0]!r}")
+                break
+            if pending and time.monotonic() - lastMoved >= TUNNEL_IDLE_TIMEOUT:
+                logging.info("Closing idle tunnel")
+                break
+    finally:
+        for task in pending: task.cancel()
+        metrics.tunneled(*moved)
+        serverWriter.close()
+        finish()
+
+async def prewarm_async(path: bytes) -> bytes:
+    '''Serves a ``DNS_PREWARM_PATH`` request on the event loop. Mirrors that settings path in ``parse_settings``,
+    which would block the loop on the lookup.'''
+    try:
+        hostPort = parse_host_port(path.removeprefix(DNS_PREWARM_PATH))
+    except ValueError:
+        return status_code_response(ParseError.BADREQ.value)
+    return status_code_response("200 OK", f"resolved: {await resolverCache.prewarm_async([hostPort])}\r\n".encode())
+
+async def send_cached_async(writer: MeteredWriter, cached: CacheEntry) -> None:
+    '''Writes a cached response to ``writer``. Responses cached on disk are sent with ``sendfile``.'''
+    if not isinstance(cached, DiskEntry):
+        writer.write(cached.response)
+        return
+    try:
+        file = open(cached.path, 'rb')
+    except FileNotFoundError: # Evicted since the lookup, but still mapped
+        writer.write(cached.response)
+        return
+    with file:
+        if os.fstat(file.fileno()).st_size != cached.size: # Replaced since the lookup
+            writer.write(cached.response)
+            return
+        await writer.sendfile(file, cached.size)
+
+async def handle_client_async(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    '''Manages a request from a single client on the event loop.'''
+    metrics.opened()
+    writer = MeteredWriter(writer)
+    message = b''
+    handedOver = False
+    def finish() -> None:
+        metrics.closed(len(message), writer.sent, writer.seconds)
+        writer.close()
+    try:
+        start = time.perf_counter()
+        error, message = await receive_request_async(reader)
+        metrics.record('receive', time.perf_counter() - start)
+        if sharedSettings is not None: sharedSettings.apply()
+        if not error:
+            start = time.perf_counter()
+            error, host, port, path, headers = parse_request(message)
+            metrics.record('parse', time.perf_counter() - start)
+        if not error:
+            if path is None:
+                handedOver = await open_tunnel_async(reader, writer, host, port, finish)
+            elif path.startswith(DNS_PREWARM_PATH):
+                writer.write(await prewarm_async(path))
+            elif settings_response := parse_settings(path):
+                writer.write(settings_response)
+            else:
+                await relay_server_response_async(writer, host, port, path, headers)
         else:
-            response = request_server(host, port, path, headers)
+            metrics.reject(error.value)
+            writer.write(status_code_response(error.value))
+        if not handedOver: await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError) as e:
+        logging.info(f"Dropped client {writer.get_extra_info('peername')}: {e!r}")
+    finally:
+        if not handedOver: finish()
+
+async def serve_async(address: str, port: int, reusePort: bool = False) -> None:
+    '''Accepts clients and handles their requests on a single event loop.
+    With ``reusePort``, other processes may listen on the same port.'''
+    global admission
+    admission = AsyncAdmission(maxConcurrency or MAX_ASYNC_CLIENTS, maxQueued, maxQueueTime)
+    admission.start(handle_client_async)
+    server = await asyncio.start_server(admission.submit, address, port, reuse_address=True,
+                                        reuse_port=reusePort, backlog=LISTEN_BACKLOG, limit=MAX_REQUEST_HEAD)
+    logging.info("Accepting clients (async engine)...")
+    async with server:
+        await server.serve_forever()
+
+def serve_threaded(address: str, port: int, reusePort: bool = False) -> None:
+    '''Accepts clients and handles each request on a thread from a fixed pool.
+    With ``reusePort``, other processes may listen on the same port.'''
+    # Set up socket to receive requests
+    listener_skt = socket(AF_INET, SOCK_STREAM)
+    listener_skt.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1) # Make the autograder behave
+    if reusePort: listener_skt.setsockopt(SOL_SOCKET, SO_REUSEPORT, 1)
+    listener_skt.bind((address, port))
+    listener_skt.listen(LISTEN_BACKLOG)
+    listener_skt.settimeout(ADMISSION_SWEEP_INTERVAL) # Wake up to turn away clients that waited too long
+    global admission
+    admission = ThreadAdmission(maxConcurrency or MAX_THREADS, maxQueued, maxQueueTime)
+    admission.start(handle_client)
+    logging.info("Accepting clients...")
+
+    # Accept client sockets and queue them for the workers
+    while True:
+        try:
+            client_skt, client_address = listener_skt.accept()
+        except TimeoutError:
+            admission.sweep()
+            continue
+        client_skt.settimeout(None)
+        logging.info(f"Accepted client {client_address}")
+        admission.submit(client_address[0], client_skt)
+        admission.sweep()
+
+def serve(address: str, port: int, engine: str | None, reusePort: bool = False) -> None:
+    '''Serves clients with the chosen connection ``engine``.'''
+    if engine == 'async':
+        asyncio.run(serve_async(address, port, reusePort))
     else:
-        response = status_code_response(error.value)
-    send_client_response(client_skt, response)
+        serve_threaded(address, port, reusePort)
+
+def serve_workers(workers: int, address: str, port: int, engine: str | None) -> None:
+    '''Forks ``workers`` processes that each accept clients on ``port`` through their own
+    ``SO_REUSEPORT`` listener, so the kernel spreads connections across them and every
+    worker can use its own core. Returns once the workers have exited.'''
+    children = []
+    try:
+        for _ in range(workers):
+            if (pid := os.fork()) == 0:
+                status = 0
+                try:
+                    serve(address, port, engine, reusePort=True)
+                except SystemExit:
+                    pass
+                except BaseException:
+                    logging.exception("Worker failed")
+                    status = 1
+                finally:
+                    os._exit(status) # Leave exit handlers to the parent
+            children.append(pid)
+        logging.info(f"Started {workers} workers")
+        for _ in children:
+            pid, status = os.wait()
+            logging.error(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}")
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
 
 def main():
     # Parse out the command line server address and port number to listen to
@@ -213,6 +3015,58 @@ def main():
     parser.add_option('-p', type='int', dest='serverPort')
     parser.add_option('-a', type='string', dest='serverAddress')
     parser.add_option('-l', type='string', dest='loggingLevel')
+    parser.add_option('--cache-bytes', type='int', dest='cacheBytes', default=DEFAULT_CACHE_BYTES,
+                      help='maximum total size of cached responses in bytes')
+    parser.add_option('--cache-entries', type='int', dest='cacheEntries', default=DEFAULT_CACHE_ENTRIES,
+                      help='maximum number of cached responses')
+    parser.add_option('--cache-dir', type='string', dest='cacheDir',
+                      help='directory for a persistent on-disk cache tier')
+    parser.add_option('--cache-disk-bytes', type='int', dest='cacheDiskBytes', default=DEFAULT_DISK_CACHE_BYTES,
+                      help='maximum total size of responses cached on disk in bytes')
+    parser.add_option('--cache-warm', action='store_true', dest='cacheWarm', default=False,
+                      help='keep responses cached on disk by a previous run instead of starting cold')
+    parser.add_option('--stale-while-revalidate', type='float', dest='staleWhileRevalidate',
+                      default=DEFAULT_STALE_WHILE_REVALIDATE,
+                      help='seconds past expiry a cached response is served while it is refreshed in the background')
+    parser.add_option('--stale-if-error', type='float', dest='staleIfError', default=DEFAULT_STALE_IF_ERROR,
+                      help='seconds past expiry a cached response is served if the server fails')
+    parser.add_option('--refresh-workers', type='int', dest='refreshWorkers', default=DEFAULT_REFRESH_WORKERS,
+                      help='threads refreshing stale cached responses in the background')
+    parser.add_option('--prefetch', action='store_true', dest='prefetch', default=False,
+                      help='fetch the resources embedded in cached HTML pages into the cache ahead of time')
+    parser.add_option('--prefetch-workers', type='int', dest='prefetchWorkers', default=DEFAULT_PREFETCH_WORKERS,
+                      help='prefetches run at once')
+    parser.add_option('--prefetch-budget', type='int', dest='prefetchBudget', default=DEFAULT_PREFETCH_BUDGET,
+                      help='most resources prefetched per page')
+    parser.add_option('--keepalive', action='store_true', dest='keepAlive', default=False,
+                      help='reuse persistent HTTP/1.1 connections to servers')
+    parser.add_option('--pool-max-per-host', type='int', dest='poolMaxPerHost', default=DEFAULT_POOL_MAX_PER_HOST,
+                      help='maximum idle server connections kept per host')
+    parser.add_option('--pool-idle-timeout', type='float', dest='poolIdleTimeout', default=DEFAULT_POOL_IDLE_TIMEOUT,
+                      help='seconds an idle server connection is kept')
+    parser.add_option('--dns-ttl', type='float', dest='dnsTtl', default=DEFAULT_DNS_TTL,
+                      help='seconds resolved server addresses are reused (0 to resolve every connection)')
+    parser.add_option('--dns-negative-ttl', type='float', dest='dnsNegativeTtl', default=DEFAULT_DNS_NEGATIVE_TTL,
+                      help='seconds a failed server lookup is remembered')
+    parser.add_option('--dns-prewarm', type='string', dest='dnsPrewarm',
+                      help='resolve the hosts listed in this file, one host[:port] per line, before serving')
+    parser.add_option('--tunnel-relay', type='choice', choices=['splice', 'copy'], dest='tunnelRelay',
+                      default='splice' if hasattr(os, 'splice') else 'copy',
+                      help='how the thread engine relays CONNECT tunnels: splice (kernel pipe, Linux only) or copy (recv_into)')
+    parser.add_option('--blocklist-file', type='string', dest='blocklistFile',
+                      help='enable the blocklist with the hosts listed in this file, one per line')
+    parser.add_option('--request-timeout', type='float', dest='requestTimeout', default=DEFAULT_REQUEST_TIMEOUT,
+                      help='seconds a client has to send its request before getting a 408')
+    parser.add_option('--max-concurrency', type='int', dest='maxConcurrency',
+                      help=f'clients handled at once (default {MAX_THREADS} threads, or {MAX_ASYNC_CLIENTS} async)')
+    parser.add_option('--max-queued', type='int', dest='maxQueued', default=DEFAULT_MAX_QUEUED,
+                      help='accepted clients that may wait for a worker before new ones get a 503')
+    parser.add_option('--max-queue-time', type='float', dest='maxQueueTime', default=DEFAULT_MAX_QUEUE_TIME,
+                      help='seconds a client may wait for a worker before it gets a 503')
+    parser.add_option('--workers', type='int', dest='workers', default=1,
+                      help='number of worker processes sharing the port and the cache')
+    parser.add_option('-e', '--engine', type='choice', choices=['thread', 'async'], dest='engine',
+                      help='connection engine: thread (one thread per client) or async (single event loop)')
     (options, args) = parser.parse_args()
 
     # Set logging level
@@ -233,26 +3087,54 @@ def main():
     if port is None:
         port = 2100
 
+    if options.tunnelRelay == 'splice' and not hasattr(os, 'splice'):
+        parser.error("--tunnel-relay splice needs os.splice, which this system doesn't have")
+
+    global requestTimeout, maxConcurrency, maxQueued, maxQueueTime, tunnelSplice
+    tunnelSplice = options.tunnelRelay == 'splice'
+    requestTimeout = options.requestTimeout
+    maxConcurrency, maxQueued, maxQueueTime = options.maxConcurrency, options.maxQueued, options.maxQueueTime
+    responseCache.maxBytes = options.cacheBytes
+    global staleWhileRevalidate, staleIfError
+    staleWhileRevalidate, staleIfError = options.staleWhileRevalidate, options.staleIfError
+    cacheRefresher.workers = options.refreshWorkers
+    global prefetchEnabled
+    prefetchEnabled = options.prefetch
+    prefetcher.workers, prefetcher.budget = options.prefetchWorkers, options.prefetchBudget
+    responseCache.maxEntries = options.cacheEntries
+    workers = options.workers > 1
+    if workers: # Workers share settings and responses through this directory
+        workDir = tempfile.mkdtemp(prefix='proxy-workers-')
+        atexit.register(shutil.rmtree, workDir, ignore_errors=True)
+    if options.cacheDir or workers:
+        global diskCache
+        diskCache = DiskCache(options.cacheDir or os.path.join(workDir, 'cache'), options.cacheDiskBytes,
+                              options.cacheWarm, shared=workers)
+        if options.cacheDir: atexit.register(diskCache.save_index)
+    if options.blocklistFile:
+        global blocklistEnabled
+        load_blocklist(options.blocklistFile)
+        blocklistEnabled = True
+    if workers:
+        global sharedSettings
+        sharedSettings = SharedSettings(workDir)
+    if options.keepAlive:
+        global connectionPool
+        connectionPool = ConnectionPool(options.poolMaxPerHost, options.poolIdleTimeout)
+    resolverCache.ttl, resolverCache.negativeTtl = options.dnsTtl, options.dnsNegativeTtl
+    if options.dnsPrewarm: # Before forking, so every worker starts warm
+        hosts = read_prewarm_hosts(options.dnsPrewarm)
+        logging.info(f"Pre-warmed {resolverCache.prewarm(hosts)} of {len(hosts)} hosts from {options.dnsPrewarm}")
+
     # Set up signal handling (ctrl-c)
     signal.signal(signal.SIGINT, ctrl_c_pressed)
+    signal.signal(signal.SIGTERM, ctrl_c_pressed)
 
-    # Set up socket to receive requests
-    listener_skt = socket(AF_INET, SOCK_STREAM)
-    listener_skt.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1) # Make the autograder behave
-    listener_skt.bind((address, port))
-    listener_skt.listen()
-    logging.info("Accepting clients...")
-
-    # Accept client sockets and handle requests
-    while True:
-        client_skt, client_address = listener_skt.accept()
-        if threading.active_count() > MAX_THREADS:
-            logging.info(f"Rejected client {client_skt.getsockname()}: too many threads")
-            send_client_response(client_skt, status_code_response("503 Service Unavailable"))
-        
-        logging.info(f"Accepted client {client_skt.getsockname()}")
-        client_thread = threading.Thread(target=handle_client, args=[client_skt])
-        client_thread.start()
+    if workers:
+        if options.cacheDir: atexit.register(diskCache.reload) # Index what the workers cached before it's saved
+        serve_workers(options.workers, address, port, options.engine)
+    else:
+        serve(address, port, options.engine)
        
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+# Checks admission control: bounded concurrency and queueing, fast 503s under overload, and fairness.
+
+import asyncio
+import time
+
+from HTTPproxy import AdmissionQueue
+from bench_util import free_port, start_proxy, stop_proxy, send, send_async
+from local_origin import OriginServer
+
+# Clients are taken round-robin by address
+queue = AdmissionQueue(maxQueued=10)
+for client in ('a1', 'a2', 'a3', 'b1', 'c1', 'b2'):
+    assert queue.put(client[0], client) is None
+assert [queue.pop()[0] for _ in range(6)] == ['a1', 'b1', 'c1', 'a2', 'b2', 'a3']
+assert queue.pop() is None and len(queue) == 0
+
+# When full, a newcomer displaces the newest client of the address hogging the queue...
+queue = AdmissionQueue(maxQueued=4)
+for client in ('a1', 'a2', 'a3', 'b1'):
+    assert queue.put(client[0], client) is None
+assert queue.put('c', 'c1') == 'a3'
+# ...but not when that would only trade places with it
+assert queue.put('b', 'b2') == 'b2'
+assert queue.put('a', 'a4') == 'a4'
+assert [queue.pop()[0] for _ in range(4)] == ['a1', 'b1', 'c1', 'a2']
+
+# Clients that waited too long are swept out
+queue = AdmissionQueue()
+queue.put('a', 'old')
+time.sleep(0.05)
+queue.put('a', 'new')
+assert queue.expire(0.03) == ['old'] and len(queue) == 1 and queue.pop()[0] == 'new'
+
+def stats(port: int) -> dict[str, str]:
+    body = send(port, b'GET http://localhost/proxy/admission/stats HTTP/1.0\r\n\r\n').split(b'\r\n\r\n', 1)[1]
+    return dict(line.split(': ') for line in body.decode().splitlines())
+
+async def burst(port: int, msg: bytes, clients: int) -> list[tuple[bytes, float]]:
+    async def client(delay: float):
+        await asyncio.sleep(delay) # Arrive in a known order
+        return await send_async(port, msg)
+    return await asyncio.gather(*(client(i * 0.02) for i in range(clients)))
+
+origin = OriginServer(latency=1.0).start()
+for engine in ('thread', 'async'):
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine, '--max-concurrency', '2', '--max-queued', '4', '--max-queue-time', '0.5')
+    try:
+        results = asyncio.run(burst(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n', 10))
+        served = [latency for response, latency in results if response.startswith(b'HTTP/1.0 200')]
+        shed = [(response, latency) for response, latency in results if response.startswith(b'HTTP/1.0 503')]
+        assert len(served) == 2 and len(shed) == 8, [response[:12] for response, _ in results]
+        assert all(b'\r\nRetry-After: 1\r\n' in response for response, _ in shed)
+        assert all(latency < 0.9 for _, latency in shed), shed # Turned away well before a slot frees up
+        current = stats(port)
+        assert current['shedQueueFull'] == '4' and current['shedQueueTime'] == '4', current
+        assert current['active'] == '1' and current['queued'] == '0' # Only this request
+        assert send(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 200')
+    finally:
+        stop_proxy(proxy)
+origin.stop()
+print('All tests passed!')
@@ -0,0 +1,67 @@
+# Shared helpers for the proxy load tests and benchmarks
+
+import asyncio
+import subprocess
+import sys
+import time
+from socket import *
+
+PROXY_SCRIPT = 'HTTPproxy.py'
+
+def free_port() -> int:
+    '''Returns a currently unused localhost TCP port.'''
+    with socket(AF_INET, SOCK_STREAM) as skt:
+        skt.bind(('localhost', 0))
+        return skt.getsockname()[1]
+
+def start_proxy(port: int, *args: str) -> subprocess.Popen:
+    '''Starts ``HTTPproxy.py`` on ``port`` with extra command line ``args``
+    and waits until it accepts connections.'''
+    proxy = subprocess.Popen([sys.executable, PROXY_SCRIPT, '-p', str(port), *args],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            create_connection(('localhost', port)).close()
+            return proxy
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    proxy.kill()
+    raise RuntimeError("Proxy did not start")
+
+def stop_proxy(proxy: subprocess.Popen) -> None:
+    '''Stops a proxy started with ``start_proxy``.'''
+    proxy.terminate()
+    try:
+        proxy.wait(5)
+    except subprocess.TimeoutExpired:
+        proxy.kill()
+        proxy.wait()
+
+def send(port: int, msg: bytes) -> bytes:
+    '''Sends ``msg`` to the proxy on ``port`` and returns the full response.'''
+    with create_connection(('localhost', port)) as sock:
+        sock.sendall(msg)
+        return sock.makefile('rb').read()
+
+async def send_async(port: int, msg: bytes, timeout: float = 30) -> tuple[bytes, float]:
+    '''Sends ``msg`` to the proxy on ``port``.
+    Returns the full response and the time it took in seconds.
+    Raises ``TimeoutError`` if the exchange takes longer than ``timeout`` seconds.'''
+    async def exchange() -> bytes:
+        reader, writer = await asyncio.open_connection('localhost', port)
+        try:
+            writer.write(msg)
+            await writer.drain()
+            return await reader.read()
+        finally:
+            writer.close()
+    start = time.perf_counter()
+    response = await asyncio.wait_for(exchange(), timeout)
+    return response, time.perf_counter() - start
+
+def percentile(samples: list[float], pct: float) -> float:
+    '''Nearest-rank percentile of ``samples``.'''
+    if not samples: return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+
+# Measures the cost of checking a host against blocklists of different sizes,
+# comparing the original linear substring scan with the indexed Blocklist, and
+# what building the index, adding one more host and holding the index cost.
+
+import random
+import timeit
+import tracemalloc
+
+from HTTPproxy import Blocklist
+
+SIZES = (10, 10_000, 100_000)
+LOOKUPS = 200
+
+rng = random.Random(4480)
+letters = 'abcdefghijklmnopqrstuvwxyz'
+def domain() -> bytes:
+    labels = [''.join(rng.choices(letters, k=rng.randint(3, 10))) for _ in range(rng.randint(2, 3))]
+    return ('.'.join(labels) + rng.choice(['.com', '.net', '.org'])).encode()
+
+def linear_match(hosts: set[bytes], host: bytes) -> bool:
+    for blockedHost in hosts:
+        if blockedHost in host: return True
+    return False
+
+print(f"{'entries':>8} {'build':>9} {'add':>9} {'memory':>9} {'linear':>12} {'indexed':>12}")
+for size in SIZES:
+    hosts = {domain() for _ in range(size)}
+    lookups = [domain() for _ in range(LOOKUPS)] # Misses, the common case
+    lookups += [b'www.' + host for host in rng.sample(sorted(hosts), min(size, LOOKUPS))]
+
+    blocklist = Blocklist()
+    build = timeit.timeit(lambda: blocklist.update(hosts), number=1)
+    assert all(blocklist.matches(host) == linear_match(hosts, host) for host in lookups)
+    linear = min(timeit.repeat(lambda: [linear_match(hosts, host) for host in lookups], number=1, repeat=3))
+    indexed = min(timeit.repeat(lambda: [blocklist.matches(host) for host in lookups], number=1, repeat=3))
+    extra = iter([domain() for _ in range(1000)])
+    add = timeit.timeit(lambda: blocklist.add(next(extra)), number=1000) / 1000
+    tracemalloc.start()
+    Blocklist().update(hosts)
+    memory = tracemalloc.get_traced_memory()[1] # Peak, the index being dropped by then
+    tracemalloc.stop()
+    print(f"{size:>8} {build * 1000:>7.1f}ms {add * 1e6:>7.1f}us {memory / 2**20:>7.1f}MB "
+          f"{linear / len(lookups) * 1e6:>10.2f}us {indexed / len(lookups) * 1e6:>10.2f}us")
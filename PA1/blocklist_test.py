@@ -0,0 +1,65 @@
+import random
+
+import HTTPproxy
+from HTTPproxy import Blocklist, BLOCKLIST_PREFIX
+
+def linear_match(hosts: set[bytes], host: bytes) -> bool:
+    return any(blockedHost in host for blockedHost in hosts)
+
+# Matches any blocked host as a substring, like the original linear scan
+blocklist = Blocklist()
+blocklist.update([b'flux', b'ads.', b'tracker.example.com', b'he', b'she', b'hers'])
+for host, blocked in [(b'www.flux.utah.edu', True), (b'ads.example.com', True), (b'www.google.com', False),
+                      (b'cdn.tracker.example.com', True), (b'ushers.org', True), (b'shop.org', False), (b'sheep.org', True),
+                      (b'example.com', False), (b'', False)]:
+    assert blocklist.matches(host) == blocked, host
+
+# Additions and removals are matched right away
+blocklist.add(b'google')
+assert blocklist.matches(b'www.google.com')
+blocklist.remove(b'he')
+assert not blocklist.matches(b'hello.com') and blocklist.matches(b'ushers.org') # Still blocked by 'she'
+blocklist.remove(b'google')
+assert not blocklist.matches(b'www.google.com')
+
+# An empty host blocks everything, as it did before
+blocklist.add(b'')
+assert blocklist.matches(b'anything') and blocklist.matches(b'')
+blocklist.clear()
+assert len(blocklist) == 0 and not blocklist.matches(b'www.flux.utah.edu')
+
+# Random churn agrees with the linear scan, with hosts either side of the prefix length
+rng = random.Random(4480)
+alphabet = b'abcde.'
+def word(n: int) -> bytes:
+    return bytes(rng.choice(alphabet) for _ in range(n))
+hosts = set()
+for step in range(256):
+    if hosts and rng.random() < 0.3:
+        host = rng.choice(sorted(hosts))
+        hosts.discard(host)
+        blocklist.remove(host)
+    else:
+        host = word(rng.randint(1, 2 * BLOCKLIST_PREFIX))
+        hosts.add(host)
+        blocklist.add(host)
+    for _ in range(20):
+        host = word(rng.randint(0, 12))
+        assert blocklist.matches(host) == linear_match(hosts, host), (hosts, host)
+
+# Replacing swaps in exactly the new hosts, leaving nothing of the old ones behind
+blocklist.replace([b'ab', b'abcdef'])
+assert blocklist.matches(b'xabcdefx') and blocklist.matches(b'xab') and not blocklist.matches(b'a.b')
+assert all(not blocklist.matches(host) for host in hosts if b'ab' not in host)
+blocklist.remove(b'abcdef')
+blocklist.remove(b'ab')
+assert not blocklist.matches(b'xabcdefx') and len(blocklist) == 0
+
+# Bulk loading from a file strips comments and ports
+import tempfile
+with tempfile.NamedTemporaryFile('wb', suffix='.txt', delete=False) as file:
+    file.write(b'# blocked hosts\nflux.utah.edu\nads.example.com:8080  # with port\n\n')
+HTTPproxy.requestBlocklist.clear()
+HTTPproxy.load_blocklist(file.name)
+assert sorted(HTTPproxy.requestBlocklist) == [b'ads.example.com', b'flux.utah.edu']
+print('All tests passed!')
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Checks that concurrent cache misses for the same URL are served from a single origin fetch.
+
+import asyncio
+import threading
+import time
+from socket import *
+
+import HTTPproxy
+from bench_util import free_port, start_proxy, stop_proxy, send, send_async
+from local_origin import OriginServer
+
+CLIENTS = 20
+
+def stats(port: int) -> dict[str, str]:
+    body = send(port, b'GET http://localhost/proxy/coalesce/stats HTTP/1.0\r\n\r\n').split(b'\r\n\r\n', 1)[1]
+    return dict(line.split(': ') for line in body.decode().splitlines())
+
+async def burst(port: int, msg: bytes) -> list[bytes]:
+    return [response for response, _ in await asyncio.gather(*(send_async(port, msg) for _ in range(CLIENTS)))]
+
+for engine in ('thread', 'async'):
+    origin = OriginServer(bodySize=100000, latency=0.5).start()
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine)
+    try:
+        send(port, b'GET http://localhost/proxy/cache/enable HTTP/1.0\r\n\r\n')
+        responses = asyncio.run(burst(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n'))
+        assert origin.requests == 1, f"{engine}: {origin.requests} origin fetches"
+        assert all(response == responses[0] for response in responses)
+        assert responses[0].split(b'\r\n\r\n', 1)[1] == b'x' * 100000
+        assert stats(port)['coalesced'] == str(CLIENTS - 1)
+
+        # Responses that can't be shared are fetched by every client
+        send(port, b'GET http://localhost/proxy/cache/flush HTTP/1.0\r\n\r\n')
+        origin.headers = {b'Cache-Control': b'private'}
+        asyncio.run(burst(port, b'GET ' + origin.url('/private') + b' HTTP/1.0\r\n\r\n'))
+        assert origin.requests == 1 + CLIENTS, f"{engine}: {origin.requests} origin fetches"
+        assert stats(port)['coalesceFallbacks'] == str(CLIENTS - 1)
+
+        # Requests carrying credentials are never coalesced
+        origin.headers = {b'Cache-Control': b'max-age=60'}
+        fetches = origin.requests
+        asyncio.run(burst(port, b'GET ' + origin.url('/cookie') + b' HTTP/1.0\r\nCookie: id=1\r\n\r\n'))
+        assert origin.requests == fetches + CLIENTS, f"{engine}: {origin.requests - fetches} origin fetches"
+        assert stats(port)['coalesced'] == str(2 * (CLIENTS - 1))
+
+        # ...and their responses are only cached for other clients if marked as shareable
+        fetches = origin.requests
+        send(port, b'GET ' + origin.url('/cookie') + b' HTTP/1.0\r\n\r\n')
+        origin.headers = {b'Cache-Control': b'public, max-age=60'}
+        for request in (b'Cookie: id=1\r\n', b''):
+            send(port, b'GET ' + origin.url('/public') + b' HTTP/1.0\r\n' + request + b'\r\n')
+        assert origin.requests == fetches + 2, f"{engine}: {origin.requests - fetches} origin fetches"
+
+        # Without the cache every request goes to the origin
+        send(port, b'GET http://localhost/proxy/cache/disable HTTP/1.0\r\n\r\n')
+        origin.headers = {}
+        fetches = origin.requests
+        asyncio.run(burst(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n'))
+        assert origin.requests == fetches + CLIENTS
+    finally:
+        stop_proxy(proxy)
+        origin.stop()
+
+# Flights capture nothing unless someone joined before the response started,
+# and hand over only cacheable 200s no larger than the memory cache allows
+ok = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'
+alone = HTTPproxy.Flight()
+alone.capture(ok)
+assert not alone.shareable and alone.response() is None
+for response, shared in [(ok, True), (b'HTTP/1.1 404 Not Found\r\nContent-Length: 2\r\n\r\nno', False),
+                         (b'HTTP/1.1 200 OK\r\nCache-Control: no-store\r\n\r\nok', False)]:
+    flight = HTTPproxy.Flight()
+    flight.followers = 1
+    flight.capture(response[:10])
+    flight.capture(response[10:])
+    assert flight.response() == (response if shared else None), response
+HTTPproxy.responseCache.maxBytes = 1000
+flight = HTTPproxy.Flight()
+flight.followers = 1
+flight.capture(b'x' * 1001)
+assert not flight.shareable
+HTTPproxy.responseCache.maxBytes = HTTPproxy.DEFAULT_CACHE_BYTES
+assert HTTPproxy.carries_credentials({b'Authorization': b'Basic eDp5'}) and not HTTPproxy.carries_credentials({b'Accept': b'*/*'})
+assert HTTPproxy.is_cacheable({b'cache-control': b'max-age=60'}) and not HTTPproxy.is_cacheable({b'cache-control': b'max-age=60'}, True)
+assert HTTPproxy.is_cacheable({b'cache-control': b'public'}, True) and HTTPproxy.is_cacheable({b'cache-control': b's-maxage=60'}, True)
+
+# A failed fetch fails every request waiting on it
+listener = socket(AF_INET, SOCK_STREAM)
+listener.bind(('localhost', 0))
+listener.listen()
+def reset_after_delay():
+    server_skt, _ = listener.accept()
+    time.sleep(0.5)
+    server_skt.setsockopt(SOL_SOCKET, SO_LINGER, b'\x01\x00\x00\x00\x00\x00\x00\x00') # Close with RST
+    server_skt.close()
+threading.Thread(target=reset_after_delay, daemon=True).start()
+
+HTTPproxy.cacheEnabled = True
+errors = []
+def fetch():
+    try:
+        HTTPproxy.relay_server_response(lambda data: None, b'localhost', listener.getsockname()[1], b'/', {})
+    except OSError as e:
+        errors.append(e)
+threads = [threading.Thread(target=fetch) for _ in range(5)]
+for thread in threads: thread.start()
+for thread in threads: thread.join()
+assert len(errors) == 5 and all(isinstance(e, ConnectionResetError) for e in errors), errors
+assert HTTPproxy.requestCoalescer.stats()['coalesced'] == 4
+listener.close()
+print('All tests passed!')
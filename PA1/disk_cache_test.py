@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import tempfile
+import threading
+from wsgiref.handlers import format_date_time
+import time
+
+import HTTPproxy
+from HTTPproxy import DiskCache
+from bench_util import free_port, start_proxy, stop_proxy, send
+from local_origin import OriginServer
+
+def store(cache: DiskCache, key: bytes, response: bytes, headers: dict[bytes, bytes] = {}) -> None:
+    writer = cache.begin(key)
+    assert writer.write(response)
+    cache.commit(writer, headers)
+
+temporary = tempfile.TemporaryDirectory()
+directory = temporary.name
+
+# Responses round-trip through their files, and the byte budget evicts LRU entries
+cache = DiskCache(directory, maxBytes=250)
+store(cache, b'a', b'1' * 100)
+store(cache, b'b', b'2' * 100, {b'cache-control': b'max-age=60'})
+assert bytes(cache.get(b'a').response) == b'1' * 100 # 'b' is now least recently used
+store(cache, b'c', b'3' * 100)
+assert cache.get(b'b') is None and cache.evictions == 1 and cache.size == 200
+assert not os.path.exists(os.path.join(cache.entryDirectory, DiskCache.entry_name(b'b')))
+writer = cache.begin(b'huge')
+assert not writer.write(b'x' * 300) # Over budget, discarded
+assert os.listdir(cache.tmpDirectory) == []
+
+# A warm start picks up entries committed after the last index snapshot, drops
+# bodies that never got a .meta file, and keeps metadata updates
+cache.save_index()
+store(cache, b'd', b'4' * 40, {b'cache-control': b'max-age=60'})
+cache.get(b'd').update({b'date': format_date_time(time.time()).encode()})
+open(os.path.join(cache.entryDirectory, DiskCache.entry_name(b'orphan')), 'wb').write(b'partial')
+open(os.path.join(cache.tmpDirectory, 'leftover'), 'wb').write(b'partial')
+cache = DiskCache(directory, maxBytes=250, warm=True)
+assert len(cache) == 3 and cache.size == 240
+assert cache.get(b'd').is_fresh() and b'date' in cache.get(b'd').headers
+assert not os.path.exists(os.path.join(cache.entryDirectory, DiskCache.entry_name(b'orphan')))
+assert os.listdir(cache.tmpDirectory) == []
+
+# An entry evicted between its lookup and serving is still served; one gone before it's mapped is a miss
+pinned = cache.get(b'd')
+other = DiskCache(directory, maxBytes=250, warm=True)
+other.clear()
+assert bytes(pinned.response) == b'4' * 40
+assert cache.get(b'd') is None and cache.misses == 1
+cache = DiskCache(directory, maxBytes=250, warm=True)
+store(cache, b'e', b'5' * 10)
+os.unlink(os.path.join(cache.entryDirectory, DiskCache.entry_name(b'e')))
+assert cache.get(b'e') is None and len(cache) == 0 and cache.size == 0
+
+# A cold start discards what's on disk, but only the proxy's own files
+open(os.path.join(directory, 'a' * 40), 'wb').write(b'not ours')
+store(cache, b'f', b'6' * 10)
+cache = DiskCache(directory, maxBytes=250)
+assert len(cache) == 0 and os.listdir(cache.entryDirectory) == []
+assert os.path.exists(os.path.join(directory, 'a' * 40))
+
+# A shared cache keeps the bytes of every process within budget, evicting another's entries if needed
+cache = DiskCache(directory, maxBytes=250, shared=True)
+if (child := os.fork()) == 0:
+    store(cache, b'g', b'7' * 100)
+    store(cache, b'h', b'8' * 100)
+    os._exit(0)
+assert os.waitpid(child, 0)[1] == 0 and cache.total_size() == 200 and len(cache) == 0
+time.sleep(0.01) # Newer modification time than the child's entries
+store(cache, b'i', b'9' * 100)
+assert cache.total_size() == 200 and cache.evictions == 1
+assert not os.path.exists(os.path.join(cache.entryDirectory, DiskCache.entry_name(b'g')))
+assert bytes(cache.get(b'h').response) == b'8' * 100
+cache.clear()
+assert cache.total_size() == 0
+
+# The async engine commits and looks up disk cache entries off the event loop
+cache = HTTPproxy.diskCache = DiskCache(directory)
+HTTPproxy.cacheEnabled = True
+threads = []
+def on_thread(method):
+    def call(*args):
+        threads.append(threading.current_thread())
+        return method(*args)
+    return call
+cache.get, cache.commit = on_thread(cache.get), on_thread(cache.commit)
+async def commit_then_get() -> bytes:
+    spool = cache.begin(HTTPproxy.get_cache_key(b'localhost', 80, b'/j'))
+    assert spool.write(b'0' * 100)
+    HTTPproxy.add_to_cache(b'localhost', 80, b'/j', None, {}, spool, HTTPproxy.offload_to_executor)
+    while not len(cache): await asyncio.sleep(0.01)
+    return bytes((await HTTPproxy.fetch_from_cache_async(b'localhost', 80, b'/j')).response)
+assert asyncio.run(commit_then_get()) == b'0' * 100
+assert len(threads) == 2 and threading.main_thread() not in threads
+HTTPproxy.cacheEnabled, HTTPproxy.diskCache = False, None
+temporary.cleanup()
+
+# Cached responses survive a proxy restart with --cache-warm
+origin = OriginServer(headers={b'Cache-Control': b'max-age=60'}).start()
+for engine in ('thread', 'async'):
+    temporary = tempfile.TemporaryDirectory()
+    directory = temporary.name
+    requests = origin.requests
+    responses = []
+    for warm in ([], ['--cache-warm']):
+        port = free_port()
+        proxy = start_proxy(port, '-e', engine, '--cache-dir', directory, '--cache-bytes', '1000', *warm)
+        try:
+            send(port, b'GET http://localhost/proxy/cache/enable HTTP/1.0\r\n\r\n')
+            responses.append(send(port, b'GET ' + origin.url('/size/100000') + b' HTTP/1.0\r\n\r\n'))
+        finally:
+            stop_proxy(proxy)
+    assert responses[0] == responses[1] and responses[0].endswith(b'x' * 100000)
+    assert origin.requests == requests + 1, f"{engine}: cached response did not survive restart"
+    temporary.cleanup()
+origin.stop()
+print('All tests passed!')
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Checks the resolver cache: TTLs, negative caching, lookup sharing, and Happy Eyeballs connects.
+
+import asyncio
+import threading
+import time
+from socket import *
+
+import HTTPproxy
+from HTTPproxy import ResolverCache, order_addresses, open_connection, open_connection_async
+from bench_util import free_port, start_proxy, stop_proxy, send
+from local_origin import OriginServer
+
+calls = []
+def fake_getaddrinfo(host, port, family=0, type=0):
+    '''Stands in for the system resolver, slowly. ``bad.invalid`` doesn't resolve.'''
+    calls.append(host)
+    time.sleep(0.05)
+    if host == 'bad.invalid': raise gaierror(EAI_NONAME, "Name or service not known")
+    return [(AF_INET, SOCK_STREAM, 6, '', ('10.0.0.1', port)), (AF_INET, SOCK_STREAM, 6, '', ('10.0.0.2', port))]
+HTTPproxy.getaddrinfo = fake_getaddrinfo
+
+# Resolved hosts are reused until their TTL runs out
+resolver = ResolverCache(ttl=0.2)
+assert resolver.resolve(b'example.com', 80) == [(AF_INET, ('10.0.0.1', 80)), (AF_INET, ('10.0.0.2', 80))]
+assert resolver.resolve(b'example.com', 80) and calls == ['example.com']
+resolver.resolve(b'example.com', 8080) # Ports are looked up separately
+time.sleep(0.25)
+resolver.resolve(b'example.com', 80)
+assert len(calls) == 3 and resolver.hits == 1 and resolver.misses == 3
+
+# Failures are remembered for the negative TTL
+calls.clear()
+resolver = ResolverCache(negativeTtl=0.2)
+for _ in range(3):
+    try:
+        resolver.resolve(b'bad.invalid', 80)
+        assert False, "Expected a lookup failure"
+    except gaierror as e:
+        assert e.errno == EAI_NONAME
+assert calls == ['bad.invalid'] and resolver.negativeHits == 2 and resolver.failures == 1
+time.sleep(0.25)
+try:
+    resolver.resolve(b'bad.invalid', 80)
+except gaierror:
+    pass
+assert len(calls) == 2
+
+# Concurrent lookups of one host share a single call
+calls.clear()
+resolver = ResolverCache()
+threads = [threading.Thread(target=resolver.resolve, args=[b'example.com', 80]) for _ in range(10)]
+for thread in threads: thread.start()
+for thread in threads: thread.join()
+assert calls == ['example.com'] and resolver.misses == 1 and resolver.coalesced + resolver.hits == 9
+async def resolve_many() -> list:
+    return await asyncio.gather(*(resolver.resolve_async(b'other.com', 80) for _ in range(10)))
+assert len(set(map(tuple, asyncio.run(resolve_many())))) == 1 and calls == ['example.com', 'other.com']
+
+# Pre-warming resolves ahead of the first request; the least recently used hosts are evicted past maxEntries
+calls.clear()
+resolver = ResolverCache(maxEntries=2)
+assert resolver.prewarm([(b'a.com', 80), (b'b.com', 80)]) == 2 and len(calls) == 2
+resolver.resolve(b'b.com', 80)
+assert resolver.prewarm([(b'bad.invalid', 80)]) == 0 and len(resolver) == 2 # a.com was evicted
+resolver.resolve(b'b.com', 80)
+resolver.resolve(b'a.com', 80)
+assert calls[2:] == ['bad.invalid', 'a.com'] and resolver.stats()['hitRatio'] == round(2 / 6, 4)
+
+# Pre-warming from the event loop leaves it free while the lookups run
+calls.clear()
+resolver = ResolverCache()
+async def prewarm_while_ticking() -> tuple[int, int]:
+    ticks = 0
+    async def tick() -> None:
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+    ticker = asyncio.get_running_loop().create_task(tick())
+    resolved = await resolver.prewarm_async([(b'a.com', 80), (b'b.com', 80), (b'bad.invalid', 80)])
+    ticker.cancel()
+    return resolved, ticks
+resolved, ticks = asyncio.run(prewarm_while_ticking())
+assert resolved == 2 and len(calls) == 3 and ticks >= 2
+HTTPproxy.getaddrinfo = getaddrinfo
+
+# Addresses alternate between families
+v6 = [(AF_INET6, SOCK_STREAM, 6, '', (f'::{i}', 80, 0, 0)) for i in (1, 2, 3)]
+v4 = [(AF_INET, SOCK_STREAM, 6, '', (f'10.0.0.{i}', 80)) for i in (1, 2)]
+assert [sockaddr[0] for _, sockaddr in order_addresses(v6 + v4 + v4)] == ['::1', '10.0.0.1', '::2', '10.0.0.2', '::3']
+
+# Connecting falls back to the next address without waiting for the first to time out
+listener = create_server(('127.0.0.1', 0))
+closed = free_port()
+addresses = [(AF_INET, ('127.0.0.1', closed)), (AF_INET, ('127.0.0.1', listener.getsockname()[1]))]
+start = time.perf_counter()
+with open_connection(addresses) as skt:
+    assert skt.getpeername() == addresses[1][1] and skt.getblocking()
+assert time.perf_counter() - start < 0.2
+async def connect_async() -> None:
+    skt = await open_connection_async(addresses)
+    assert skt.getpeername() == addresses[1][1]
+    skt.close()
+asyncio.run(connect_async())
+try:
+    open_connection(addresses[:1] * 2)
+    assert False, "Expected a refused connection"
+except ConnectionRefusedError:
+    pass
+listener.close()
+
+# The proxy resolves each origin once
+origin = OriginServer('localhost').start()
+for engine in ('thread', 'async'):
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine)
+    try:
+        for _ in range(3):
+            assert send(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 200')
+        stats = dict(line.split(': ') for line in
+                     send(port, b'GET http://localhost/proxy/dns/stats HTTP/1.0\r\n\r\n').split(b'\r\n\r\n', 1)[1].decode().splitlines())
+        assert stats['misses'] == '1' and stats['hits'] == '2' and stats['entries'] == '1', stats
+        assert send(port, b'GET http://localhost/proxy/dns/prewarm/localhost:8080 HTTP/1.0\r\n\r\n').endswith(b'resolved: 1\r\n')
+        send(port, b'GET http://localhost/proxy/dns/flush HTTP/1.0\r\n\r\n')
+        assert send(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 200')
+        assert b'misses: 3\r\n' in send(port, b'GET http://localhost/proxy/dns/stats HTTP/1.0\r\n\r\n')
+    finally:
+        stop_proxy(proxy)
+origin.stop()
+print('All tests passed!')
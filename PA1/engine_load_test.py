@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+# Compares how many concurrent clients the threaded and async engines can serve.
+# Usage: engine_load_test.py [clients]
+
+import asyncio
+import sys
+import time
+
+from bench_util import free_port, start_proxy, stop_proxy, send_async, percentile
+from local_origin import OriginServer
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+ORIGIN_LATENCY = 0.2 # Keeps every client's request in flight at the same time
+CLIENT_TIMEOUT = 10
+
+async def run_clients(port: int, url: bytes) -> tuple[int, list[float], float]:
+    '''Fires ``CLIENTS`` simultaneous GETs for ``url``.
+    Returns the number of 200 responses, their latencies, and the total elapsed time.'''
+    msg = b'GET ' + url + b' HTTP/1.0\r\n\r\n'
+    start = time.perf_counter()
+    results = await asyncio.gather(*(send_async(port, msg, CLIENT_TIMEOUT) for _ in range(CLIENTS)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    latencies = [latency for result in results if not isinstance(result, BaseException)
+                 for response, latency in [result] if response.startswith(b'HTTP/1.0 200')]
+    return len(latencies), latencies, elapsed
+
+origin = OriginServer(latency=ORIGIN_LATENCY).start()
+served = {}
+for engine in ('thread', 'async'):
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine)
+    try:
+        ok, latencies, elapsed = asyncio.run(run_clients(port, origin.url('/load')))
+    finally:
+        stop_proxy(proxy)
+    served[engine] = ok
+    print(f"{engine:>6}: {ok}/{CLIENTS} served in {elapsed:.2f}s, "
+          f"p50 {percentile(latencies, 50) * 1000:.0f} ms, p99 {percentile(latencies, 99) * 1000:.0f} ms")
+origin.stop()
+
+assert served['async'] == CLIENTS, f"async engine only served {served['async']}/{CLIENTS} clients"
+assert served['async'] > served['thread'], "async engine did not outperform the threaded engine"
+print('All tests passed!')
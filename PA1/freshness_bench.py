@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+# Measures latency of repeated GETs through the proxy cache when responses must be
+# revalidated with the origin versus when they are fresh and served locally.
+# Usage: freshness_bench.py [requests]
+
+import sys
+import time
+
+from bench_util import free_port, start_proxy, stop_proxy, send, percentile
+from local_origin import OriginServer
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+ORIGIN_LATENCY = 0.02
+
+scenarios = {
+    'cache off': (False, {}),
+    'revalidate': (True, {b'Cache-Control': b'no-cache'}),
+    'fresh': (True, {b'Cache-Control': b'max-age=3600'}),
+}
+
+print(f"{REQUESTS} sequential GETs, origin latency {ORIGIN_LATENCY * 1000:.0f} ms")
+for name, (cache, headers) in scenarios.items():
+    origin = OriginServer(latency=ORIGIN_LATENCY, headers=headers, lastModified=time.time() - 3600).start()
+    port = free_port()
+    proxy = start_proxy(port)
+    try:
+        if cache: send(port, b'GET http://localhost/proxy/cache/enable HTTP/1.0\r\n\r\n')
+        msg = b'GET ' + origin.url('/simple.html') + b' HTTP/1.0\r\n\r\n'
+        latencies = []
+        for _ in range(REQUESTS):
+            start = time.perf_counter()
+            assert send(port, msg).startswith(b'HTTP/1.0 200')
+            latencies.append(time.perf_counter() - start)
+    finally:
+        stop_proxy(proxy)
+        origin.stop()
+    print(f"{name:>10}: p50 {percentile(latencies, 50) * 1000:6.2f} ms, p99 {percentile(latencies, 99) * 1000:6.2f} ms, "
+          f"origin requests {origin.requests} ({origin.notModified} not modified)")
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+# Compares sequential request latency with and without pooled keep-alive server connections.
+# The local origin delays the first request on each connection to stand in for handshake round-trips.
+# Usage: keepalive_bench.py [requests]
+
+import sys
+import time
+
+from bench_util import free_port, start_proxy, stop_proxy, send, percentile
+from local_origin import OriginServer
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CONNECT_LATENCY = 0.005
+
+print(f"{REQUESTS} sequential GETs, {CONNECT_LATENCY * 1000:.0f} ms extra per new server connection")
+for name, args in (('close', []), ('keepalive', ['--keepalive'])):
+    origin = OriginServer(connectLatency=CONNECT_LATENCY).start()
+    port = free_port()
+    proxy = start_proxy(port, *args)
+    try:
+        msg = b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n'
+        latencies = []
+        for _ in range(REQUESTS):
+            start = time.perf_counter()
+            assert send(port, msg).startswith(b'HTTP/1.0 200')
+            latencies.append(time.perf_counter() - start)
+        stats = send(port, b'GET http://localhost/proxy/pool/stats HTTP/1.0\r\n\r\n').split(b'\r\n\r\n', 1)[1]
+    finally:
+        stop_proxy(proxy)
+        origin.stop()
+    print(f"{name:>9}: p50 {percentile(latencies, 50) * 1000:6.2f} ms, p99 {percentile(latencies, 99) * 1000:6.2f} ms, "
+          f"server connections {origin.connections}")
+    print('           ' + stats.decode().strip().replace('\r\n', ', '))
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Checks that --keepalive reuses HTTP/1.1 server connections while clients still get HTTP/1.0.
+
+import time
+
+from bench_util import free_port, start_proxy, stop_proxy, send
+from local_origin import OriginServer
+
+def stats(port: int) -> dict[str, str]:
+    body = send(port, b'GET http://localhost/proxy/pool/stats HTTP/1.0\r\n\r\n').split(b'\r\n\r\n', 1)[1]
+    return dict(line.split(': ') for line in body.decode().splitlines())
+
+for engine in ('thread', 'async'):
+    for chunked in (False, True):
+        origin = OriginServer(bodySize=200000, chunked=chunked).start()
+        port = free_port()
+        proxy = start_proxy(port, '-e', engine, '--keepalive', '--pool-idle-timeout', '0.5')
+        try:
+            for _ in range(20):
+                response = send(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n')
+                head, body = response.split(b'\r\n\r\n', 1)
+                assert head.startswith(b'HTTP/1.0 200 OK'), head
+                assert b'transfer-encoding' not in head.lower() and b'connection' not in head.lower()
+                assert body == b'x' * 200000, f"{engine}: body of {len(body)} bytes"
+            assert origin.connections == 1, f"{engine}: {origin.connections} server connections"
+            assert stats(port)['reused'] == '19'
+
+            # Connections idle for longer than the timeout aren't reused
+            time.sleep(0.6)
+            send(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n')
+            assert origin.connections == 2
+        finally:
+            stop_proxy(proxy)
+            origin.stop()
+
+# The retry on a fresh connection covers servers that drop idle connections
+origin = OriginServer().start()
+port = free_port()
+proxy = start_proxy(port, '--keepalive')
+try:
+    send(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n')
+    originPort = origin.port
+    origin.stop() # Closes the pooled connection
+    origin = OriginServer(port=originPort).start()
+    assert send(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 200 OK')
+finally:
+    stop_proxy(proxy)
+    origin.stop()
+print('All tests passed!')
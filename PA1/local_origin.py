@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+# Local stand-ins for an origin web server and a tunneled TLS server, so the proxy can be load tested offline
+
+import asyncio
+import socket
+import threading
+from collections import Counter
+from optparse import OptionParser
+from wsgiref.handlers import format_date_time
+from email.utils import parsedate_to_datetime
+import time
+
+class OriginServer:
+    '''Minimal HTTP origin served from a background event loop.
+    Every GET is answered with a ``bodySize``-byte body after ``latency`` seconds,
+    unless the path is ``/size/<n>`` or ``/size/<n>/<name>``, which return an ``n``-byte body instead.
+    ``headers`` are added to every response. If ``lastModified`` is given, responses carry
+    it as ``Last-Modified`` and requests with a later ``If-Modified-Since`` get a 304.
+    A non-zero ``trickle`` sends the body in 64 KB chunks, pausing ``trickle`` seconds between them.
+    HTTP/1.1 requests are answered in kind and the connection is kept open for further requests;
+    with ``chunked``, their bodies use chunked transfer coding. ``connectLatency`` is an extra
+    delay before the first request on each new connection, standing in for handshake round-trips.
+    ``pages`` maps paths to the content type and body served for them instead, e.g. HTML pages
+    embedding other resources.'''
+    def __init__(self, address: str = 'localhost', port: int = 0, bodySize: int = 1024,
+                 latency: float = 0.0, headers: dict[bytes, bytes] | None = None,
+                 lastModified: float | None = None, trickle: float = 0.0,
+                 chunked: bool = False, connectLatency: float = 0.0,
+                 pages: dict[bytes, tuple[bytes, bytes]] | None = None):
+        self.address = address
+        self.port = port
+        self.bodySize = bodySize
+        self.latency = latency
+        self.headers = headers or {}
+        self.lastModified = lastModified
+        self.trickle = trickle
+        self.chunked = chunked
+        self.connectLatency = connectLatency
+        self.pages = pages or {}
+        self.connections = 0 # Number of connections accepted
+        self.requests = 0 # Number of requests answered
+        self.notModified = 0 # Number of 304 responses among them
+        self.paths: Counter[bytes] = Counter() # Number of requests answered per path
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._writers: set[asyncio.StreamWriter] = set() # Open connections
+
+    def start(self) -> 'OriginServer':
+        '''Starts serving on a background thread. Returns once the origin is listening.'''
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, args=[ready], daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self) -> None:
+        '''Stops serving, closes open connections and joins the background thread.'''
+        asyncio.run_coroutine_threadsafe(self._close_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _close_all(self) -> None:
+        self._server.close()
+        for writer in list(self._writers): writer.close()
+        await asyncio.sleep(0.01) # Let the transports actually close their sockets
+
+    def url(self, path: str = '/') -> bytes:
+        '''Absolute URL of ``path`` on this origin, as a proxy client would request it.'''
+        return f"http://{self.address}:{self.port}{path}".encode()
+
+    def _run(self, ready: threading.Event) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.address, self.port, reuse_address=True, backlog=4096))
+        self.port = self._server.sockets[0].getsockname()[1]
+        ready.set()
+        self._loop.run_forever()
+
+    def _body(self, path: bytes) -> bytes:
+        if path.startswith(b'/size/'):
+            return b'x' * int(path.removeprefix(b'/size/').split(b'/')[0])
+        return b'x' * self.bodySize
+
+    def _not_modified(self, request: bytes) -> bool:
+        for header_line in request.split(b'\r\n')[1:]:
+            name, _, value = header_line.partition(b':')
+            if name.strip().lower() == b'if-modified-since':
+                try:
+                    return parsedate_to_datetime(value.strip().decode()).timestamp() >= int(self.lastModified)
+                except (TypeError, ValueError):
+                    return False
+        return False
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        try:
+            if self.connectLatency: await asyncio.sleep(self.connectLatency)
+            while await self._respond(reader, writer): pass
+        except (asyncio.IncompleteReadError, ConnectionError, IndexError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _respond(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        '''Answers one request. Returns ``True`` if the connection stays open for another.'''
+        request = await reader.readuntil(b'\r\n\r\n')
+        _, path, version = request.split(b'\r\n', 1)[0].split(b' ')
+        keepAlive = version == b'HTTP/1.1' and b'connection: close' not in request.lower()
+        if self.latency: await asyncio.sleep(self.latency)
+        self.requests += 1
+        self.paths[path] += 1
+        head = f"Date: {format_date_time(time.time())}\r\n"
+        if self.lastModified is not None:
+            head += f"Last-Modified: {format_date_time(self.lastModified)}\r\n"
+            if self._not_modified(request):
+                self.notModified += 1
+                writer.write(f"{version.decode()} 304 Not Modified\r\n{head}\r\n".encode())
+                await writer.drain()
+                return keepAlive
+        contentType, body = self.pages.get(path) or (b'text/plain', self._body(path))
+        chunked = self.chunked and version == b'HTTP/1.1'
+        head = f"{version.decode()} 200 OK\r\n{head}Content-Type: {contentType.decode()}\r\n"
+        head += "Transfer-Encoding: chunked\r\n" if chunked else f"Content-Length: {len(body)}\r\n"
+        if version == b'HTTP/1.1' and not keepAlive: head += "Connection: close\r\n"
+        for headkey, headval in self.headers.items():
+            head += f"{headkey.decode()}: {headval.decode()}\r\n"
+        writer.write(head.encode() + b'\r\n')
+        for i in range(0, len(body), 65536):
+            if self.trickle: await asyncio.sleep(self.trickle)
+            piece = body[i:i + 65536]
+            writer.write(b'%x\r\n%s\r\n' % (len(piece), piece) if chunked else piece)
+            await writer.drain()
+        if chunked: writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return keepAlive
+
+class EchoServer:
+    '''Plain TCP server that sends back whatever it receives, standing in for a TLS origin
+    behind a ``CONNECT`` tunnel. Each connection is served by its own thread, and closed
+    once everything the client sent before closing its side has been echoed.'''
+    def __init__(self, address: str = '127.0.0.1', port: int = 0):
+        self.address = address
+        self.port = port
+        self.connections = 0 # Number of connections accepted
+        self._listener = None
+        self._thread = None
+
+    def start(self) -> 'EchoServer':
+        '''Starts serving on a background thread. Returns once the server is listening.'''
+        self._listener = socket.create_server((self.address, self.port), backlog=4096)
+        self.port = self._listener.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        '''Stops accepting connections. Connections being served finish on their own.'''
+        self._listener.shutdown(socket.SHUT_RDWR)
+        self._listener.close()
+        self._thread.join()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            threading.Thread(target=self._echo, args=[conn], daemon=True).start()
+
+    def _echo(self, conn: socket.socket) -> None:
+        buffer = bytearray(65536)
+        view = memoryview(buffer)
+        with conn:
+            try:
+                while n := conn.recv_into(buffer):
+                    conn.sendall(view[:n])
+                conn.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+def main():
+    parser = OptionParser()
+    parser.add_option('-p', type='int', dest='port', default=8080)
+    parser.add_option('-a', type='string', dest='address', default='localhost')
+    parser.add_option('-s', type='int', dest='bodySize', default=1024, help='response body size in bytes')
+    parser.add_option('-d', type='float', dest='latency', default=0.0, help='delay before each response in seconds')
+    (options, args) = parser.parse_args()
+
+    origin = OriginServer(options.address, options.port, options.bodySize, options.latency).start()
+    print(f"Serving on {options.address}:{origin.port}")
+    try:
+        while True: time.sleep(1)
+    except KeyboardInterrupt:
+        origin.stop()
+
+if __name__ == '__main__':
+    main()
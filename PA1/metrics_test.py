@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# Checks the latency histograms and the counters served at /proxy/stats.
+
+import json
+
+from HTTPproxy import LatencyHistogram
+from bench_util import free_port, start_proxy, stop_proxy, send
+from local_origin import OriginServer
+
+# Percentiles are bucket upper bounds, capped at the largest latency seen
+histogram = LatencyHistogram()
+for ms in [1] * 90 + [10] * 9 + [100]:
+    histogram.record(ms / 1000)
+summary = histogram.summary()
+assert summary['count'] == 100 and summary['maxMs'] == 100
+assert 1 <= summary['p50Ms'] < 2 and 10 <= summary['p99Ms'] < 20, summary
+assert abs(summary['meanMs'] - 2.8) < 1e-9, summary
+assert LatencyHistogram().summary()['p99Ms'] == 0
+
+def stats(port: int) -> dict[str, str]:
+    body = send(port, b'GET http://localhost/proxy/stats HTTP/1.0\r\n\r\n').split(b'\r\n\r\n', 1)[1]
+    return dict(line.split(': ') for line in body.decode().splitlines())
+
+origin = OriginServer('127.0.0.1', bodySize=10000, headers={b'Cache-Control': b'max-age=60'}).start()
+for engine in ('thread', 'async'):
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine)
+    try:
+        send(port, b'GET http://localhost/proxy/cache/enable HTTP/1.0\r\n\r\n')
+        for _ in range(3): # A miss, then two hits
+            assert send(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n').endswith(b'x' * 10000)
+        send(port, b'GET http://localhost/proxy/blocklist/add/127.0.0.1 HTTP/1.0\r\n\r\n')
+        send(port, b'GET http://localhost/proxy/blocklist/enable HTTP/1.0\r\n\r\n')
+        assert send(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 403')
+        assert send(port, b'GIBBERISH\r\n\r\n').startswith(b'HTTP/1.0 400')
+
+        current = stats(port) # The proxy's readiness probe connected without sending a request
+        assert current['connections'] == '10' and current['active'] == '1', current
+        assert current['rejected 403'] == '1' and current['rejected 400'] == '1'
+        assert current['cacheHitRatio'] == str(round(2 / 3, 4)), current['cacheHitRatio']
+        assert 10000 < int(current['bytesFromServers']) < 11000
+        assert int(current['bytesToClients']) > 3 * 10000
+        assert current['receive count'] == '9' and current['parse count'] == '9'
+        assert current['connect count'] == '1' and current['transfer count'] == '1'
+        assert current['blocklist count'] == '2' and current['cache count'] == '3' # Settings requests included
+        assert float(current['transfer p99Ms']) >= float(current['transfer p50Ms']) > 0
+
+        response = send(port, b'GET http://localhost/proxy/stats/json HTTP/1.0\r\n\r\n')
+        head, body = response.split(b'\r\n\r\n', 1)
+        assert b'Content-Type: application/json' in head
+        snapshot = json.loads(body)
+        assert snapshot['connections'] == 11 and snapshot['rejections'] == {'403': 1, '400': 1}
+        assert set(snapshot['stages']) == {'receive', 'parse', 'blocklist', 'cache', 'connect', 'transfer', 'send'}
+        assert snapshot['stages']['send']['count'] == 9
+    finally:
+        stop_proxy(proxy)
+origin.stop()
+print('All tests passed!')
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Measures request parsing and head scanning, against the original implementations.
+
+import re
+import timeit
+
+from HTTPproxy import parse_request, RequestReader, ParseError, host_blocked
+
+def legacy_parse_request(message: bytes):
+    '''``parse_request`` as it was before the patterns were precompiled.'''
+    try:
+        message_tokens = message.split(maxsplit=3)
+        assert len(message_tokens) >= 3
+        method = message_tokens[0]
+        assert method in [b'GET', b'HEAD', b'OPTIONS', b'TRACE', b'PUT', b'DELETE', b'POST', b'PATCH', b'CONNECT']
+        if method != b'GET':
+            return ParseError.NOTIMPL, None, None, None, None
+        url_match = re.fullmatch(rb"http:\/\/([^:]+?)(?::(\d+)|)(/.*)", message_tokens[1])
+        assert url_match
+        host = url_match[1]
+        port = int(url_match[2]) if url_match[2] else 80
+        path = url_match[3]
+        if host_blocked(host):
+            return ParseError.FORBID, None, None, None, None
+        assert message_tokens[2] == b'HTTP/1.0'
+        headers = {}
+        if len(message_tokens) == 4:
+            for header_line in message_tokens[-1].split(b'\r\n'):
+                if not header_line: break
+                assert re.match(rb'\S+: .+', header_line)
+                mh_key, mh_value = (i.strip() for i in header_line.split(b': ', maxsplit=1))
+                headers[mh_key] = mh_value
+    except AssertionError:
+        return ParseError.BADREQ, None, None, None, None
+    return None, host, port, path, headers
+
+def legacy_receive(pieces: list[bytes]) -> bytes:
+    '''The original ``receive_request`` loop, fed from memory.'''
+    request = b''
+    pieces = iter(pieces)
+    while b'\r\n\r\n' not in request:
+        request += next(pieces)
+    return request
+
+def reader_receive(pieces: list[bytes]) -> memoryview:
+    reader = RequestReader(maxSize=1 << 20)
+    for piece in pieces:
+        if reader.feed(piece): break
+    return reader.head()
+
+browser = (b'GET http://www.flux.utah.edu/cs4480/simple.html HTTP/1.0\r\nHost: www.flux.utah.edu\r\n'
+           b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0\r\n'
+           b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+           b'Accept-Language: en-US,en;q=0.5\r\nAccept-Encoding: gzip, deflate\r\nConnection: close\r\n'
+           b'Cookie: ' + b'session=0123456789abcdef; ' * 8 + b'\r\n\r\n')
+malformed = [b'GIBBERISH http://www.flux.utah.edu/cs4480/simple.html HTTP/1.0\r\n\r\n',
+             b'GET http://www.flux.utah.edu/cs4480/simple.html HTTP/1.0\r\nConnection:close\r\n\r\n',
+             b'GET http://www.flux.utah.edu HTTP/1.0\r\n\r\n',
+             b'GET http://www.flux.utah.edu/cs4480/simple.html HTTP/1.1\r\n\r\n']
+cases = [('minimal request', [b'GET http://www.google.com/ HTTP/1.0\r\n\r\n']), ('malformed', malformed),
+         ('browser request', [browser])]
+
+def per_call(function, messages: list, number: int) -> float:
+    return min(timeit.repeat(lambda: [function(message) for message in messages], number=number, repeat=5)) \
+        / number / len(messages) * 1e6
+
+print(f"{'parse':<16} {'legacy':>10} {'current':>10}")
+for name, messages in cases:
+    print(f"{name:<16} {per_call(legacy_parse_request, messages, 2000):>8.2f}us "
+          f"{per_call(parse_request, messages, 2000):>8.2f}us")
+
+print(f"\n{'scan head':<16} {'legacy':>10} {'current':>10}")
+for size in (1024, 16 * 1024, 256 * 1024):
+    head = b'GET http://localhost/ HTTP/1.0\r\n' + b'X-Filler: ' + b'x' * size + b'\r\n\r\n'
+    pieces = [head[i:i + 2048] for i in range(0, len(head), 2048)]
+    number = max(1, 200000 // size)
+    print(f"{str(size // 1024) + ' KB':<16} {per_call(legacy_receive, [pieces], number):>8.1f}us "
+          f"{per_call(reader_receive, [pieces], number):>8.1f}us")
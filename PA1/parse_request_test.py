@@ -27,7 +27,13 @@ requests = [
     (b'GET http://www.flux.utah.edu/cs4480/simple.html gibberish\r\n\r\n', badreq),
     # 103.5) Requests should include the specified headers [0.5 points]
     (b'GET http://localhost:8080/simple.html HTTP/1.0\r\nConnection: close\r\nUser-Agent: Mozilla/5.0 (Macintosh; Intel Mac OS X 10.9; rv:50.0) Firefox/50.0\r\n\r\n',
-      (None, b'localhost', 8080, b'/simple.html', {b'Connection': b'close', b'User-Agent': b'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.9; rv:50.0) Firefox/50.0'}))
+      (None, b'localhost', 8080, b'/simple.html', {b'Connection': b'close', b'User-Agent': b'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.9; rv:50.0) Firefox/50.0'})),
+    # CONNECT tunnels to host:port, with either protocol version
+    (b'CONNECT www.google.com:443 HTTP/1.1\r\nHost: www.google.com:443\r\n\r\n', (None, b'www.google.com', 443, None, {b'Host': b'www.google.com:443'})),
+    (b'CONNECT localhost:8443 HTTP/1.0\r\n\r\n', (None, b'localhost', 8443, None, {})),
+    (b'CONNECT www.google.com HTTP/1.1\r\n\r\n', badreq),
+    (b'CONNECT http://www.google.com:443/ HTTP/1.0\r\n\r\n', badreq),
+    (b'CONNECT www.google.com:443 HTTP/2.0\r\n\r\n', badreq),
 ]
 
 for request, expected in requests:
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Checks prefetching the resources embedded in cached HTML pages.
+
+import time
+
+from HTTPproxy import find_embedded_resources
+from bench_util import free_port, start_proxy, stop_proxy, send
+from local_origin import OriginServer
+
+# Only same-origin resources that a page embeds are prefetched, each once
+page = b'''<html><head>
+<link rel="stylesheet" href="/style.css"><link rel=icon href='favicon.ico'><link rel="canonical" href="/other">
+<script src="app.js?v=2#main"></script><script>inline()</script>
+</head><body>
+<img src="/img/a.png"> <IMG SRC="img/b.png" alt="b"> <img src="/img/a.png">
+<img src="http://EXAMPLE.com/abs.png"> <img src="http://example.com:8080/port.png"> <img src="//cdn.example.net/c.png">
+<img src="https://example.com/secure.png"> <img src="data:image/png;base64,AAAA"> <a href="/page.html">link</a>
+<img src="http://example.com:x/bad.png"> <img src="../up.png"> <img src="/docs/">
+</body></html>'''
+assert find_embedded_resources(b'example.com', 80, b'/docs/', page) == [
+    b'/style.css', b'/docs/favicon.ico', b'/docs/app.js?v=2', b'/img/a.png', b'/docs/img/b.png', b'/abs.png', b'/up.png']
+onPort = find_embedded_resources(b'example.com', 8080, b'/', page)
+assert b'/port.png' in onPort and b'/abs.png' not in onPort and b'/style.css' in onPort
+assert find_embedded_resources(b'example.com', 80, b'/', b'no links here') == []
+
+def stats(port: int) -> dict[str, str]:
+    body = send(port, b'GET http://localhost/proxy/prefetch/stats HTTP/1.0\r\n\r\n').split(b'\r\n\r\n', 1)[1]
+    return dict(line.split(': ') for line in body.decode().splitlines())
+
+def settle(port: int, pending: int = 0) -> dict[str, str]:
+    '''Waits for the prefetches in progress to finish and returns the stats.'''
+    for _ in range(100):
+        if (current := stats(port))['pending'] == str(pending): return current
+        time.sleep(0.05)
+    raise AssertionError(current)
+
+images = b''.join(b'<img src="/size/%d/img">' % n for n in range(1, 6))
+pages = {b'/index.html': (b'text/html; charset=utf-8', b'<script src="/size/100/app.js"></script>' + images),
+         b'/other.html': (b'text/html', images + b'<img src="/size/6/img">'),
+         b'/plain.txt': (b'text/plain', images)}
+for engine in ('thread', 'async'):
+    origin = OriginServer('127.0.0.1', headers={b'Cache-Control': b'max-age=60'}, pages=pages).start()
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine, '--prefetch-budget', '4')
+    try:
+        send(port, b'GET http://localhost/proxy/cache/enable HTTP/1.0\r\n\r\n')
+
+        # Off by default
+        assert send(port, b'GET ' + origin.url('/other.html') + b' HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 200')
+        assert stats(port)['prefetch'] == 'disabled' and stats(port)['pages'] == '0'
+        assert send(port, b'GET http://localhost/proxy/prefetch/enable HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 200')
+
+        # A cached page's resources are fetched ahead of time, up to the budget
+        response = send(port, b'GET ' + origin.url('/index.html') + b' HTTP/1.0\r\n\r\n')
+        assert response.startswith(b'HTTP/1.0 200') and response.endswith(images)
+        current = settle(port)
+        assert current['prefetch'] == 'enabled' and current['pages'] == '1' and current['found'] == '6', current
+        assert current['fetched'] == '4' and current['dropped'] == '2' and current['hits'] == '0', current
+        assert origin.requests == 6
+
+        # Requests for them are served from the cache and counted as hits, once each
+        for path in ('/size/100/app.js', '/size/1/img', '/size/2/img', '/size/2/img'):
+            assert send(port, b'GET ' + origin.url(path) + b' HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 200')
+        assert origin.requests == 6
+        current = stats(port)
+        assert current['hits'] == '3' and current['hitRatio'] == '0.75', current
+
+        # Resources already cached aren't fetched again, and non-HTML responses aren't scanned
+        send(port, b'GET ' + origin.url('/other.html') + b' HTTP/1.0\r\n\r\n') # Still cached, so not scanned
+        send(port, b'GET ' + origin.url('/plain.txt') + b' HTTP/1.0\r\n\r\n')
+        send(port, b'GET http://localhost/proxy/cache/flush HTTP/1.0\r\n\r\n')
+        send(port, b'GET ' + origin.url('/size/1/img') + b' HTTP/1.0\r\n\r\n')
+        send(port, b'GET ' + origin.url('/other.html') + b' HTTP/1.0\r\n\r\n')
+        current = settle(port)
+        assert current['pages'] == '2' and current['skipped'] == '1' and current['fetched'] == '7', current
+        assert origin.paths[b'/size/1/img'] == 2 and origin.paths[b'/size/4/img'] == 1 and origin.paths[b'/size/6/img'] == 0
+
+        # Turned off again, pages aren't scanned
+        send(port, b'GET http://localhost/proxy/prefetch/disable HTTP/1.0\r\n\r\n')
+        send(port, b'GET http://localhost/proxy/cache/flush HTTP/1.0\r\n\r\n')
+        send(port, b'GET ' + origin.url('/index.html') + b' HTTP/1.0\r\n\r\n')
+        assert settle(port)['pages'] == '2' and stats(port)['prefetch'] == 'disabled'
+    finally:
+        stop_proxy(proxy)
+        origin.stop()
+print('All tests passed!')
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# Load tests the proxy offline against a local origin, with many concurrent clients requesting
+# a Zipf-distributed set of objects, in each cache and blocklist configuration.
+# Reports throughput, latency percentiles, the proxy's peak memory and the cache hit ratio.
+# Usage: proxy_bench.py [options], see --help. The defaults run every scenario in about a minute.
+
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from optparse import OptionParser
+
+from bench_util import free_port, start_proxy, stop_proxy, send, send_async, percentile
+from local_origin import OriginServer
+
+SCENARIOS = {
+    'baseline': (False, False),
+    'cache': (True, False),
+    'blocklist': (False, True),
+    'cache+blocklist': (True, True),
+}
+
+def peak_rss(pid: int) -> float:
+    '''Peak resident memory of process ``pid`` in MB, or NaN where /proc isn't available.'''
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'): return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float('nan')
+
+def write_blocklist(path: str, size: int, rng: random.Random) -> None:
+    '''Writes ``size`` random domains, none of which match the origin.'''
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    with open(path, 'w') as file:
+        for _ in range(size):
+            file.write(''.join(rng.choices(letters, k=rng.randint(5, 12))) + rng.choice(['.com', '.net', '.org']) + '\n')
+
+def workload(options, origin: OriginServer, rng: random.Random) -> list[bytes]:
+    '''Requests for ``options.objects`` objects of the given sizes, the k-th most popular
+    requested with probability proportional to 1/k.'''
+    sizes = [int(size) for size in options.sizes.split(',')]
+    urls = [origin.url(f'/size/{sizes[i % len(sizes)]}/{i}') for i in range(options.objects)]
+    weights = [1 / rank for rank in range(1, len(urls) + 1)]
+    return [b'GET ' + url + b' HTTP/1.0\r\n\r\n' for url in rng.choices(urls, weights, k=options.requests)]
+
+async def drive(port: int, messages: list[bytes], clients: int) -> tuple[list[float], int, int]:
+    '''Sends ``messages`` through the proxy from ``clients`` concurrent clients.
+    Returns the latencies of successful requests, the bytes they received and the number of failures.'''
+    queue = iter(messages)
+    latencies, received, failures = [], 0, 0
+    async def client():
+        nonlocal received, failures
+        for msg in queue:
+            try:
+                response, elapsed = await send_async(port, msg)
+            except (OSError, asyncio.TimeoutError):
+                failures += 1
+                continue
+            if not response.startswith(b'HTTP/1.0 200'):
+                failures += 1
+                continue
+            latencies.append(elapsed)
+            received += len(response)
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return latencies, received, failures
+
+def run(name: str, options, workDir: str) -> dict:
+    cache, blocklist = SCENARIOS[name]
+    rng = random.Random(options.seed)
+    origin = OriginServer('127.0.0.1', latency=options.latency,
+                          headers={b'Cache-Control': b'max-age=3600'}).start()
+    args = ['-e', options.engine, *options.proxyArgs.split()]
+    if blocklist:
+        blocklistPath = os.path.join(workDir, 'blocklist')
+        write_blocklist(blocklistPath, options.blocklistSize, rng)
+        args += ['--blocklist-file', blocklistPath]
+    port = free_port()
+    proxy = start_proxy(port, *args)
+    try:
+        if cache: send(port, b'GET http://localhost/proxy/cache/enable HTTP/1.0\r\n\r\n')
+        messages = workload(options, origin, rng)
+        start = time.perf_counter()
+        latencies, received, failures = asyncio.run(drive(port, messages, options.clients))
+        elapsed = time.perf_counter() - start
+        stats = json.loads(send(port, b'GET http://localhost/proxy/stats/json HTTP/1.0\r\n\r\n').split(b'\r\n\r\n', 1)[1])
+        rss = peak_rss(proxy.pid)
+    finally:
+        stop_proxy(proxy)
+        origin.stop()
+    return {'scenario': name, 'requests': len(messages), 'failures': failures,
+            'throughput': len(latencies) / elapsed, 'mbPerSecond': received / elapsed / 1e6,
+            'p50Ms': percentile(latencies, 50) * 1000, 'p99Ms': percentile(latencies, 99) * 1000,
+            'peakRssMb': rss, 'hitRatio': stats['cacheHitRatio'], 'originRequests': origin.requests}
+
+def main():
+    parser = OptionParser(description='Load tests the proxy against a local origin.')
+    parser.add_option('-n', '--requests', type='int', dest='requests', default=2000, help='requests per scenario')
+    parser.add_option('-c', '--clients', type='int', dest='clients', default=50, help='concurrent clients')
+    parser.add_option('--objects', type='int', dest='objects', default=200, help='distinct objects requested')
+    parser.add_option('--sizes', type='string', dest='sizes', default='1024,16384,131072',
+                      help='comma-separated object sizes in bytes, assigned to objects in turn')
+    parser.add_option('--latency', type='float', dest='latency', default=0.01, help='origin latency in seconds')
+    parser.add_option('--blocklist-size', type='int', dest='blocklistSize', default=10000,
+                      help='hosts in the blocklist of the blocklist scenarios')
+    parser.add_option('-e', '--engine', type='choice', choices=['thread', 'async'], dest='engine', default='thread')
+    parser.add_option('--proxy-args', type='string', dest='proxyArgs', default='',
+                      help='extra proxy command line arguments, e.g. "--keepalive"')
+    parser.add_option('-s', '--scenario', action='append', choices=list(SCENARIOS), dest='scenarios',
+                      help='scenario to run (repeatable); all by default')
+    parser.add_option('--seed', type='int', dest='seed', default=4480, help='seed for the workload and blocklist')
+    parser.add_option('--json', type='string', dest='json', help='also write the results to this file')
+    (options, args) = parser.parse_args()
+
+    print(f"{options.requests} requests per scenario from {options.clients} clients, {options.objects} objects "
+          f"of {options.sizes} bytes, origin latency {options.latency * 1000:.0f} ms, {options.engine} engine")
+    print(f"{'scenario':<16} {'req/s':>8} {'MB/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'failed':>6} "
+          f"{'peak MB':>8} {'hit ratio':>9} {'origin':>6}")
+    results = []
+    with tempfile.TemporaryDirectory() as workDir:
+        for name in options.scenarios or SCENARIOS:
+            result = run(name, options, workDir)
+            results.append(result)
+            print(f"{name:<16} {result['throughput']:>8.0f} {result['mbPerSecond']:>7.1f} {result['p50Ms']:>8.2f} "
+                  f"{result['p99Ms']:>8.2f} {result['failures']:>6} {result['peakRssMb']:>8.1f} "
+                  f"{result['hitRatio']:>9.3f} {result['originRequests']:>6}")
+    if options.json:
+        with open(options.json, 'w') as file:
+            json.dump({'options': vars(options), 'results': results}, file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+# Checks the incremental request reader and the request timeout and size limits.
+
+import time
+from socket import *
+
+from HTTPproxy import RequestReader, MAX_REQUEST_HEAD
+from bench_util import free_port, start_proxy, stop_proxy, send
+from local_origin import OriginServer
+
+# The end of the head is found however the request is split up
+request = b'GET http://localhost/ HTTP/1.0\r\nUser-Agent: test\r\n\r\n'
+for size in range(1, len(request) + 1):
+    reader = RequestReader()
+    pieces = [request[i:i + size] for i in range(0, len(request), size)]
+    done = [reader.feed(memoryview(piece)) for piece in pieces]
+    assert done == [False] * (len(pieces) - 1) + [True] and bytes(reader.head()) == request
+
+# Anything sent after the head is left out of it
+reader = RequestReader()
+assert reader.feed(request + b'body') and bytes(reader.head()) == request
+
+# Heads over the limit are refused, even before they're complete
+reader = RequestReader(maxSize=100)
+assert not reader.feed(b'x' * 100) and reader.feed(b'x') and reader.overflowed
+reader = RequestReader(maxSize=100)
+assert reader.feed(b'x' * 200 + b'\r\n\r\n') and reader.overflowed
+
+origin = OriginServer().start()
+for engine in ('thread', 'async'):
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine, '--request-timeout', '0.5')
+    try:
+        # A client that never finishes its request gets a 408 once the deadline passes
+        with create_connection(('localhost', port)) as sock:
+            start = time.monotonic()
+            sock.sendall(b'GET ' + origin.url('/') + b' HTTP/1.0\r\n')
+            response = sock.makefile('rb').read()
+            assert response.startswith(b'HTTP/1.0 408 Request Timeout'), response
+            assert 0.4 < time.monotonic() - start < 2
+
+        # The deadline covers the whole head, not each read
+        with create_connection(('localhost', port)) as sock:
+            start = time.monotonic()
+            sock.sendall(b'GET ' + origin.url('/') + b' HTTP/1.0\r\n')
+            time.sleep(0.3)
+            sock.sendall(b'X-Slow: 1\r\n')
+            assert sock.makefile('rb').read().startswith(b'HTTP/1.0 408 Request Timeout')
+            assert time.monotonic() - start < 0.75
+
+        # Oversized heads get a 431
+        response = send(port, b'GET ' + origin.url('/') + b' HTTP/1.0\r\nX-Big: ' + b'x' * MAX_REQUEST_HEAD + b'\r\n\r\n')
+        assert response.startswith(b'HTTP/1.0 431 Request Header Fields Too Large'), response
+
+        # Clients that give up early don't take the proxy down with them
+        with create_connection(('localhost', port)) as sock:
+            sock.sendall(b'GET ' + origin.url('/'))
+        with create_connection(('localhost', port)) as sock:
+            for byte in b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n':
+                sock.send(bytes([byte]))
+            assert sock.makefile('rb').read().startswith(b'HTTP/1.0 200 OK')
+    finally:
+        stop_proxy(proxy)
+origin.stop()
+print('All tests passed!')
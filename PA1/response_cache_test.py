@@ -0,0 +1,72 @@
+import threading
+from wsgiref.handlers import format_date_time
+
+from HTTPproxy import ResponseCache, CacheEntry, get_cache_key
+
+# Keys are compact regardless of port
+assert get_cache_key(b'www.flux.utah.edu', 80, b'/cs4480/simple.html') == b'www.flux.utah.edu:80/cs4480/simple.html'
+assert get_cache_key(b'localhost', 8080, b'/') == b'localhost:8080/'
+
+# Least recently used entry is evicted once the entry cap is reached
+cache = ResponseCache(maxBytes=1024, maxEntries=2)
+cache.put(b'a', b'1')
+cache.put(b'b', b'2')
+assert cache.get(b'a') == b'1' # 'b' is now least recently used
+cache.put(b'c', b'3')
+assert cache.get(b'b') is None
+assert cache.get(b'a') == b'1' and cache.get(b'c') == b'3'
+assert (cache.hits, cache.misses, cache.evictions) == (3, 1, 1)
+
+# Byte budget counts keys and responses
+cache = ResponseCache(maxBytes=100, maxEntries=100)
+for i in range(10):
+    cache.put(b'k%d' % i, b'x' * 38) # 40 bytes each
+assert len(cache) == 2 and cache.size == 80 and cache.evictions == 8
+assert cache.get(b'k9') and cache.get(b'k8')
+
+# Replacing an entry doesn't double count it, and oversized responses are skipped
+cache.put(b'k9', b'y' * 10)
+assert cache.size == 52
+cache.put(b'huge', b'z' * 1000)
+assert cache.get(b'huge') is None and cache.size == 52
+
+cache.clear()
+assert len(cache) == 0 and cache.size == 0
+
+# Concurrent writers keep the cache within its bounds
+cache = ResponseCache(maxBytes=10000, maxEntries=50)
+def writer(n: int):
+    for i in range(2000):
+        cache.put(b'%d-%d' % (n, i % 300), b'v' * (i % 90))
+        cache.get(b'%d-%d' % (n, (i * 7) % 300))
+threads = [threading.Thread(target=writer, args=[n]) for n in range(8)]
+for thread in threads: thread.start()
+for thread in threads: thread.join()
+assert cache.size <= cache.maxBytes and len(cache) <= cache.maxEntries
+assert cache.size == sum(len(k) + len(v) for k, v in cache._entries.items())
+
+# Freshness lifetime comes from Cache-Control, then Expires, then Last-Modified
+now = 1_700_000_000.0
+date = format_date_time(now).encode()
+def entry(**headers: bytes) -> CacheEntry:
+    return CacheEntry(b'', {b'date': date} | {k.replace('_', '-').encode(): v for k, v in headers.items()}, now)
+assert entry(cache_control=b'max-age=60').is_fresh(now + 59)
+assert not entry(cache_control=b'max-age=60').is_fresh(now + 61)
+assert entry(cache_control=b'max-age=60, s-maxage=600').is_fresh(now + 300)
+assert not entry(cache_control=b'no-cache, max-age=60').is_fresh(now)
+assert entry(expires=format_date_time(now + 30).encode()).is_fresh(now + 29)
+assert not entry(expires=b'0').is_fresh(now)
+assert entry(last_modified=format_date_time(now - 1000).encode()).is_fresh(now + 99)
+assert not entry(last_modified=format_date_time(now - 1000).encode()).is_fresh(now + 101)
+assert not entry().is_fresh(now)
+assert not entry(cache_control=b'max-age=60', age=b'100').is_fresh(now)
+
+# Revalidation uses the real Last-Modified, falling back to Date
+assert entry(last_modified=b'Tue, 01 Jan 2030 00:00:00 GMT').validator() == b'Tue, 01 Jan 2030 00:00:00 GMT'
+assert entry().validator() == date
+
+# A 304 refreshes the metadata but keeps Last-Modified
+stale = entry(cache_control=b'max-age=10', last_modified=b'Tue, 01 Jan 2030 00:00:00 GMT')
+stale.update({b'date': format_date_time(now + 100).encode(), b'cache-control': b'max-age=10'}, now + 100)
+assert stale.is_fresh(now + 105) and stale.lastModified == b'Tue, 01 Jan 2030 00:00:00 GMT'
+print('All tests passed!')
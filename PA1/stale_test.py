@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Checks serving stale cached responses: while they're refreshed in the background, and in place of server errors.
+
+import asyncio
+import time
+from wsgiref.handlers import format_date_time
+
+import HTTPproxy
+from HTTPproxy import CacheEntry, ResponseRelay
+from bench_util import free_port, start_proxy, stop_proxy, send, send_async
+from local_origin import OriginServer
+
+# Stale windows come from the response, then the proxy's settings; some responses may never be served stale
+now = 1_700_000_000.0
+def entry(cacheControl: bytes) -> CacheEntry:
+    return CacheEntry(b'HTTP/1.0 200 OK\r\n\r\ncached', {b'date': format_date_time(now).encode(),
+                                                         b'cache-control': cacheControl}, now)
+assert entry(b'max-age=10, stale-while-revalidate=30').serves_while_revalidating(now + 39)
+assert not entry(b'max-age=10, stale-while-revalidate=30').serves_while_revalidating(now + 41)
+assert not entry(b'max-age=10').serves_while_revalidating(now + 11) # Off by default
+HTTPproxy.staleWhileRevalidate = HTTPproxy.staleIfError = 5
+assert entry(b'max-age=10').serves_while_revalidating(now + 14) and not entry(b'max-age=10').serves_while_revalidating(now + 16)
+assert entry(b'max-age=10, stale-if-error=60').serves_on_error(now + 69)
+for directive in (b'must-revalidate', b'proxy-revalidate', b'no-cache', b's-maxage=10'):
+    assert not entry(b'max-age=10, stale-if-error=60, ' + directive).serves_on_error(now + 11), directive
+
+# A server error is replaced by a stale response that may stand in for it
+HTTPproxy.cacheEnabled = True
+stale = CacheEntry(b'HTTP/1.0 200 OK\r\n\r\ncached', {b'cache-control': b'max-age=0'})
+relay = ResponseRelay(b'localhost', 80, b'/', stale)
+assert relay.feed(memoryview(b'HTTP/1.0 503 Service Unavailable\r\n\r\n')) == [stale.response]
+assert relay.done and relay.usesCached and relay.finish() == b''
+relay = ResponseRelay(b'localhost', 80, b'/', stale, staleOnError=False)
+assert relay.feed(memoryview(b'HTTP/1.0 503 Service Unavailable\r\n\r\n'))[0].startswith(b'HTTP/1.0 503')
+HTTPproxy.cacheEnabled = False
+
+def stats(port: int) -> dict[str, str]:
+    body = send(port, b'GET http://localhost/proxy/cache/stats HTTP/1.0\r\n\r\n').split(b'\r\n\r\n', 1)[1]
+    return dict(line.split(': ') for line in body.decode().splitlines())
+
+async def concurrently(port: int, msg: bytes, clients: int) -> list[tuple[bytes, float]]:
+    return await asyncio.gather(*(send_async(port, msg) for _ in range(clients)))
+
+for engine in ('thread', 'async'):
+    origin = OriginServer('127.0.0.1', latency=0.5, headers={b'Cache-Control': b'max-age=1'}).start()
+    request = b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n'
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine)
+    try:
+        send(port, b'GET http://localhost/proxy/cache/enable HTTP/1.0\r\n\r\n')
+        assert send(port, b'GET http://localhost/proxy/cache/stale-while-revalidate/30 HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 200')
+        assert send(port, b'GET http://localhost/proxy/cache/stale-if-error/x HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 400')
+        assert send(port, request).startswith(b'HTTP/1.0 200') and origin.requests == 1
+        time.sleep(1.1)
+
+        # Stale responses are served without waiting for the origin, and refreshed once
+        results = asyncio.run(concurrently(port, request, 5))
+        assert all(response.startswith(b'HTTP/1.0 200') and elapsed < 0.4 for response, elapsed in results), results
+        time.sleep(0.7)
+        assert origin.requests == 2
+        current = stats(port)
+        assert current['stale servedStale'] == '5' and current['stale refreshed'] == '1', current
+        assert current['stale deduplicated'] == '4' and current['staleWhileRevalidate'] == '30'
+        start = time.perf_counter()
+        assert send(port, request).startswith(b'HTTP/1.0 200') and time.perf_counter() - start < 0.4
+        assert origin.requests == 2 # Fresh again
+
+        # Without a stale-if-error window, an unreachable origin is an error...
+        origin.stop()
+        send(port, b'GET http://localhost/proxy/cache/stale-while-revalidate/0 HTTP/1.0\r\n\r\n')
+        time.sleep(1.1)
+        assert send(port, request).startswith(b'HTTP/1.0 400')
+        # ...with one, the stale response stands in for it
+        send(port, b'GET http://localhost/proxy/cache/stale-if-error/60 HTTP/1.0\r\n\r\n')
+        assert send(port, request).endswith(b'x' * 1024)
+        assert stats(port)['stale servedOnError'] == '1'
+    finally:
+        stop_proxy(proxy)
+print('All tests passed!')
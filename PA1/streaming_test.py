@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+# Checks that both engines stream origin responses to the client as they arrive,
+# and only keep a copy of responses that can be cached.
+
+import time
+from socket import *
+
+from bench_util import free_port, start_proxy, stop_proxy, send
+from local_origin import OriginServer
+
+BODY_SIZE = 4 * 1024 * 1024
+CACHE_BYTES = 1024 * 1024
+
+def timed_get(port: int, url: bytes) -> tuple[bytes, float, float]:
+    '''GETs ``url`` through the proxy. Returns the response, time to first byte and total time.'''
+    start = time.perf_counter()
+    with create_connection(('localhost', port)) as sock:
+        sock.sendall(b'GET ' + url + b' HTTP/1.0\r\n\r\n')
+        chunks = [sock.recv(65536)]
+        firstByte = time.perf_counter() - start
+        while chunk := sock.recv(65536):
+            chunks.append(chunk)
+    return b''.join(chunks), firstByte, time.perf_counter() - start
+
+origin = OriginServer(trickle=0.02, headers={b'Cache-Control': b'max-age=60'}).start()
+for engine in ('thread', 'async'):
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine, '--cache-bytes', str(CACHE_BYTES))
+    try:
+        send(port, b'GET http://localhost/proxy/cache/enable HTTP/1.0\r\n\r\n')
+
+        # Large responses arrive incrementally and intact, but aren't cached
+        requests = origin.requests
+        response, firstByte, total = timed_get(port, origin.url(f'/size/{BODY_SIZE}'))
+        print(f"{engine:>6}: {BODY_SIZE} bytes, first byte after {firstByte * 1000:.0f} ms, all after {total * 1000:.0f} ms")
+        assert response.startswith(b'HTTP/1.0 200') and response.endswith(b'x' * BODY_SIZE)
+        assert firstByte < total / 4, "response was not streamed"
+        timed_get(port, origin.url(f'/size/{BODY_SIZE}'))
+        assert origin.requests == requests + 2, "oversized response was cached"
+
+        # Small cacheable responses are still cached
+        requests = origin.requests
+        first, _, _ = timed_get(port, origin.url('/size/1000'))
+        second, _, _ = timed_get(port, origin.url('/size/1000'))
+        assert first == second and first.endswith(b'x' * 1000)
+        assert origin.requests == requests + 1, "small response was not cached"
+    finally:
+        stop_proxy(proxy)
+origin.stop()
+print('All tests passed!')
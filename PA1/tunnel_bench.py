@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Measures CONNECT tunnel throughput for large transfers against a local echo server:
+# each tunnel sends its payload and reads it back. Compares the proxy's splice and copy relays
+# and its async engine with a naive Python forwarder and with no proxy at all.
+# Reports throughput and the CPU time the forwarding process spent per GB relayed.
+# Usage: tunnel_bench.py [options], see --help.
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+from optparse import OptionParser
+from socket import *
+
+from bench_util import free_port, start_proxy, stop_proxy
+from local_origin import EchoServer
+
+SCENARIOS = {
+    'direct': None, # Straight to the echo server
+    'naive': None, # recv/sendall forwarder, one thread per direction
+    'copy': ['-e', 'thread', '--tunnel-relay', 'copy'],
+    'splice': ['-e', 'thread', '--tunnel-relay', 'splice'],
+    'async': ['-e', 'async'],
+}
+
+def cpu_seconds(pid: int) -> float:
+    '''User plus system CPU time of process ``pid`` so far, or NaN where /proc isn't available.'''
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return float('nan')
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def naive_forwarder(listener: socket) -> None:
+    '''Serves tunnels the obvious way: reads the ``CONNECT`` head, connects, then copies each way
+    with ``recv`` and ``sendall`` in a thread per direction.'''
+    def copy(src: socket, dst: socket) -> None:
+        try:
+            while data := src.recv(65536): dst.sendall(data)
+            dst.shutdown(SHUT_WR)
+        except OSError:
+            pass
+    def serve(client: socket) -> None:
+        head = b''
+        while b'\r\n\r\n' not in head: head += client.recv(4096)
+        host, port = head.split(b' ', 2)[1].split(b':')
+        server = create_connection((host.decode(), int(port)))
+        client.sendall(b'HTTP/1.0 200 Connection established\r\n\r\n')
+        upstream = threading.Thread(target=copy, args=[client, server])
+        upstream.start()
+        copy(server, client)
+        upstream.join()
+        client.close()
+        server.close()
+    while True:
+        client, _ = listener.accept()
+        threading.Thread(target=serve, args=[client], daemon=True).start()
+
+def transfer(port: int, target: bytes | None, payload: bytes) -> float:
+    '''Sends ``payload`` through a tunnel to ``target`` via the proxy on ``port`` (straight to
+    the echo server on ``port`` if ``target`` is ``None``) and reads it back.
+    Returns the seconds it took.'''
+    start = time.perf_counter()
+    skt = create_connection(('127.0.0.1', port))
+    if target is not None:
+        skt.sendall(b'CONNECT ' + target + b' HTTP/1.1\r\n\r\n')
+        head = b''
+        while b'\r\n\r\n' not in head: head += skt.recv(1)
+        assert head.startswith(b'HTTP/1.0 200'), head
+    def write():
+        skt.sendall(payload)
+        skt.shutdown(SHUT_WR)
+    writer = threading.Thread(target=write)
+    writer.start()
+    buffer = bytearray(1024 * 1024)
+    received = 0
+    while n := skt.recv_into(buffer): received += n
+    writer.join()
+    skt.close()
+    assert received == len(payload), (received, len(payload))
+    return time.perf_counter() - start
+
+def run(name: str, options, echo: EchoServer, payload: bytes) -> dict:
+    target = b'127.0.0.1:%d' % echo.port
+    forwarder, proxy, pid = None, None, None
+    if name == 'direct':
+        port, target = echo.port, None
+    elif name == 'naive':
+        listener = create_server(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        forwarder = multiprocessing.Process(target=naive_forwarder, args=[listener], daemon=True)
+        forwarder.start()
+        listener.close()
+        pid = forwarder.pid
+    else:
+        port = free_port()
+        proxy = start_proxy(port, '-a', '127.0.0.1', *SCENARIOS[name])
+        pid = proxy.pid
+    try:
+        cpuBefore = cpu_seconds(pid) if pid else 0.0
+        threads = [threading.Thread(target=transfer, args=[port, target, payload]) for _ in range(options.tunnels)]
+        start = time.perf_counter()
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        elapsed = time.perf_counter() - start
+        cpu = cpu_seconds(pid) - cpuBefore if pid else 0.0
+    finally:
+        if proxy is not None: stop_proxy(proxy)
+        if forwarder is not None: forwarder.kill()
+    relayed = 2 * len(payload) * options.tunnels # Each byte crosses the tunnel twice
+    return {'scenario': name, 'seconds': elapsed, 'mbPerSecond': relayed / elapsed / 1e6,
+            'cpuSeconds': cpu, 'cpuSecondsPerGb': cpu / (relayed / 1e9)}
+
+def main():
+    parser = OptionParser(description='Measures CONNECT tunnel throughput against a local echo server.')
+    parser.add_option('-m', '--megabytes', type='int', dest='megabytes', default=256,
+                      help='payload sent (and echoed back) per tunnel, in MB')
+    parser.add_option('-c', '--tunnels', type='int', dest='tunnels', default=1, help='concurrent tunnels')
+    parser.add_option('-s', '--scenario', action='append', choices=list(SCENARIOS), dest='scenarios',
+                      help='scenario to run (repeatable); all by default')
+    parser.add_option('--json', type='string', dest='json', help='also write the results to this file')
+    (options, args) = parser.parse_args()
+
+    payload = os.urandom(options.megabytes * 1000 * 1000)
+    echo = EchoServer().start()
+    print(f"{options.tunnels} tunnel(s), each echoing {options.megabytes} MB")
+    print(f"{'scenario':<10} {'seconds':>8} {'MB/s':>8} {'CPU s':>7} {'CPU s/GB':>9}")
+    results = []
+    try:
+        for name in options.scenarios or SCENARIOS:
+            result = run(name, options, echo, payload)
+            results.append(result)
+            print(f"{name:<10} {result['seconds']:>8.2f} {result['mbPerSecond']:>8.1f} "
+                  f"{result['cpuSeconds']:>7.2f} {result['cpuSecondsPerGb']:>9.2f}")
+    finally:
+        echo.stop()
+    if options.json:
+        with open(options.json, 'w') as file:
+            json.dump({'options': vars(options), 'results': results}, file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Checks CONNECT tunneling through the proxy with each relay, against a local echo server.
+
+import os
+import threading
+import time
+from socket import *
+
+from bench_util import free_port, start_proxy, stop_proxy, send
+from local_origin import EchoServer
+
+def open_tunnel(port: int, target: bytes, early: bytes = b'') -> tuple[socket, bytes]:
+    '''Asks the proxy on ``port`` for a tunnel to ``target``, sending ``early`` right after the request.
+    Returns the connection and the response head, plus anything after it.'''
+    skt = create_connection(('localhost', port))
+    skt.sendall(b'CONNECT ' + target + b' HTTP/1.1\r\nHost: ' + target + b'\r\n\r\n' + early)
+    response = b''
+    while b'\r\n\r\n' not in response and (data := skt.recv(4096)): response += data
+    return skt, response
+
+def echo_through(skt: socket, payload: bytes) -> bytes:
+    '''Sends ``payload`` from a second thread while reading the echo, then closes the sending side
+    and reads until the tunnel closes.'''
+    def write():
+        skt.sendall(payload)
+        skt.shutdown(SHUT_WR)
+    writer = threading.Thread(target=write)
+    writer.start()
+    received = bytearray()
+    while data := skt.recv(65536): received += data
+    writer.join()
+    return bytes(received)
+
+echo = EchoServer().start()
+target = b'127.0.0.1:%d' % echo.port
+payload = os.urandom(8 * 1024 * 1024)
+for engine, relay in (('thread', 'splice'), ('thread', 'copy'), ('async', None)):
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine, '--max-concurrency', '2', *(['--tunnel-relay', relay] if relay else []))
+    try:
+        # Bytes arrive intact both ways, and a close on one side is passed on
+        skt, response = open_tunnel(port, target)
+        assert response == b'HTTP/1.0 200 Connection established\r\n\r\n', response
+        assert echo_through(skt, payload) == payload, engine
+        skt.close()
+
+        # Anything sent right after the request goes through the tunnel first
+        skt, response = open_tunnel(port, target, b'hello')
+        received = response.split(b'\r\n\r\n', 1)[1]
+        assert received + echo_through(skt, b' world') == b'hello world'
+        skt.close()
+
+        # Open tunnels don't hold the proxy's concurrency slots, so more clients than slots are served
+        held = [open_tunnel(port, target)[0] for _ in range(2)]
+        start = time.monotonic()
+        assert send(port, b'GET http://localhost/proxy/stats HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 200'), engine
+        skt, response = open_tunnel(port, target)
+        assert echo_through(skt, b'third') == b'third' and time.monotonic() - start < 0.5, engine
+        skt.close()
+        for skt in held:
+            skt.sendall(b'still open')
+            assert skt.recv(4096) == b'still open'
+            skt.close()
+
+        # Unreachable and blocked targets are refused
+        skt, response = open_tunnel(port, b'127.0.0.1:%d' % free_port())
+        assert response.startswith(b'HTTP/1.0 400'), response
+        skt.close()
+        send(port, b'GET http://localhost/proxy/blocklist/add/127.0.0.1 HTTP/1.0\r\n\r\n')
+        send(port, b'GET http://localhost/proxy/blocklist/enable HTTP/1.0\r\n\r\n')
+        skt, response = open_tunnel(port, target)
+        assert response.startswith(b'HTTP/1.0 403'), response
+        skt.close()
+        send(port, b'GET http://localhost/proxy/blocklist/disable HTTP/1.0\r\n\r\n')
+
+        deadline = time.monotonic() + 1 # Tunnels are counted just after passing on the last close
+        while b'\r\ntunnels: 5\r\n' not in (stats := send(port, b'GET http://localhost/proxy/stats HTTP/1.0\r\n\r\n')):
+            assert time.monotonic() < deadline, stats
+            time.sleep(0.01)
+    finally:
+        stop_proxy(proxy)
+echo.stop()
+print('All tests passed!')
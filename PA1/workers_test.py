@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+# Checks that --workers processes share one port, the cache contents and settings changes.
+
+import asyncio
+import time
+
+from bench_util import free_port, start_proxy, stop_proxy, send, send_async
+from local_origin import OriginServer
+
+CLIENTS = 40 # Separate connections, so the kernel spreads them over every worker
+
+async def burst(port: int, msg: bytes) -> list[bytes]:
+    return [response for response, _ in await asyncio.gather(*(send_async(port, msg) for _ in range(CLIENTS)))]
+
+def eventually(port: int, msg: bytes, status: bytes) -> None:
+    '''Waits for every worker to answer ``msg`` with ``status``, as settings reach them in the background.'''
+    deadline = time.monotonic() + 2
+    while not all(response.startswith(b'HTTP/1.0 ' + status) for response in asyncio.run(burst(port, msg))):
+        assert time.monotonic() < deadline, f"not every worker answers {status}"
+        time.sleep(0.05)
+
+def setting(port: int, path: bytes) -> None:
+    assert send(port, b'GET http://localhost' + path + b' HTTP/1.0\r\n\r\n').startswith(b'HTTP/1.0 200 OK')
+
+for engine in ('thread', 'async'):
+    origin = OriginServer('127.0.0.1', bodySize=5000, headers={b'Cache-Control': b'max-age=60'}).start()
+    port = free_port()
+    proxy = start_proxy(port, '-e', engine, '--workers', '2')
+    msg = b'GET ' + origin.url('/') + b' HTTP/1.0\r\n\r\n'
+    try:
+        # Without the cache every request reaches the origin
+        assert all(response.endswith(b'x' * 5000) for response in asyncio.run(burst(port, msg)))
+        assert origin.requests == CLIENTS
+
+        # Enabling the cache in one worker enables it in all of them, and they share its contents
+        setting(port, b'/proxy/cache/enable')
+        send(port, msg)
+        responses = asyncio.run(burst(port, msg))
+        assert all(response.endswith(b'x' * 5000) for response in responses)
+        assert origin.requests == CLIENTS + 1, f"{engine}: {origin.requests} origin requests"
+
+        # A flush empties every worker's cache
+        setting(port, b'/proxy/cache/flush')
+        send(port, msg)
+        asyncio.run(burst(port, msg))
+        assert origin.requests == CLIENTS + 2, f"{engine}: {origin.requests} origin requests"
+
+        # Blocklist changes reach every worker
+        setting(port, b'/proxy/blocklist/add/127.0.0.1')
+        setting(port, b'/proxy/blocklist/enable')
+        eventually(port, msg, b'403 Forbidden')
+        setting(port, b'/proxy/blocklist/remove/127.0.0.1')
+        eventually(port, msg, b'200 OK')
+    finally:
+        stop_proxy(proxy)
+        origin.stop()
+print('All tests passed!')
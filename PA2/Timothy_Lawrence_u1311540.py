@@ -2,17 +2,31 @@
 
 # Simple load balancing switch that maps a virtual IP address to multiple real server IP addresses 
 # using round-robin load balancing. Handles ICMP traffic, using ARP requests to determing server mapping.
+# Load-aware selection policies are available, fed by flow and port statistics polled from the switch.
+# Flow rules expire, so clients get reassigned; in proactive mode, rules for blocks of client addresses
+# are installed up front.
+# Any number of switches and virtual IPs can be served, with server pools loaded from a JSON config
+# file (see pools.json) that is reloaded when it changes.
 # Implemented using Mininet, POX, and OpenFlow.
 # Written by Tim Lawrence for CS4480, Spring 2025
 
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 import pox.lib.packet as pkt
-from pox.lib.addresses import IPAddr, EthAddr
+from pox.lib.addresses import IPAddr, EthAddr, parse_cidr
+from pox.lib.recoco import Timer
+from pox.lib.util import dpid_to_str, str_to_dpid
+import itertools
+import json
+import os
+import struct
+import time
+
+from selection_policies import LoadTracker, POLICIES, WeightedRoundRobinPolicy
 
 log = core.getLogger()
 
-# Hardcoded server configurations
+# Hardcoded server configurations, used without a config file
 SWITCH_IP = IPAddr('10.0.0.10')
 SERVER_IPS = [
     IPAddr('10.0.0.5'),
@@ -26,26 +40,331 @@ SERVER_PORTS = [
     5,
     6
 ]
+SERVER_WEIGHTS = [
+    1,
+    1
+]
+DEFAULT_POLICY = 'round-robin'
+DEFAULT_STATS_INTERVAL = 5 # Seconds between statistics polls, 0 to disable
+DEFAULT_IDLE_TIMEOUT = 30 # Seconds a client's flow rules last without traffic, 0 for no limit
+DEFAULT_HARD_TIMEOUT = 0 # Seconds a client's flow rules last at most, so it gets rebalanced; 0 for no limit
+DEFAULT_PROACTIVE_BUCKETS = 8 # Blocks the client network is split into in proactive mode
+DEFAULT_RELOAD_INTERVAL = 2 # Seconds between checks of the config file for changes, 0 to disable
+PROACTIVE_PRIORITY = of.OFP_DEFAULT_PRIORITY - 1 # Per-client rules take precedence
+
+# Ethernet type and the fixed ARP fields of an Ethernet/IPv4 ARP reply
+ARP_REPLY_HEADER = struct.pack('!HHHBBH', pkt.ethernet.ARP_TYPE, pkt.arp.HW_TYPE_ETHERNET, pkt.arp.PROTO_TYPE_IP,
+                               6, 4, pkt.arp.REPLY)
+ARP_FRAME_LENGTH = 42
+
+def arp_reply_frame(hwdst, hwsrc, protosrc, protodst):
+    '''Ethernet frame carrying an ARP reply from `hwsrc`/`protosrc` to `hwdst`/`protodst`, given as raw bytes.
+    Assembled directly rather than through `pkt.arp` and `pkt.ethernet`, since every reply has the same layout.'''
+    return hwdst + hwsrc + ARP_REPLY_HEADER + hwsrc + protosrc + hwdst + protodst
+
+class PacketOutTemplate:
+    '''A packet-out sending an ARP reply out of `port`, packed once. Each reply patches in a fresh xid and its frame.'''
+    def __init__(self, port):
+        msg = of.ofp_packet_out(data=bytes(ARP_FRAME_LENGTH))
+        msg.actions.append(of.ofp_action_output(port=port))
+        packed = msg.pack()
+        self._head = packed[:4] # Version, type and length
+        self._tail = packed[8:-ARP_FRAME_LENGTH] # Buffer ID, in port and actions
+    
+    def pack(self, frame):
+        return self._head + struct.pack('!I', of.generate_xid()) + self._tail + frame
+
+def default_pool_config(weights=SERVER_WEIGHTS):
+    '''Pool config for the hardcoded servers, with the given `weights`.'''
+    return {'vip': str(SWITCH_IP), 'servers': [
+        {'ip': str(ip), 'mac': str(mac), 'port': port, 'weight': weight}
+        for ip, mac, port, weight in zip(SERVER_IPS, SERVER_MACS, SERVER_PORTS, weights)]}
+
+def load_pool_configs(path):
+    '''Read and check the pool configs in the JSON file at `path`.
+    Raises ValueError (or OSError) if the file can't be used.'''
+    with open(path) as file:
+        configs = json.load(file).get('pools')
+    if not isinstance(configs, list) or not configs:
+        raise ValueError("Config has no pools")
+    for config in configs:
+        check_pool_config(config)
+    return configs
+
+def check_pool_config(config):
+    '''Raise ValueError if `config` isn't a usable pool config.'''
+    try:
+        IPAddr(config['vip'])
+        if not config['servers']:
+            raise ValueError(f"Pool for {config['vip']} has no servers")
+        for server in config['servers']:
+            IPAddr(server['ip'])
+            EthAddr(server['mac'])
+            int(server['port'])
+            if int(server.get('weight', 1)) < 1:
+                raise ValueError(f"Server {server['ip']} needs a positive weight")
+        if config.get('policy', DEFAULT_POLICY) not in POLICIES:
+            raise ValueError(f"Unknown policy {config['policy']}, expected one of {', '.join(POLICIES)}")
+        buckets = int(config.get('buckets', DEFAULT_PROACTIVE_BUCKETS))
+        if config.get('proactive') and (buckets < 1 or buckets & (buckets - 1) or
+                                        parse_cidr(config['proactive'])[1] + (buckets - 1).bit_length() > 32):
+            raise ValueError(f"Can't split {config['proactive']} into {buckets} blocks")
+        for dpid in config.get('dpids', []):
+            pool_dpid(dpid)
+    except (KeyError, TypeError, OSError, RuntimeError) as e: # Missing fields, bad addresses
+        raise ValueError(f"Malformed pool config {config}: {e!r}")
+
+def pool_dpid(dpid):
+    '''A switch's datapath ID given in a config, as a number or a string like 00-00-00-00-00-01.'''
+    return dpid if isinstance(dpid, int) else str_to_dpid(dpid)
+
+class ServerPool:
+    '''The servers behind one virtual IP on one switch, and the state for picking among them.
+    `config` is a dict as found in the config file; `defaults` fills in what it leaves out.
+    Its flow rules carry its own `cookie`, so rules of a pool that was since replaced can be told apart.'''
+    _cookies = itertools.count(1)
+    
+    def __init__(self, config, defaults):
+        config = {**defaults, **config}
+        self.config = config
+        self.cookie = next(ServerPool._cookies)
+        self.vip = IPAddr(config['vip'])
+        self.serverIPs = [IPAddr(server['ip']) for server in config['servers']]
+        self.serverMACs = [EthAddr(server['mac']) for server in config['servers']]
+        self.serverPorts = [int(server['port']) for server in config['servers']]
+        self.policy = POLICIES[config['policy']]()
+        self.loads = LoadTracker([int(server.get('weight', 1)) for server in config['servers']])
+        self.assignments = {} # Server index assigned to each client IP
+        self.idleTimeout = int(config['idle_timeout'])
+        self.hardTimeout = int(config['hard_timeout'])
+        
+        # Blocks of the proactive client network and the server each one is assigned
+        self.proactiveNetwork = parse_cidr(config['proactive']) if config.get('proactive') else None
+        self.bucketServers = []
+        if self.proactiveNetwork is not None:
+            bucketPolicy = WeightedRoundRobinPolicy()
+            self.bucketServers = [bucketPolicy.select(self.loads.servers) for _ in range(int(config['buckets']))]
+    
+    def select_server(self, clientIP):
+        '''Assign a server to `clientIP`: the one for its block in proactive mode, otherwise by policy.'''
+        serverIndex = self.proactive_server(clientIP)
+        if serverIndex is None:
+            serverIndex = self.policy.select(self.loads.servers)
+            self.loads.assign(serverIndex)
+        self.assignments[clientIP] = serverIndex
+        return serverIndex
+    
+    def proactive_server(self, clientIP):
+        '''The server assigned to the proactive block `clientIP` is in, or None if it's outside the network.'''
+        if self.proactiveNetwork is None:
+            return None
+        network, prefixLength = self.proactiveNetwork
+        offset = clientIP.toUnsigned() - network.toUnsigned()
+        size = 1 << (32 - prefixLength)
+        if not 0 <= offset < size:
+            return None
+        return self.bucketServers[offset * len(self.bucketServers) // size]
+
+class Datapath:
+    '''State for one switch: its connection, the pools it serves, indexed by virtual IP and by
+    server IP, and the clients it has seen.'''
+    def __init__(self, connection, pools):
+        self.connection = connection
+        self.mac_table = {} # MAC address table for ARP requests
+        self.pendingBarriers = {} # Callbacks to run once the switch has applied a batch, by barrier xid
+        self.set_pools(pools)
+    
+    def set_pools(self, pools):
+        self.pools = {pool.vip: pool for pool in pools}
+        self.serverPools = {ip: pool for pool in pools for ip in pool.serverIPs}
 
 class VirtualLoadBalancer:
     '''Implements a 'virtual IP load balancing switch'.
-    Maps a virtual IP address to multiple real server IP addresses, using round-robin load balancing.
-    OpenFlow flow rules are set based on incoming ARP requests.'''
-    def __init__(self):
-        self.serverIndex = 0
-        self.connection = None # Set when switch connects to the OpenFlow controller
-        self.mac_table = {} # MAC address table for ARP requests
+    Maps each virtual IP address to multiple real server IP addresses, using its pool's policy to
+    pick a server. Pools come from the config file at `configPath`, or the hardcoded servers with `weights`;
+    settings they leave out come from `defaults`. A pool applies to the switches listed in its
+    `dpids`, or to all of them if it doesn't list any. Every `reloadInterval` seconds, the config
+    file is reloaded if it changed; clients of pools that changed are dropped and reassigned.
+    OpenFlow flow rules are set based on incoming ARP requests, and expire after `idle_timeout`
+    seconds without traffic or `hard_timeout` seconds in all; the client's next packet then reaches
+    the controller, which assigns it a server again. Flow rules are installed in batches, each
+    followed by a barrier, and the packet that triggered them is only answered once they're in place.
+    In proactive mode, forward rules for `buckets` equal blocks of the `proactive` client network
+    (a CIDR string) are installed when the switch connects, spread over the servers by weight;
+    clients in it only reach the controller to resolve the virtual IP.
+    Every `statsInterval` seconds, flow and port statistics are requested from the switches; their
+    replies update the per-server load that load-aware policies work from.'''
+    def __init__(self, defaults, configPath=None, statsInterval=DEFAULT_STATS_INTERVAL,
+                 reloadInterval=DEFAULT_RELOAD_INTERVAL, weights=SERVER_WEIGHTS):
+        self.defaults = defaults
+        self.configPath = configPath
+        self.configTime = None # Modification time of the config file last loaded
+        self.poolConfigs = [default_pool_config(weights)]
+        if configPath is not None:
+            self.configTime = os.stat(configPath).st_mtime
+            self.poolConfigs = load_pool_configs(configPath)
+        self.datapaths = {} # State for each connected switch, by DPID
+        self.packetOuts = {} # Packet-out templates for ARP replies, by output port
         
         # Register event listeners
         core.openflow.addListenerByName("ConnectionUp", self._handle_ConnectionUp)
+        core.openflow.addListenerByName("ConnectionDown", self._handle_ConnectionDown)
         core.openflow.addListenerByName("PacketIn", self._handle_PacketIn)
+        core.openflow.addListenerByName("FlowRemoved", self._handle_FlowRemoved)
+        core.openflow.addListenerByName("BarrierIn", self._handle_BarrierIn)
+        core.openflow.addListenerByName("FlowStatsReceived", self._handle_FlowStatsReceived)
+        core.openflow.addListenerByName("PortStatsReceived", self._handle_PortStatsReceived)
         
-        log.info("Load balancer started")
+        if statsInterval > 0:
+            Timer(statsInterval, self._request_stats, recurring=True)
+        if configPath is not None and reloadInterval > 0:
+            Timer(reloadInterval, self._check_config, recurring=True)
+        
+        log.info(f"Load balancer started with {len(self.poolConfigs)} pools")
+    
+    def _pools_for(self, dpid):
+        '''New pools for switch `dpid`. A pool listing the switch replaces one for all switches with the same virtual IP.'''
+        configs = {}
+        for config in self.poolConfigs:
+            dpids = [pool_dpid(listed) for listed in config.get('dpids', [])]
+            if not dpids and config['vip'] not in configs:
+                configs[config['vip']] = config
+            elif dpid in dpids:
+                configs[config['vip']] = config
+        return [ServerPool(config, self.defaults) for config in configs.values()]
     
     def _handle_ConnectionUp(self, event):
         '''Establish connection with the switch.'''
-        self.connection = core.openflow.getConnection(event.dpid)
-        log.info(f"Connection established with switch {event.dpid}")
+        datapath = Datapath(event.connection, self._pools_for(event.dpid))
+        self.datapaths[event.dpid] = datapath
+        log.info(f"Connection established with switch {dpid_to_str(event.dpid)}, serving {len(datapath.pools)} virtual IPs")
+        for pool in datapath.pools.values():
+            if pool.proactiveNetwork is not None:
+                self._set_proactive_rules(datapath, pool)
+    
+    def _handle_ConnectionDown(self, event):
+        '''Forget the switch.'''
+        self.datapaths.pop(event.dpid, None)
+        log.info(f"Connection lost with switch {dpid_to_str(event.dpid)}")
+    
+    def reload(self):
+        '''Reload the config file and apply it to every switch. Pools that didn't change keep their
+        state; the flow rules and clients of the others are dropped, and those clients get assigned
+        again from the new pools on their next packet. Returns whether the config was loaded.'''
+        try:
+            self.configTime = os.stat(self.configPath).st_mtime
+            self.poolConfigs = load_pool_configs(self.configPath)
+        except (OSError, ValueError) as e:
+            log.error(f"Not reloading {self.configPath}: {e}")
+            return False
+        for dpid, datapath in self.datapaths.items():
+            pools = []
+            for pool in self._pools_for(dpid):
+                current = datapath.pools.get(pool.vip)
+                if current is not None and current.config == pool.config:
+                    pools.append(current)
+                    continue
+                pools.append(pool)
+                if current is not None:
+                    self._drop_pool(datapath, current)
+                if pool.proactiveNetwork is not None:
+                    self._set_proactive_rules(datapath, pool)
+            vips = {pool.vip for pool in pools}
+            for vip, current in datapath.pools.items():
+                if vip not in vips:
+                    self._drop_pool(datapath, current)
+            datapath.set_pools(pools)
+        log.info(f"Reloaded {len(self.poolConfigs)} pools from {self.configPath}")
+        return True
+    
+    def _check_config(self):
+        '''Reload the config file if it changed.'''
+        try:
+            changed = os.stat(self.configPath).st_mtime != self.configTime
+        except OSError:
+            return
+        if changed:
+            self.reload()
+    
+    def _drop_pool(self, datapath, pool):
+        '''Delete the flow rules of a pool that's being replaced or removed, and forget its clients.'''
+        log.info(f"Dropping flow rules for {pool.vip} on switch {dpid_to_str(datapath.connection.dpid)}")
+        # All forward rules, proactive ones included, then each client's reverse rule (servers may be in other pools too)
+        messages = [of.ofp_flow_mod(command=of.OFPFC_DELETE, match=of.ofp_match(dl_type=pkt.ethernet.IP_TYPE, nw_dst=pool.vip))]
+        for clientIP, serverIndex in pool.assignments.items():
+            messages.append(of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT,
+                                            match=self._flow_match(pool.serverIPs[serverIndex], clientIP)))
+            datapath.mac_table.pop(clientIP, None)
+        pool.assignments.clear()
+        self._send_batch(datapath, messages)
+    
+    def _handle_BarrierIn(self, event):
+        '''Run whatever waited on a batch of messages the switch has now applied.'''
+        datapath = self.datapaths.get(event.dpid)
+        then = datapath.pendingBarriers.pop(event.xid, None) if datapath is not None else None
+        if then is not None:
+            then()
+    
+    def _handle_FlowRemoved(self, event):
+        '''Forget a client whose flow rules expired, and remove its rule in the other direction.'''
+        datapath = self.datapaths.get(event.dpid)
+        if datapath is None:
+            return
+        match = event.ofp.match
+        if match.nw_dst in datapath.pools:
+            pool = datapath.pools[match.nw_dst]
+            clientIP = match.nw_src
+            serverIndex = pool.assignments.get(clientIP)
+            reverseMatch = self._flow_match(pool.serverIPs[serverIndex], clientIP) if serverIndex is not None else None
+        elif match.nw_src in datapath.serverPools:
+            pool = datapath.serverPools[match.nw_src]
+            clientIP = match.nw_dst
+            reverseMatch = self._flow_match(clientIP, pool.vip)
+        else:
+            return
+        if event.ofp.cookie != pool.cookie: # A rule of a pool since dropped, whose clients are already forgotten
+            return
+        log.debug(f"Flow rule for {clientIP} removed")
+        pool.assignments.pop(clientIP, None)
+        datapath.mac_table.pop(clientIP, None)
+        if reverseMatch is not None and not event.deleted: # Otherwise we deleted it, after the other one went
+            reverse = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT, match=reverseMatch)
+            datapath.connection.send(reverse)
+    
+    def _request_stats(self):
+        '''Request statistics for the client flows towards the servers, and for the switch ports.'''
+        for datapath in self.datapaths.values():
+            for pool in datapath.pools.values():
+                pool.loads.request()
+            flowMatch = of.ofp_match(dl_type=pkt.ethernet.IP_TYPE)
+            datapath.connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request(match=flowMatch)))
+            datapath.connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+    
+    def _handle_FlowStatsReceived(self, event):
+        '''Update the number of active flows per server.'''
+        datapath = self.datapaths.get(event.dpid)
+        if datapath is None:
+            return
+        flowBytes = {vip: [{} for _ in pool.serverIPs] for vip, pool in datapath.pools.items()}
+        for stat in event.stats:
+            pool = datapath.pools.get(stat.match.nw_dst)
+            serverIndex = pool.assignments.get(stat.match.nw_src) if pool is not None else None
+            if serverIndex is not None:
+                flowBytes[pool.vip][serverIndex][stat.match.nw_src] = stat.byte_count
+        for vip, pool in datapath.pools.items():
+            pool.loads.update_flows(flowBytes[vip])
+            log.debug(f"Active flows per server for {vip}: {[server.flows for server in pool.loads.servers]}")
+    
+    def _handle_PortStatsReceived(self, event):
+        '''Update the traffic rate through each server's port.'''
+        datapath = self.datapaths.get(event.dpid)
+        if datapath is None:
+            return
+        portBytes = {stat.port_no: stat.rx_bytes + stat.tx_bytes for stat in event.stats}
+        now = time.monotonic()
+        for vip, pool in datapath.pools.items():
+            pool.loads.update_ports([portBytes.get(port) for port in pool.serverPorts], now)
+            log.debug(f"Bytes per second per server for {vip}: {[round(server.byteRate) for server in pool.loads.servers]}")
     
     def _handle_PacketIn(self, event):
         '''Handle incoming packets and process ARP requests.'''
@@ -53,15 +372,38 @@ class VirtualLoadBalancer:
         if not packet.parsed:
             log.warning("Ignoring incomplete packet")
             return
+        datapath = self.datapaths.get(event.dpid)
+        if datapath is None:
+            return
         
         log.debug(f"PacketIn event received from {packet.src}")
         
         if packet.type == packet.ARP_TYPE:
-            self._handle_arp(packet, event)
+            self._handle_arp(datapath, packet, event)
         elif packet.type == packet.IP_TYPE:
+            self._handle_ip(datapath, packet, event)
+    
+    def _handle_ip(self, datapath, packet, event):
+        '''Assign a server to a client whose flow rules expired, then send its packet on through the new rules.'''
+        ipPkt = packet.find('ipv4')
+        pool = datapath.pools.get(ipPkt.dstip) if ipPkt is not None else None
+        if pool is None or ipPkt.protocol != pkt.ipv4.ICMP_PROTOCOL:
             log.warning("Caught IP packet not handled by flow rules")
+            return
+        
+        clientIP = ipPkt.srcip
+        clientPort = event.port
+        serverIndex = pool.assignments.get(clientIP) # Still set while its rules are being installed
+        if serverIndex is None:
+            serverIndex = pool.select_server(clientIP)
+        datapath.mac_table[clientIP] = packet.src
+        
+        resend = of.ofp_packet_out(data=event.ofp, in_port=clientPort)
+        resend.actions.append(of.ofp_action_output(port=of.OFPP_TABLE))
+        self._set_flow_rules(datapath, pool, clientIP, serverIndex, clientPort,
+                             lambda: datapath.connection.send(resend))
     
-    def _handle_arp(self, packet, event):
+    def _handle_arp(self, datapath, packet, event):
         '''Handle ARP packets and set up flow rules for ICMP traffic.'''
         log.debug("Handling packet")
         
@@ -72,126 +414,152 @@ class VirtualLoadBalancer:
             return
         
         # Client request to server
-        if arpPkt.protodst == SWITCH_IP:
+        pool = datapath.pools.get(arpPkt.protodst)
+        if pool is not None:
             log.debug("Handling ARP request from client")
             
-            # Get client IP/Port and assign server round-robin
+            # Get client IP/Port and assign server
             clientIP = arpPkt.protosrc
             clientPort = event.port
-            serverIP = SERVER_IPS[self.serverIndex]
-            serverMAC = SERVER_MACS[self.serverIndex]
-            serverPort = SERVER_PORTS[self.serverIndex]
-            self.serverIndex = (self.serverIndex + 1) % len(SERVER_IPS)
+            serverIndex = pool.select_server(clientIP)
+            serverMAC = pool.serverMACs[serverIndex]
             
             # Store MAC address for ARP reply
-            self.mac_table[clientIP] = arpPkt.hwsrc
-            
-            self._set_flow_rules(clientIP, serverIP, clientPort, serverPort)
-            self._send_client_arp_reply(arpPkt, serverMAC, clientPort)
+            datapath.mac_table[clientIP] = arpPkt.hwsrc
             
+            # Reply once the flow rules are in place, so the client's first packet doesn't miss them
+            self._set_flow_rules(datapath, pool, clientIP, serverIndex, clientPort,
+                                 lambda: self._send_client_arp_reply(datapath, arpPkt, pool.vip, serverMAC, clientPort))
+        
         # Server request to client
-        if arpPkt.protosrc in SERVER_IPS:
+        if arpPkt.protosrc in datapath.serverPools:
             log.debug("Handling ARP request from server")
             
             # Get client MAC from previous request
-            clientMAC = self.mac_table.get(arpPkt.protodst)
+            clientMAC = datapath.mac_table.get(arpPkt.protodst)
             if clientMAC is None:
                 log.warning("Client MAC address not found in table")
                 return
             serverPort = event.port
             
-            self._send_server_arp_reply(arpPkt, clientMAC, serverPort)
-            
-    def _set_flow_rules(self, clientIP, serverIP, clientPort, serverPort):
-        '''Set flow rules for ICMP packets from `clientIP` to `serverIP` (and vice-versa).'''
+            self._send_server_arp_reply(datapath, arpPkt, clientMAC, serverPort)
+    
+    def _flow_match(self, srcIP, dstIP):
+        '''Match ICMP packets from `srcIP` to `dstIP`.'''
+        match = of.ofp_match()
+        match.dl_type = pkt.ethernet.IP_TYPE
+        match.nw_proto = pkt.ipv4.ICMP_PROTOCOL
+        match.nw_src = srcIP
+        match.nw_dst = dstIP
+        return match
+    
+    def _set_flow_rules(self, datapath, pool, clientIP, serverIndex, clientPort, then=None):
+        '''Set flow rules for ICMP packets from `clientIP` to server `serverIndex` of `pool` (and vice-versa).
+        Clients in the proactive network already have their forward rule.
+        `then` is called once the switch has applied the rules.'''
+        serverIP = pool.serverIPs[serverIndex]
         log.info(f"Redirecting {clientIP} to {serverIP}")
+        messages = []
         
-        log.debug(f"Setting flow rules for {clientIP} to {serverIP}")
-        
-        # Match ICMP packets from client to server
-        clientMsg = of.ofp_flow_mod()
-        clientMsg.match.dl_type = pkt.ethernet.IP_TYPE
-        clientMsg.match.nw_proto = pkt.ipv4.ICMP_PROTOCOL
-        clientMsg.match.nw_src = clientIP
-        clientMsg.match.nw_dst = SWITCH_IP
-        
-        # Redirect to the assigned server
-        clientMsg.actions.append(of.ofp_action_nw_addr.set_dst(serverIP))
-        clientMsg.actions.append(of.ofp_action_output(port=serverPort))
-        self.connection.send(clientMsg)
+        if pool.proactive_server(clientIP) is None:
+            log.debug(f"Setting flow rules for {clientIP} to {serverIP}")
+            
+            # Match ICMP packets from client to server
+            clientMsg = of.ofp_flow_mod(idle_timeout=pool.idleTimeout, hard_timeout=pool.hardTimeout,
+                                        flags=of.OFPFF_SEND_FLOW_REM, cookie=pool.cookie)
+            clientMsg.match = self._flow_match(clientIP, pool.vip)
+            
+            # Redirect to the assigned server (whose MAC the client may not have been given, if reassigned)
+            clientMsg.actions.append(of.ofp_action_nw_addr.set_dst(serverIP))
+            clientMsg.actions.append(of.ofp_action_dl_addr.set_dst(pool.serverMACs[serverIndex]))
+            clientMsg.actions.append(of.ofp_action_output(port=pool.serverPorts[serverIndex]))
+            messages.append(clientMsg)
         
         log.debug(f"Setting flow rules for {serverIP} to {clientIP}")
         
         # Match ICMP packets from server to client
-        serverMsg = of.ofp_flow_mod()
-        serverMsg.match.dl_type = pkt.ethernet.IP_TYPE
-        serverMsg.match.nw_proto = pkt.ipv4.ICMP_PROTOCOL
-        serverMsg.match.nw_src = serverIP
-        serverMsg.match.nw_dst = clientIP
-        
-        # Rewrite source IP to switch (so client perceives switch as server)
-        serverMsg.actions.append(of.ofp_action_nw_addr.set_src(SWITCH_IP))
+        serverMsg = of.ofp_flow_mod(idle_timeout=pool.idleTimeout, hard_timeout=pool.hardTimeout,
+                                    flags=of.OFPFF_SEND_FLOW_REM, cookie=pool.cookie)
+        serverMsg.match = self._flow_match(serverIP, clientIP)
+        
+        # Rewrite source IP to the virtual IP (so client perceives switch as server)
+        serverMsg.actions.append(of.ofp_action_nw_addr.set_src(pool.vip))
         serverMsg.actions.append(of.ofp_action_output(port=clientPort))
-        self.connection.send(serverMsg)
+        messages.append(serverMsg)
+        
+        self._send_batch(datapath, messages, then)
+    
+    def _set_proactive_rules(self, datapath, pool):
+        '''Set forward flow rules for each block of the pool's proactive client network, to the block's server.'''
+        network, prefixLength = pool.proactiveNetwork
+        blockLength = prefixLength + (len(pool.bucketServers) - 1).bit_length()
+        blockSize = 1 << (32 - blockLength)
+        messages = []
+        for bucket, serverIndex in enumerate(pool.bucketServers):
+            block = IPAddr(network.toUnsigned() + bucket * blockSize)
+            log.debug(f"Setting flow rules for {block}/{blockLength} to {pool.serverIPs[serverIndex]}")
+            
+            msg = of.ofp_flow_mod(priority=PROACTIVE_PRIORITY, cookie=pool.cookie)
+            msg.match = self._flow_match(f"{block}/{blockLength}", pool.vip)
+            msg.actions.append(of.ofp_action_nw_addr.set_dst(pool.serverIPs[serverIndex]))
+            msg.actions.append(of.ofp_action_dl_addr.set_dst(pool.serverMACs[serverIndex]))
+            msg.actions.append(of.ofp_action_output(port=pool.serverPorts[serverIndex]))
+            messages.append(msg)
+        self._send_batch(datapath, messages)
+        log.info(f"Set proactive flow rules for {len(messages)} blocks of {network}/{prefixLength} to {pool.vip}")
+    
+    def _send_batch(self, datapath, messages, then=None):
+        '''Send `messages` to the switch in a single write, followed by a barrier request.
+        `then` is called once the barrier reply shows the switch has applied them all.'''
+        barrier = of.ofp_barrier_request()
+        if then is not None:
+            datapath.pendingBarriers[barrier.xid] = then
+        datapath.connection.send(b''.join(msg.pack() for msg in messages) + barrier.pack())
     
-    def _send_client_arp_reply(self, arpPkt, serverMAC, clientPort):
+    def _send_client_arp_reply(self, datapath, arpPkt, vip, serverMAC, clientPort):
         '''Send ARP reply to the client.'''
         log.debug("Sending ARP reply to client")
         
-        # Setup reply
-        arpReply = pkt.arp()
-        arpReply.hwtype = arpPkt.hwtype
-        arpReply.prototype = arpPkt.prototype
-        arpReply.hwlen = arpPkt.hwlen
-        arpReply.protolen = arpPkt.protolen
-        arpReply.opcode = pkt.arp.REPLY
-        arpReply.hwsrc = serverMAC
-        arpReply.hwdst = arpPkt.hwsrc
-        arpReply.protosrc = SWITCH_IP # Client perceives switch as server
-        arpReply.protodst = arpPkt.protosrc
-        
-        # Setup ethernet frame
-        ethFrame = pkt.ethernet()
-        ethFrame.src = arpReply.hwsrc
-        ethFrame.dst = arpPkt.hwsrc
-        ethFrame.type = pkt.ethernet.ARP_TYPE
-        ethFrame.set_payload(arpReply)
-        
-        # Send the ARP reply
-        clientMsg = of.ofp_packet_out()
-        clientMsg.data = ethFrame.pack()
-        clientMsg.actions.append(of.ofp_action_output(port=clientPort))
-        self.connection.send(clientMsg)
-        
-    def _send_server_arp_reply(self, arpPkt, clientMAC, serverPort):
+        # Client perceives switch as server
+        clientMAC = arpPkt.hwsrc.toRaw()
+        frame = arp_reply_frame(clientMAC, serverMAC.toRaw(), vip.toRaw(), arpPkt.protosrc.toRaw())
+        datapath.connection.send(self._packet_out(clientPort).pack(frame))
+        
+    def _send_server_arp_reply(self, datapath, arpPkt, clientMAC, serverPort):
         '''Send ARP reply to the server.'''
         log.debug("Sending ARP reply to server")
         
-        # Setup reply
-        arpReply = pkt.arp()
-        arpReply.hwtype = arpPkt.hwtype
-        arpReply.prototype = arpPkt.prototype
-        arpReply.hwlen = arpPkt.hwlen
-        arpReply.protolen = arpPkt.protolen
-        arpReply.opcode = pkt.arp.REPLY
-        arpReply.hwsrc = clientMAC
-        arpReply.hwdst = arpPkt.hwsrc
-        arpReply.protosrc = arpPkt.protodst
-        arpReply.protodst = arpPkt.protosrc
-        
-        # Setup ethernet frame
-        ethFrame = pkt.ethernet()
-        ethFrame.src = arpReply.hwsrc
-        ethFrame.dst = arpPkt.hwsrc
-        ethFrame.type = pkt.ethernet.ARP_TYPE
-        ethFrame.set_payload(arpReply)
-        
-        # Send the ARP reply
-        serverMsg = of.ofp_packet_out()
-        serverMsg.data = ethFrame.pack()
-        serverMsg.actions.append(of.ofp_action_output(port=serverPort))
-        self.connection.send(serverMsg)
-    
-def launch():
+        serverMAC = arpPkt.hwsrc.toRaw()
+        frame = arp_reply_frame(serverMAC, clientMAC.toRaw(), arpPkt.protodst.toRaw(), arpPkt.protosrc.toRaw())
+        datapath.connection.send(self._packet_out(serverPort).pack(frame))
+    
+    def _packet_out(self, port):
+        '''The packet-out template for ARP replies out of `port`.'''
+        template = self.packetOuts.get(port)
+        if template is None:
+            template = self.packetOuts[port] = PacketOutTemplate(port)
+        return template
+    
+def launch(config=None, policy=DEFAULT_POLICY, weights=None, stats_interval=DEFAULT_STATS_INTERVAL,
+           idle_timeout=DEFAULT_IDLE_TIMEOUT, hard_timeout=DEFAULT_HARD_TIMEOUT,
+           proactive=None, buckets=DEFAULT_PROACTIVE_BUCKETS, reload_interval=DEFAULT_RELOAD_INTERVAL):
+    '''Options: `--config` is a JSON file of server pools (see pools.json); without one, the hardcoded
+    servers are used, weighted by `--weights` (comma-separated, e.g. 3,1).
+    `--policy` is one of round-robin, weighted-round-robin, least-flows or least-bytes;
+    `--stats_interval` is in seconds. `--idle_timeout` and `--hard_timeout` are the client flow rule
+    timeouts in seconds (0 for none). `--proactive` is a client network (e.g. 10.0.0.0/24) to install
+    rules for up front, split into `--buckets` blocks (a power of two). Pools may override all of these.
+    `--reload_interval` is how often the config file is checked for changes, in seconds.
+    The load balancer is registered as core.load_balancer; core.load_balancer.reload() reloads the config.'''
+    weights = [int(weight) for weight in weights.split(',')] if weights else SERVER_WEIGHTS
+    if len(weights) != len(SERVER_IPS):
+        raise RuntimeError(f"Expected {len(SERVER_IPS)} server weights, got {weights}")
+    defaults = {'policy': policy, 'idle_timeout': int(idle_timeout), 'hard_timeout': int(hard_timeout),
+                'proactive': proactive, 'buckets': int(buckets)}
+    try:
+        check_pool_config({**defaults, **default_pool_config(weights)})
+        loadBalancer = VirtualLoadBalancer(defaults, config, float(stats_interval), float(reload_interval), weights)
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"Can't start load balancer: {e}")
     log.info("Starting load balancer")
-    VirtualLoadBalancer()
+    core.register('load_balancer', loadBalancer)
@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+
+# Drives the load balancer controller offline with synthetic ARP requests from thousands of clients,
+# and measures how fast it handles them: events per second, per-event latency and allocations.
+# The controller runs on POX's packet and OpenFlow libraries, but with a stub core.openflow and stub
+# switch connections in place of the POX core and Mininet. Each stub switch answers barrier requests
+# right away, so the ARP replies waiting on them are part of each event.
+# Compares the controller's ARP reply path with the one that rebuilt pkt.arp/pkt.ethernet for every reply.
+# Needs a POX checkout: pass its directory with --pox, or set POX_DIR. With --standins, runs on the
+# minimal POX stand-ins in standins/ instead; they pack the same bytes, but their costs aren't POX's.
+# Usage: controller_bench.py [options], see --help.
+
+import gc
+import importlib
+import json
+import logging
+import os
+import statistics
+import struct
+import sys
+import time
+import tracemalloc
+import types
+from optparse import OptionParser
+
+OFPT_BARRIER_REQUEST = 18
+STANDINS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'standins')
+OF_HEADER = struct.Struct('!BBHI') # Version, type, length, xid
+
+class StubOpenFlow:
+    '''Stands in for core.openflow: keeps the listeners the controller registers, and raises events to them.'''
+    def __init__(self):
+        self.listeners = {}
+
+    def addListenerByName(self, name, handler):
+        self.listeners.setdefault(name, []).append(handler)
+
+    def raise_event(self, name, event):
+        for handler in self.listeners.get(name, []):
+            handler(event)
+
+class StubCore:
+    '''Stands in for pox.core.core.'''
+    def __init__(self):
+        self.openflow = StubOpenFlow()
+        self.components = {}
+
+    def getLogger(self, name='load_balancer'):
+        return logging.getLogger(name)
+
+    def register(self, name, component):
+        self.components[name] = component
+
+class StubConnection:
+    '''Stands in for a switch's connection. Packs what the controller sends, as POX does, and
+    notes the barrier requests in it so the switch can answer them.'''
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.messages = 0
+        self.bytes = 0
+        self.barriers = []
+
+    def send(self, data):
+        if not isinstance(data, bytes):
+            data = data.pack()
+        self.bytes += len(data)
+        offset = 0
+        while offset < len(data):
+            _, msgType, length, xid = OF_HEADER.unpack_from(data, offset)
+            if msgType == OFPT_BARRIER_REQUEST:
+                self.barriers.append(xid)
+            self.messages += 1
+            offset += length
+
+class Event:
+    '''An OpenFlow event as the controller sees it.'''
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+class PacketIn(Event):
+    '''A PacketIn event, parsing its packet on first use like POX's does.'''
+    @property
+    def parsed(self):
+        if self._parsed is None:
+            self._parsed = pkt.ethernet(self.data)
+        return self._parsed
+
+def load_pox(poxDir):
+    '''Import POX's libraries from `poxDir`, with the stub core in place of pox.core.
+    Raises ImportError if there's no POX checkout in `poxDir`.'''
+    global of, pkt, IPAddr, EthAddr
+    if not os.path.isfile(os.path.join(poxDir, 'pox', '__init__.py')):
+        raise ImportError(f"No POX checkout in {poxDir}")
+    sys.path.insert(0, poxDir)
+    import pox
+    stub = types.ModuleType('pox.core')
+    stub.core = StubCore()
+    sys.modules['pox.core'] = pox.core = stub
+    import pox.openflow.libopenflow_01 as of
+    import pox.lib.packet as pkt
+    from pox.lib.addresses import IPAddr, EthAddr
+    return stub.core
+
+def arp_request(hwsrc, protosrc, protodst):
+    '''Raw Ethernet frame carrying an ARP request.'''
+    arpPkt = pkt.arp()
+    arpPkt.opcode = pkt.arp.REQUEST
+    arpPkt.hwsrc = hwsrc
+    arpPkt.hwdst = EthAddr('00:00:00:00:00:00')
+    arpPkt.protosrc = protosrc
+    arpPkt.protodst = protodst
+    ethFrame = pkt.ethernet(src=hwsrc, dst=EthAddr('ff:ff:ff:ff:ff:ff'), type=pkt.ethernet.ARP_TYPE)
+    ethFrame.set_payload(arpPkt)
+    return ethFrame.pack()
+
+def make_events(lb, connection, clients, ports):
+    '''For each client, a PacketIn of its ARP request for the virtual IP, then one of its server's
+    ARP request for the client.'''
+    vip, serverIPs, serverMACs, serverPorts = lb.SWITCH_IP, lb.SERVER_IPS, lb.SERVER_MACS, lb.SERVER_PORTS
+    events = []
+    for client in range(clients):
+        clientIP = IPAddr((10 << 24) + (1 << 16) + client)
+        clientMAC = EthAddr(struct.pack('!HI', 0x0200, client))
+        clientPort = 1 + client % ports
+        server = client % len(serverIPs)
+        for port, frame in ((clientPort, arp_request(clientMAC, clientIP, vip)),
+                            (serverPorts[server], arp_request(serverMACs[server], serverIPs[server], clientIP))):
+            ofp = of.ofp_packet_in(data=frame, in_port=port, reason=of.OFPR_NO_MATCH)
+            events.append(PacketIn(connection=connection, dpid=connection.dpid, ofp=ofp, port=port, data=frame, _parsed=None))
+    return events
+
+def handle(openflow, connection, event):
+    '''Raise `event`, then have the switch answer the barriers the controller sent for it.'''
+    openflow.raise_event('PacketIn', event)
+    while connection.barriers:
+        openflow.raise_event('BarrierIn', Event(connection=connection, dpid=connection.dpid, xid=connection.barriers.pop()))
+
+def start(core, lb, configPath=None, connection=None, **settings):
+    '''A fresh controller, loading pools from `configPath` if given, with one switch connected on
+    `connection` (a StubConnection for switch 1 by default). `settings` override the launch defaults.'''
+    core.openflow.listeners.clear()
+    defaults = {'policy': lb.DEFAULT_POLICY, 'idle_timeout': lb.DEFAULT_IDLE_TIMEOUT,
+                'hard_timeout': lb.DEFAULT_HARD_TIMEOUT, 'proactive': None, 'buckets': lb.DEFAULT_PROACTIVE_BUCKETS,
+                **settings}
+    controller = lb.VirtualLoadBalancer(defaults, configPath, statsInterval=0, reloadInterval=0)
+    connection = connection or StubConnection(1)
+    core.openflow.raise_event('ConnectionUp', Event(connection=connection, dpid=connection.dpid))
+    return controller, connection
+
+def run(core, lb, options):
+    '''Times every event of a run, then measures allocations over a sample of a second run.'''
+    controller, connection = start(core, lb)
+    events = make_events(lb, connection, options.clients, options.ports)
+    for event in events[:options.warmup]:
+        handle(core.openflow, connection, event)
+    latencies = []
+    collections = sum(stat['collections'] for stat in gc.get_stats())
+    started = time.perf_counter()
+    for event in events[options.warmup:]:
+        before = time.perf_counter_ns()
+        handle(core.openflow, connection, event)
+        latencies.append(time.perf_counter_ns() - before)
+    elapsed = time.perf_counter() - started
+    collections = sum(stat['collections'] for stat in gc.get_stats()) - collections
+    messages = connection.messages
+
+    # Allocations: bytes allocated at the peak of each event and memory blocks it left behind
+    controller, connection = start(core, lb)
+    events = make_events(lb, connection, options.sample, options.ports)
+    peaks, blocks = [], []
+    tracemalloc.start()
+    for event in events:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        blocksBefore = sys.getallocatedblocks()
+        handle(core.openflow, connection, event)
+        blocks.append(sys.getallocatedblocks() - blocksBefore)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    tracemalloc.stop()
+
+    latencies.sort()
+    count = len(latencies)
+    return {'events': count, 'eventsPerSecond': count / elapsed, 'messages': messages,
+            'meanUs': statistics.fmean(latencies) / 1000, 'p50Us': latencies[count // 2] / 1000,
+            'p99Us': latencies[int(count * 0.99)] / 1000, 'gcPerThousand': collections * 1000 / count,
+            'peakBytes': statistics.fmean(peaks), 'retainedBlocks': statistics.fmean(blocks)}
+
+def baseline_client_arp_reply(self, datapath, arpPkt, vip, serverMAC, clientPort):
+    '''The client ARP reply as it used to be built, field by field.'''
+    arpReply = pkt.arp()
+    arpReply.hwtype = arpPkt.hwtype
+    arpReply.prototype = arpPkt.prototype
+    arpReply.hwlen = arpPkt.hwlen
+    arpReply.protolen = arpPkt.protolen
+    arpReply.opcode = pkt.arp.REPLY
+    arpReply.hwsrc = serverMAC
+    arpReply.hwdst = arpPkt.hwsrc
+    arpReply.protosrc = vip
+    arpReply.protodst = arpPkt.protosrc
+    ethFrame = pkt.ethernet()
+    ethFrame.src = arpReply.hwsrc
+    ethFrame.dst = arpPkt.hwsrc
+    ethFrame.type = pkt.ethernet.ARP_TYPE
+    ethFrame.set_payload(arpReply)
+    clientMsg = of.ofp_packet_out()
+    clientMsg.data = ethFrame.pack()
+    clientMsg.actions.append(of.ofp_action_output(port=clientPort))
+    datapath.connection.send(clientMsg)
+
+def baseline_server_arp_reply(self, datapath, arpPkt, clientMAC, serverPort):
+    '''The server ARP reply as it used to be built, field by field.'''
+    arpReply = pkt.arp()
+    arpReply.hwtype = arpPkt.hwtype
+    arpReply.prototype = arpPkt.prototype
+    arpReply.hwlen = arpPkt.hwlen
+    arpReply.protolen = arpPkt.protolen
+    arpReply.opcode = pkt.arp.REPLY
+    arpReply.hwsrc = clientMAC
+    arpReply.hwdst = arpPkt.hwsrc
+    arpReply.protosrc = arpPkt.protodst
+    arpReply.protodst = arpPkt.protosrc
+    ethFrame = pkt.ethernet()
+    ethFrame.src = arpReply.hwsrc
+    ethFrame.dst = arpPkt.hwsrc
+    ethFrame.type = pkt.ethernet.ARP_TYPE
+    ethFrame.set_payload(arpReply)
+    serverMsg = of.ofp_packet_out()
+    serverMsg.data = ethFrame.pack()
+    serverMsg.actions.append(of.ofp_action_output(port=serverPort))
+    datapath.connection.send(serverMsg)
+
+def check_replies(core, lb):
+    '''Check the reply templates produce the same frames as building them field by field.'''
+    frames = {}
+    for name, replies in (('baseline', (baseline_client_arp_reply, baseline_server_arp_reply)),
+                          ('templates', (lb.VirtualLoadBalancer._send_client_arp_reply, lb.VirtualLoadBalancer._send_server_arp_reply))):
+        sent = []
+        connection = types.SimpleNamespace(send=lambda data: sent.append(data if isinstance(data, bytes) else data.pack()))
+        datapath = types.SimpleNamespace(connection=connection)
+        controller = types.SimpleNamespace(packetOuts={}, _packet_out=lambda port: lb.PacketOutTemplate(port))
+        request = pkt.ethernet(arp_request(EthAddr('02:00:00:00:00:01'), IPAddr('10.1.0.1'), lb.SWITCH_IP)).find('arp')
+        replies[0](controller, datapath, request, lb.SWITCH_IP, lb.SERVER_MACS[0], 3)
+        request = pkt.ethernet(arp_request(lb.SERVER_MACS[0], lb.SERVER_IPS[0], IPAddr('10.1.0.1'))).find('arp')
+        replies[1](controller, datapath, request, EthAddr('02:00:00:00:00:01'), lb.SERVER_PORTS[0])
+        frames[name] = [data[:4] + data[8:] for data in sent] # All but the xid
+    assert frames['baseline'] == frames['templates'], frames
+
+def main():
+    parser = OptionParser(description='Measures how fast the load balancer controller handles ARP PacketIns.')
+    parser.add_option('--pox', type='string', dest='pox', default=os.environ.get('POX_DIR', os.path.expanduser('~/pox')),
+                      help='POX checkout directory')
+    parser.add_option('--standins', action='store_true', dest='standins', default=False,
+                      help='run on the bundled POX stand-ins instead of a checkout')
+    parser.add_option('-c', '--clients', type='int', dest='clients', default=5000, help='clients sending ARP requests')
+    parser.add_option('-p', '--ports', type='int', dest='ports', default=4, help='switch ports the clients are spread over')
+    parser.add_option('-w', '--warmup', type='int', dest='warmup', default=200, help='events handled before timing')
+    parser.add_option('-s', '--sample', type='int', dest='sample', default=500, help='clients in the allocation sample')
+    parser.add_option('--json', type='string', dest='json', help='also write the results to this file')
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        core = load_pox(STANDINS if options.standins else options.pox)
+    except ImportError as e:
+        parser.error(f"{e}: pass its directory with --pox or set POX_DIR, or use --standins")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    lb = importlib.import_module('Timothy_Lawrence_u1311540')
+    check_replies(core, lb)
+
+    templates = (lb.VirtualLoadBalancer._send_client_arp_reply, lb.VirtualLoadBalancer._send_server_arp_reply)
+    if options.standins: print("On the POX stand-ins: these numbers are not POX's, only a comparison of the two reply paths")
+    print(f"{options.clients} clients, {2 * options.clients} PacketIns (client and server ARP requests)")
+    print(f"{'reply path':<10} {'events/s':>9} {'mean us':>8} {'p50 us':>7} {'p99 us':>7} {'GCs/1k':>7} {'peak B':>7} {'blocks':>7}")
+    results = []
+    for name, replies in (('baseline', (baseline_client_arp_reply, baseline_server_arp_reply)), ('templates', templates)):
+        lb.VirtualLoadBalancer._send_client_arp_reply, lb.VirtualLoadBalancer._send_server_arp_reply = replies
+        result = {'replyPath': name, **run(core, lb, options)}
+        results.append(result)
+        print(f"{name:<10} {result['eventsPerSecond']:>9.0f} {result['meanUs']:>8.1f} {result['p50Us']:>7.1f} "
+              f"{result['p99Us']:>7.1f} {result['gcPerThousand']:>7.2f} {result['peakBytes']:>7.0f} {result['retainedBlocks']:>7.1f}")
+    lb.VirtualLoadBalancer._send_client_arp_reply, lb.VirtualLoadBalancer._send_server_arp_reply = templates
+    gain = results[1]['eventsPerSecond'] / results[0]['eventsPerSecond'] - 1
+    print(f"Reply templates: {gain:+.1%} events/s")
+    if options.json:
+        with open(options.json, 'w') as file:
+            json.dump({'options': vars(options), 'pox': 'stand-ins' if options.standins else options.pox, 'results': results},
+                      file, indent=2)
+
+if __name__ == '__main__':
+    main()
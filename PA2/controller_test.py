@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+
+# Checks the load balancer controller offline, on the controller_bench stubs: flow rule expiry,
+# proactive rules, pool configs and reloading, and the ARP reply templates.
+# Runs on the POX checkout in POX_DIR if there is one, otherwise on the bundled stand-ins.
+
+import importlib
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import types
+
+import controller_bench
+from controller_bench import Event, PacketIn, StubConnection, arp_request, handle, load_pox, start
+
+MATCH = struct.Struct('!IH6s6sHBxHBBxxIIHH') # OpenFlow 1.0 match, wildcards first
+FLOW_MOD = struct.Struct('!QHHHHIHH') # Cookie, command, timeouts, priority, buffer ID, out port, flags
+
+class RecordingConnection(StubConnection):
+    '''A stub connection that also keeps the flow mods sent through it, decoded.'''
+    def __init__(self, dpid):
+        super().__init__(dpid)
+        self.flowMods = []
+
+    def send(self, data):
+        if not isinstance(data, bytes):
+            data = data.pack()
+        super().send(data)
+        offset = 0
+        while offset < len(data):
+            _, msgType, length, _ = controller_bench.OF_HEADER.unpack_from(data, offset)
+            if msgType == of.OFPT_FLOW_MOD:
+                self.flowMods.append(decode_flow_mod(data[offset:offset + length]))
+            offset += length
+
+def decode_flow_mod(data):
+    wildcards, *_, srcIP, dstIP, _, _ = MATCH.unpack_from(data, 8)
+    cookie, command, _, _, priority, _, _, _ = FLOW_MOD.unpack_from(data, 48)
+    setDst, offset = None, 72
+    while offset < len(data):
+        actionType, length = struct.unpack_from('!HH', data, offset)
+        if actionType == 7: # Set the destination IP
+            setDst = IPAddr(data[offset + 4:offset + 8])
+        offset += length
+    return types.SimpleNamespace(cookie=cookie, command=command, priority=priority, setDst=setDst,
+                                 src=(IPAddr(srcIP), 32 - min(32, (wildcards >> 8) & 0x3f)),
+                                 dst=(IPAddr(dstIP), 32 - min(32, (wildcards >> 14) & 0x3f)))
+
+def arp_in(connection, clientIP, vip, port=1):
+    '''Have the controller handle an ARP request from `clientIP` for `vip`.'''
+    clientMAC = EthAddr(struct.pack('!HI', 0x0200, clientIP.toUnsigned() & 0xffffffff))
+    frame = arp_request(clientMAC, clientIP, vip)
+    ofp = of.ofp_packet_in(data=frame, in_port=port, reason=of.OFPR_NO_MATCH)
+    handle(core.openflow, connection, PacketIn(connection=connection, dpid=connection.dpid, ofp=ofp, port=port,
+                                               data=frame, _parsed=None))
+
+def flow_removed(connection, controller, srcIP, dstIP, cookie, deleted=False):
+    '''Have the controller handle the removal of the flow rule from `srcIP` to `dstIP`.'''
+    ofp = types.SimpleNamespace(match=controller._flow_match(srcIP, dstIP), cookie=cookie,
+                                reason=of.OFPRR_DELETE if deleted else of.OFPRR_IDLE_TIMEOUT)
+    core.openflow.raise_event('FlowRemoved', Event(connection=connection, dpid=connection.dpid, ofp=ofp,
+                                                   deleted=deleted, idleTimeout=not deleted, hardTimeout=False))
+
+def write_config(path, pools):
+    with open(path, 'w') as file:
+        json.dump({'pools': pools}, file)
+    os.utime(path, (0, os.stat(path).st_mtime + 1)) # A new modification time even within the clock's resolution
+
+logging.disable(logging.CRITICAL) # The controller complains about the broken configs it's given
+poxDir = os.environ.get('POX_DIR', os.path.expanduser('~/pox'))
+core = load_pox(poxDir if os.path.isfile(os.path.join(poxDir, 'pox', '__init__.py')) else controller_bench.STANDINS)
+of, pkt, IPAddr, EthAddr = controller_bench.of, controller_bench.pkt, controller_bench.IPAddr, controller_bench.EthAddr
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+lb = importlib.import_module('Timothy_Lawrence_u1311540')
+
+# The ARP reply templates produce the frames and packet-outs pkt.arp and of.ofp_packet_out do
+controller_bench.check_replies(core, lb)
+request = pkt.ethernet(arp_request(EthAddr('02:00:00:00:00:01'), IPAddr('10.1.0.1'), lb.SWITCH_IP)).find('arp')
+reply = pkt.arp(opcode=pkt.arp.REPLY, hwsrc=lb.SERVER_MACS[0], hwdst=request.hwsrc, protosrc=lb.SWITCH_IP,
+                protodst=request.protosrc)
+ethFrame = pkt.ethernet(src=lb.SERVER_MACS[0], dst=request.hwsrc, type=pkt.ethernet.ARP_TYPE)
+ethFrame.set_payload(reply)
+frame = lb.arp_reply_frame(request.hwsrc.toRaw(), lb.SERVER_MACS[0].toRaw(), lb.SWITCH_IP.toRaw(), request.protosrc.toRaw())
+assert frame == ethFrame.pack() and len(frame) == lb.ARP_FRAME_LENGTH
+packetOut = of.ofp_packet_out(data=frame)
+packetOut.actions.append(of.ofp_action_output(port=3))
+template = lb.PacketOutTemplate(3).pack(frame)
+assert template[:4] + template[8:] == packetOut.pack()[:4] + packetOut.pack()[8:]
+# ...and those are the bytes OpenFlow 1.0 and RFC 826 call for, worked out by hand, so the check
+# doesn't rest on the stand-ins' packing alone
+assert frame.hex() == ('020000000001' '000000000005' '0806' # Ethernet: to the client, from server 1, ARP
+                       '0001' '0800' '06' '04' '0002' # Ethernet/IPv4 reply
+                       '000000000005' '0a00000a' '020000000001' '0a010001') # 10.0.0.10 is at server 1's MAC, to 10.1.0.1
+assert template[:4].hex() + template[8:24].hex() == ('01' '0d' '0042' # OpenFlow 1.0 packet-out, 66 bytes
+                                                      'ffffffff' 'ffff' '0008' # No buffer, no in port, 8 bytes of actions
+                                                      '0000' '0008' '0003' 'ffff') # Output to port 3
+
+# An expired rule deletes the rule in the other direction exactly once, and forgets the client
+controller, connection = start(core, lb, connection=RecordingConnection(1))
+pool = controller.datapaths[1].pools[lb.SWITCH_IP]
+clientIP = IPAddr('10.1.0.1')
+arp_in(connection, clientIP, pool.vip)
+serverIP = pool.serverIPs[pool.assignments[clientIP]]
+assert len(connection.flowMods) == 2 and all(flowMod.cookie == pool.cookie for flowMod in connection.flowMods)
+connection.flowMods.clear()
+flow_removed(connection, controller, clientIP, pool.vip, pool.cookie)
+assert [(flowMod.command, flowMod.src, flowMod.dst) for flowMod in connection.flowMods] == \
+    [(of.OFPFC_DELETE_STRICT, (serverIP, 32), (clientIP, 32))]
+assert clientIP not in pool.assignments and clientIP not in controller.datapaths[1].mac_table
+flow_removed(connection, controller, serverIP, clientIP, pool.cookie, deleted=True) # The one we deleted
+assert len(connection.flowMods) == 1 and clientIP not in pool.assignments
+
+# Likewise when the reverse rule expires first
+arp_in(connection, clientIP, pool.vip)
+serverIP = pool.serverIPs[pool.assignments[clientIP]]
+connection.flowMods.clear()
+flow_removed(connection, controller, serverIP, clientIP, pool.cookie)
+assert [(flowMod.command, flowMod.src, flowMod.dst) for flowMod in connection.flowMods] == \
+    [(of.OFPFC_DELETE_STRICT, (clientIP, 32), (pool.vip, 32))]
+assert clientIP not in pool.assignments
+flow_removed(connection, controller, clientIP, pool.vip, pool.cookie, deleted=True)
+assert len(connection.flowMods) == 1
+
+# Proactive rules cover the whole client network, each block going to the server its clients are assigned
+for network, buckets in (('10.1.0.0/16', 8), ('10.2.0.0/30', 4), ('10.3.0.0/24', 1)):
+    controller, connection = start(core, lb, connection=RecordingConnection(1), proactive=network, buckets=buckets)
+    pool = controller.datapaths[1].pools[lb.SWITCH_IP]
+    rules = sorted((flowMod for flowMod in connection.flowMods if flowMod.priority == lb.PROACTIVE_PRIORITY),
+                   key=lambda flowMod: flowMod.src[0].toUnsigned())
+    assert len(rules) == buckets and all(rule.dst == (pool.vip, 32) for rule in rules)
+    address, prefixLength = pool.proactiveNetwork
+    address = address.toUnsigned()
+    for rule in rules:
+        block, length = rule.src
+        assert block.toUnsigned() == address, f"{network}: gap or overlap at {block}/{length}"
+        address += 1 << (32 - length)
+        for clientIP in (block, IPAddr(address - 1)):
+            assert rule.setDst == pool.serverIPs[pool.proactive_server(clientIP)]
+    assert address == pool.proactiveNetwork[0].toUnsigned() + (1 << (32 - prefixLength))
+    assert buckets == 1 or [pool.bucketServers.count(server) for server in (0, 1)] == [buckets // 2] * 2 # Equal weights
+
+with tempfile.TemporaryDirectory() as directory:
+    # Pool configs are checked as they're loaded
+    here = os.path.dirname(os.path.abspath(__file__))
+    assert [config['vip'] for config in lb.load_pool_configs(os.path.join(here, 'pools.json'))] == ['10.0.0.10', '10.0.0.20']
+    path = os.path.join(directory, 'pools.json')
+    server = {'ip': '10.0.0.5', 'mac': '00:00:00:00:00:05', 'port': 5}
+    for broken in ([], [{'servers': [server]}], [{'vip': '10.0.0.10', 'servers': []}],
+                   [{'vip': '10.0.0.10', 'servers': [{**server, 'ip': '10.0.0.300'}]}],
+                   [{'vip': '10.0.0.10', 'servers': [{**server, 'weight': 0}]}],
+                   [{'vip': '10.0.0.10', 'servers': [server], 'policy': 'random'}],
+                   [{'vip': '10.0.0.10', 'servers': [server], 'proactive': '10.1.0.0/24', 'buckets': 3}],
+                   [{'vip': '10.0.0.10', 'servers': [server], 'proactive': '10.1.0.0/31', 'buckets': 4}]):
+        write_config(path, broken)
+        try:
+            lb.load_pool_configs(path)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(broken)
+
+    # A pool listing a switch replaces the pool for every switch with its virtual IP, wherever it's listed
+    controller, _ = start(core, lb, os.path.join(here, 'pools.json'))
+    assert {str(pool.vip) for pool in controller._pools_for(1)} == {'10.0.0.10', '10.0.0.20'}
+    assert {str(pool.vip) for pool in controller._pools_for(2)} == {'10.0.0.10'}
+    anywhere = {'vip': '10.0.0.10', 'servers': [server]}
+    listed = {**anywhere, 'dpids': ['00-00-00-00-00-02'], 'policy': 'least-bytes'}
+    for pools in ([anywhere, listed], [listed, anywhere]):
+        write_config(path, pools)
+        controller, _ = start(core, lb, path)
+        assert [pool.config['policy'] for pool in controller._pools_for(2)] == ['least-bytes']
+        assert [pool.config['policy'] for pool in controller._pools_for(1)] == [lb.DEFAULT_POLICY]
+
+    # A reload keeps the pools that didn't change, with their clients, and drops the others' rules and clients
+    first = {'vip': '10.0.0.10', 'servers': [server, {'ip': '10.0.0.6', 'mac': '00:00:00:00:00:06', 'port': 6}]}
+    second = {'vip': '10.0.0.20', 'servers': [{'ip': '10.0.0.7', 'mac': '00:00:00:00:00:07', 'port': 7}]}
+    write_config(path, [first, second])
+    controller, connection = start(core, lb, path, connection=RecordingConnection(1))
+    datapath = controller.datapaths[1]
+    kept, replaced = datapath.pools[IPAddr('10.0.0.10')], datapath.pools[IPAddr('10.0.0.20')]
+    clientIP = IPAddr('10.1.0.1')
+    arp_in(connection, clientIP, kept.vip)
+    arp_in(connection, clientIP, replaced.vip)
+    connection.flowMods.clear()
+    write_config(path, [first, {**second, 'policy': 'least-flows'}])
+    assert controller.reload()
+    assert datapath.pools[kept.vip] is kept and clientIP in kept.assignments
+    new = datapath.pools[replaced.vip]
+    assert new is not replaced and new.cookie != replaced.cookie and not new.assignments
+    assert [(flowMod.command, flowMod.src[0], flowMod.dst) for flowMod in connection.flowMods] == \
+        [(of.OFPFC_DELETE, IPAddr(0), (replaced.vip, 32)),
+         (of.OFPFC_DELETE_STRICT, replaced.serverIPs[0], (clientIP, 32))]
+
+    # Removals of the dropped pool's rules, reported late, leave the client's new assignment alone
+    arp_in(connection, clientIP, new.vip)
+    connection.flowMods.clear()
+    flow_removed(connection, controller, clientIP, new.vip, replaced.cookie, deleted=True)
+    flow_removed(connection, controller, new.serverIPs[0], clientIP, replaced.cookie, deleted=True)
+    flow_removed(connection, controller, clientIP, new.vip, replaced.cookie) # Expired just before the reload
+    assert clientIP in new.assignments and connection.flowMods == []
+
+    # A pool no longer in the config is dropped; a config that can't be used changes nothing
+    write_config(path, [first])
+    assert controller.reload() and list(datapath.pools) == [kept.vip] and list(datapath.serverPools) == kept.serverIPs
+    assert connection.flowMods[0].command == of.OFPFC_DELETE and connection.flowMods[0].dst == (new.vip, 32)
+    write_config(path, [])
+    assert not controller.reload() and datapath.pools[kept.vip] is kept
+print('controller_test passed')
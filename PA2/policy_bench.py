@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+
+# Replays skewed client traffic against each server selection policy and reports how evenly
+# the load ends up spread over the servers. Clients arrive at random, each with a heavy-tailed
+# (Pareto) traffic rate and a random lifetime; the policies only see the load through statistics
+# polled every few seconds, as the controller does. Runs offline, without POX or Mininet.
+# Usage: policy_bench.py [options], see --help.
+
+import json
+import random
+from optparse import OptionParser
+
+from selection_policies import LoadTracker, POLICIES
+
+STEP = 0.5 # Simulated seconds per step
+
+class Client:
+    def __init__(self, ip, rate, end):
+        self.ip = ip
+        self.rate = rate # Bytes per second
+        self.end = end # Time the client leaves
+        self.bytes = 0.0 # Sent through its flow so far
+
+def generate_clients(options):
+    '''Arrival time, traffic rate and lifetime of every client, the same for each policy.'''
+    rng = random.Random(options.seed)
+    clients, now = [], 0.0
+    while True:
+        now += rng.expovariate(options.arrivals)
+        if now >= options.duration: return clients
+        rate = options.rate * rng.paretovariate(options.skew)
+        clients.append((now, rate, now + rng.expovariate(1 / options.lifetime)))
+
+def simulate(policyName, weights, clients, options):
+    '''Runs the clients against ``policyName``. Returns the bytes each server carried
+    and the mean, over time, of the busiest server's rate relative to the average (both per unit weight).'''
+    policy = POLICIES[policyName]()
+    loads = LoadTracker(weights)
+    live = [[] for _ in weights] # Clients on each server
+    served = [0.0] * len(weights)
+    peaks, arrivals, nextPoll = [], iter(enumerate(clients)), options.interval
+    pending = next(arrivals, None)
+    for step in range(int(options.duration / STEP)):
+        now = step * STEP
+        while pending is not None and pending[1][0] <= now:
+            index, (_, rate, end) = pending
+            serverIndex = policy.select(loads.servers)
+            loads.assign(serverIndex)
+            live[serverIndex].append(Client(index, rate, end))
+            pending = next(arrivals, None)
+        rates = []
+        for serverIndex, flows in enumerate(live):
+            flows[:] = [client for client in flows if client.end > now] # Expired flows leave the table
+            rate = sum(client.rate for client in flows)
+            for client in flows: client.bytes += client.rate * STEP
+            served[serverIndex] += rate * STEP
+            rates.append(rate / weights[serverIndex])
+        if sum(rates): peaks.append(max(rates) / (sum(rates) / len(rates)))
+        if now + STEP >= nextPoll:
+            nextPoll += options.interval
+            loads.request() # The switch answers at once
+            loads.update_flows([{client.ip: client.bytes for client in flows} for flows in live])
+            loads.update_ports(served, now + STEP)
+    return served, sum(peaks) / len(peaks)
+
+def main():
+    parser = OptionParser(description='Compares server selection policies on skewed client traffic.')
+    parser.add_option('-w', '--weights', type='string', dest='weights', default='1,1,1,1',
+                      help='comma-separated weight per server')
+    parser.add_option('-d', '--duration', type='float', dest='duration', default=3600, help='simulated seconds')
+    parser.add_option('-a', '--arrivals', type='float', dest='arrivals', default=2.0, help='new clients per second')
+    parser.add_option('-l', '--lifetime', type='float', dest='lifetime', default=60, help='mean client lifetime in seconds')
+    parser.add_option('-r', '--rate', type='float', dest='rate', default=10000, help='minimum client rate in bytes per second')
+    parser.add_option('-k', '--skew', type='float', dest='skew', default=1.2,
+                      help='Pareto shape of client rates; smaller is more skewed')
+    parser.add_option('-i', '--interval', type='float', dest='interval', default=5, help='seconds between statistics polls')
+    parser.add_option('-p', '--policy', action='append', choices=list(POLICIES), dest='policies',
+                      help='policy to run (repeatable); all by default')
+    parser.add_option('--seed', type='int', dest='seed', default=4480, help='seed of the first run')
+    parser.add_option('-n', '--runs', type='int', dest='runs', default=1,
+                      help='runs with consecutive seeds, averaged; one heavy client can dominate a single run')
+    parser.add_option('--json', type='string', dest='json', help='also write the results to this file')
+    (options, args) = parser.parse_args()
+
+    weights = [int(weight) for weight in options.weights.split(',')]
+    runs = []
+    for seed in range(options.seed, options.seed + options.runs):
+        options.seed = seed
+        runs.append(generate_clients(options))
+    options.seed -= options.runs - 1
+    print(f"{sum(map(len, runs)) / len(runs):.0f} clients over {options.duration:.0f} s, {len(weights)} servers "
+          f"weighted {weights}, {len(runs)} run(s)")
+    print(f"{'policy':<22} {'max/mean bytes':>14} {'mean peak/mean rate':>19}  share of bytes per server")
+    results = []
+    for name in options.policies or POLICIES:
+        imbalances, peaks, shares = [], [], [0.0] * len(weights)
+        for clients in runs:
+            served, peak = simulate(name, weights, clients, options)
+            normalized = [bytes / weight for bytes, weight in zip(served, weights)]
+            imbalances.append(max(normalized) / (sum(normalized) / len(normalized)))
+            peaks.append(peak)
+            shares = [total + bytes / sum(served) / len(runs) for total, bytes in zip(shares, served)]
+        imbalance, peak = sum(imbalances) / len(runs), sum(peaks) / len(runs)
+        results.append({'policy': name, 'imbalance': imbalance, 'peakToMean': peak, 'shares': shares,
+                        'runs': [{'imbalance': a, 'peakToMean': b} for a, b in zip(imbalances, peaks)]})
+        print(f"{name:<22} {imbalance:>14.3f} {peak:>19.3f}  {' '.join(f'{share:.1%}' for share in shares)}")
+    if options.json:
+        with open(options.json, 'w') as file:
+            json.dump({'options': vars(options), 'results': results}, file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+# Server selection policies for the virtual IP load balancer, and the per-server load they work from.
+# Load comes from the switch's flow and port statistics, polled by the controller between PacketIns.
+# Kept free of POX imports so the policies can be exercised offline (see policy_bench.py).
+# Written for CS4480, Spring 2025
+
+class ServerLoad:
+    '''Load on one server, as of the last statistics polled from the switch.'''
+    def __init__(self, weight=1):
+        self.weight = weight
+        self.flows = 0 # Client flows towards the server in the last flow statistics
+        self.byteRate = 0.0 # Bytes per second through the server's switch port since the previous poll
+        self.assigned = 0 # Clients assigned that the last flow statistics don't reflect yet
+        self._requested = 0 # Of those, the ones assigned before the pending statistics were requested
+        self._portBytes = None # Byte count of the server's port at the last poll
+        self._portTime = None
+
+class LoadTracker:
+    '''Keeps the load on each server up to date from polled statistics.'''
+    def __init__(self, weights):
+        self.servers = [ServerLoad(weight) for weight in weights]
+
+    def assign(self, index):
+        '''Account for a client just assigned to server ``index``.'''
+        self.servers[index].assigned += 1
+
+    def request(self):
+        '''Account for flow statistics just requested from the switch. The clients assigned so far
+        have their flows installed, so the reply reflects them; later ones must still be counted.'''
+        for server in self.servers:
+            server._requested = server.assigned
+
+    def update_flows(self, flowBytes):
+        '''Update from flow statistics. ``flowBytes[i]`` maps each client with a flow towards
+        server ``i`` to the flow's byte count. Every flow still in the switch's table is active:
+        idle flows time out of it.'''
+        for server, counts in zip(self.servers, flowBytes):
+            server.flows = len(counts)
+            server.assigned -= server._requested # Now in the statistics, or already expired
+            server._requested = 0
+
+    def update_ports(self, portBytes, now):
+        '''Update from port statistics. ``portBytes[i]`` is the byte count of server ``i``'s switch port
+        at time ``now`` (in seconds), or ``None`` if the switch didn't report it.'''
+        for server, count in zip(self.servers, portBytes):
+            if count is None: continue
+            if server._portBytes is not None and now > server._portTime:
+                server.byteRate = max(0, count - server._portBytes) / (now - server._portTime)
+            server._portBytes, server._portTime = count, now
+
+class RoundRobinPolicy:
+    '''Hands out the servers in turn, regardless of load.'''
+    name = 'round-robin'
+
+    def __init__(self):
+        self._next = 0
+
+    def select(self, servers):
+        index = self._next % len(servers)
+        self._next = index + 1
+        return index
+
+class WeightedRoundRobinPolicy:
+    '''Hands out the servers in turn, in proportion to their weights, spreading each server's
+    turns evenly (smooth weighted round-robin, as in nginx).'''
+    name = 'weighted-round-robin'
+
+    def __init__(self):
+        self._current = []
+
+    def select(self, servers):
+        if len(self._current) != len(servers): self._current = [0] * len(servers)
+        for index, server in enumerate(servers): self._current[index] += server.weight
+        index = max(range(len(servers)), key=self._current.__getitem__)
+        self._current[index] -= sum(server.weight for server in servers)
+        return index
+
+class LeastFlowsPolicy:
+    '''Picks the server with the fewest active client flows for its weight.'''
+    name = 'least-flows'
+
+    def select(self, servers):
+        return min(range(len(servers)), key=lambda i: (servers[i].flows + servers[i].assigned) / servers[i].weight)
+
+class LeastBytesPolicy:
+    '''Picks the server carrying the least traffic for its weight. Clients assigned since the
+    last poll are counted as carrying the average traffic of an active flow, so that a burst of
+    new clients between polls doesn't all land on the same server.'''
+    name = 'least-bytes'
+
+    def select(self, servers):
+        activeFlows = sum(server.flows for server in servers)
+        flowRate = sum(server.byteRate for server in servers) / activeFlows if activeFlows else 0.0
+        def load(i):
+            server = servers[i]
+            return ((server.byteRate + server.assigned * flowRate) / server.weight,
+                    (server.flows + server.assigned) / server.weight)
+        return min(range(len(servers)), key=load)
+
+POLICIES = {policy.name: policy for policy in (RoundRobinPolicy, WeightedRoundRobinPolicy, LeastFlowsPolicy, LeastBytesPolicy)}
@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+# Checks the server selection policies and the load they work from, without POX.
+
+from selection_policies import (LeastBytesPolicy, LeastFlowsPolicy, LoadTracker, RoundRobinPolicy,
+                                WeightedRoundRobinPolicy)
+
+def picks(policy, servers, count):
+    return [policy.select(servers) for _ in range(count)]
+
+# Round-robin ignores weights; smooth weighted round-robin interleaves each server's turns
+assert picks(RoundRobinPolicy(), LoadTracker([5, 1, 1]).servers, 7) == [0, 1, 2, 0, 1, 2, 0]
+assert picks(WeightedRoundRobinPolicy(), LoadTracker([5, 1, 1]).servers, 14) == [0, 0, 1, 0, 2, 0, 0] * 2
+assert picks(WeightedRoundRobinPolicy(), LoadTracker([1, 1, 1]).servers, 6) == [0, 1, 2, 0, 1, 2]
+assert sorted(picks(WeightedRoundRobinPolicy(), LoadTracker([3, 2]).servers, 5)) == [0, 0, 0, 1, 1]
+
+# Least-flows counts clients assigned since the last statistics, per unit weight, and breaks ties by order
+loads = LoadTracker([1, 1, 2])
+policy = LeastFlowsPolicy()
+assert policy.select(loads.servers) == 0
+loads.update_flows([{'a': 1, 'b': 1}, {'c': 1}, {'d': 1, 'e': 1}])
+assert [server.flows for server in loads.servers] == [2, 1, 2]
+assert policy.select(loads.servers) == 1 # 2 flows at weight 2 tie server 1's single flow
+loads.assign(1)
+assert policy.select(loads.servers) == 2
+loads.assign(2)
+loads.assign(2)
+assert policy.select(loads.servers) == 0
+
+# Assignments stay counted until statistics requested after them come back; idle flows still count
+loads = LoadTracker([1, 1])
+loads.assign(0)
+loads.request()
+loads.assign(0) # After the request: not in the reply
+loads.update_flows([{'a': 10}, {'b': 10}])
+assert loads.servers[0].flows == 1 and loads.servers[0].assigned == 1
+loads.request()
+loads.update_flows([{'a': 10, 'c': 0}, {'b': 10}]) # No new bytes since the last poll, still active
+assert [server.flows for server in loads.servers] == [2, 1] and loads.servers[0].assigned == 0
+loads.assign(1)
+loads.update_flows([{}, {}]) # A reply to no request of ours reflects nothing new
+assert loads.servers[1].assigned == 1
+
+# Port rates come from the difference between polls; a missing or reset counter doesn't break them
+loads = LoadTracker([1, 1])
+loads.update_ports([1000, 2000], 10.0)
+assert [server.byteRate for server in loads.servers] == [0.0, 0.0]
+loads.update_ports([3000, None], 12.0)
+assert [server.byteRate for server in loads.servers] == [1000.0, 0.0]
+loads.update_ports([3000, 6000], 14.0)
+assert [server.byteRate for server in loads.servers] == [0.0, 1000.0] # Server 1 over 4 s
+loads.update_ports([500, 6000], 15.0)
+assert loads.servers[0].byteRate == 0.0
+loads.update_ports([1500, 6000], 15.0) # No time passed
+assert loads.servers[0].byteRate == 0.0
+loads.update_ports([2500, 6000], 16.0)
+assert loads.servers[0].byteRate == 1000.0
+
+# Least-bytes weighs traffic per unit weight, counts new clients at the average flow rate,
+# and breaks ties by flows
+loads = LoadTracker([1, 1, 2])
+policy = LeastBytesPolicy()
+loads.update_flows([{'a': 1}, {'b': 1}, {'c': 1, 'd': 1}])
+for server, rate in zip(loads.servers, (300.0, 400.0, 700.0)):
+    server.byteRate = rate
+assert policy.select(loads.servers) == 0
+loads.assign(0) # 300 + 350 on average per flow
+assert policy.select(loads.servers) == 2
+loads.servers[2].byteRate = 800.0 # 400 per unit weight, with 1 flow per unit weight
+loads.servers[0].assigned = 0
+loads.servers[0].byteRate = 400.0
+loads.servers[0].flows = 2
+assert policy.select(loads.servers) == 1
+print('selection_policies_test passed')
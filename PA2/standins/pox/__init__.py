@@ -0,0 +1,4 @@
+# Minimal stand-ins for the parts of POX the load balancer uses, laid out like a POX checkout,
+# so that controller_bench.py and controller_test.py run without one (pass --pox standins).
+# Messages and packets pack to the same OpenFlow 1.0 and Ethernet/ARP/IPv4 wire formats as POX's;
+# anything the load balancer doesn't use is left out. pox.core is always replaced by a stub.
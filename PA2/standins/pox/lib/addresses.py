@@ -0,0 +1,82 @@
+# Stand-ins for POX's IPv4 and Ethernet address classes.
+
+import socket
+import struct
+
+class IPAddr:
+    '''An IPv4 address, from a dotted string, 4 raw bytes or an unsigned number.'''
+    def __init__(self, addr):
+        if isinstance(addr, IPAddr):
+            self._value = addr._value
+        elif isinstance(addr, str):
+            self._value = struct.unpack('!I', socket.inet_aton(addr))[0]
+        elif isinstance(addr, bytes):
+            self._value = struct.unpack('!I', addr)[0]
+        else:
+            self._value = int(addr) & 0xffffffff
+
+    def toUnsigned(self):
+        return self._value
+
+    def toRaw(self):
+        return struct.pack('!I', self._value)
+
+    def __str__(self):
+        return socket.inet_ntoa(self.toRaw())
+
+    def __repr__(self):
+        return f"IPAddr('{self}')"
+
+    def __eq__(self, other):
+        try:
+            return self._value == IPAddr(other)._value
+        except (TypeError, ValueError, OSError, struct.error):
+            return NotImplemented
+
+    def __hash__(self):
+        return hash(self._value)
+
+class EthAddr:
+    '''An Ethernet address, from a string like 00:00:00:00:00:01 or 6 raw bytes.'''
+    def __init__(self, addr):
+        if isinstance(addr, EthAddr):
+            self._value = addr._value
+        elif isinstance(addr, str):
+            self._value = bytes(int(part, 16) for part in addr.replace('-', ':').split(':'))
+        else:
+            self._value = bytes(addr)
+        if len(self._value) != 6:
+            raise RuntimeError(f"Expected an Ethernet address, got {addr!r}")
+
+    def toRaw(self):
+        return self._value
+
+    def __str__(self):
+        return ':'.join(f'{byte:02x}' for byte in self._value)
+
+    def __repr__(self):
+        return f"EthAddr('{self}')"
+
+    def __eq__(self, other):
+        try:
+            return self._value == EthAddr(other)._value
+        except (TypeError, ValueError, RuntimeError):
+            return NotImplemented
+
+    def __hash__(self):
+        return hash(self._value)
+
+IP_ANY = IPAddr('0.0.0.0')
+ETHER_ANY = EthAddr(bytes(6))
+ETHER_BROADCAST = EthAddr(b'\xff' * 6)
+
+def parse_cidr(addr):
+    '''The network address and prefix length of a CIDR string like 10.0.0.0/24.'''
+    network, _, length = addr.partition('/')
+    length = int(length) if length else 32
+    if not 0 <= length <= 32:
+        raise RuntimeError(f"Bad prefix length in {addr}")
+    network = IPAddr(network)
+    if network.toUnsigned() & ((1 << (32 - length)) - 1):
+        raise RuntimeError(f"Host bits set in {addr}")
+    return network, length
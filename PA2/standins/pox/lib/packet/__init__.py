@@ -0,0 +1,123 @@
+# Stand-ins for POX's Ethernet, ARP and IPv4 packet classes: each parses from raw bytes and packs back to them.
+
+import struct
+
+from pox.lib.addresses import IPAddr, EthAddr, IP_ANY, ETHER_ANY
+
+class packet_base:
+    '''A packet parsed from `raw`, or built from keyword arguments, with the packet it carries as `payload`.'''
+    def __init__(self, raw=None, prev=None, **kw):
+        self.prev = prev
+        self.payload = None
+        self.parsed = False
+        if raw is not None:
+            self.parse(bytes(raw))
+        for name, value in kw.items():
+            setattr(self, name, value)
+
+    @property
+    def next(self):
+        return self.payload
+
+    def set_payload(self, payload):
+        self.payload = payload
+        if isinstance(payload, packet_base):
+            payload.prev = self
+
+    def find(self, proto):
+        '''This packet or the first one it carries whose type is named `proto`.'''
+        packet = self
+        while isinstance(packet, packet_base):
+            if type(packet).__name__ == proto:
+                return packet
+            packet = packet.payload
+        return None
+
+    def pack(self):
+        payload = self.payload.pack() if isinstance(self.payload, packet_base) else (self.payload or b'')
+        return self.hdr(payload) + payload
+
+class ethernet(packet_base):
+    IP_TYPE = 0x0800
+    ARP_TYPE = 0x0806
+    HEADER = struct.Struct('!6s6sH')
+
+    def __init__(self, raw=None, prev=None, **kw):
+        self.dst = ETHER_ANY
+        self.src = ETHER_ANY
+        self.type = 0
+        super().__init__(raw, prev, **kw)
+
+    def parse(self, raw):
+        if len(raw) < self.HEADER.size:
+            return
+        dst, src, self.type = self.HEADER.unpack_from(raw)
+        self.dst, self.src = EthAddr(dst), EthAddr(src)
+        payloadType = {self.ARP_TYPE: arp, self.IP_TYPE: ipv4}.get(self.type)
+        self.payload = payloadType(raw[self.HEADER.size:], prev=self) if payloadType else raw[self.HEADER.size:]
+        self.parsed = True
+
+    def hdr(self, payload):
+        return self.HEADER.pack(EthAddr(self.dst).toRaw(), EthAddr(self.src).toRaw(), self.type)
+
+class arp(packet_base):
+    REQUEST = 1
+    REPLY = 2
+    HW_TYPE_ETHERNET = 1
+    PROTO_TYPE_IP = 0x0800
+    HEADER = struct.Struct('!HHBBH6s4s6s4s')
+
+    def __init__(self, raw=None, prev=None, **kw):
+        self.hwtype = self.HW_TYPE_ETHERNET
+        self.prototype = self.PROTO_TYPE_IP
+        self.hwlen = 6
+        self.protolen = 4
+        self.opcode = self.REQUEST
+        self.hwsrc = ETHER_ANY
+        self.hwdst = ETHER_ANY
+        self.protosrc = IP_ANY
+        self.protodst = IP_ANY
+        super().__init__(raw, prev, **kw)
+
+    def parse(self, raw):
+        if len(raw) < self.HEADER.size:
+            return
+        (self.hwtype, self.prototype, self.hwlen, self.protolen, self.opcode,
+         hwsrc, protosrc, hwdst, protodst) = self.HEADER.unpack_from(raw)
+        self.hwsrc, self.protosrc, self.hwdst, self.protodst = EthAddr(hwsrc), IPAddr(protosrc), EthAddr(hwdst), IPAddr(protodst)
+        self.parsed = True
+
+    def hdr(self, payload):
+        return self.HEADER.pack(self.hwtype, self.prototype, self.hwlen, self.protolen, self.opcode,
+                                EthAddr(self.hwsrc).toRaw(), IPAddr(self.protosrc).toRaw(),
+                                EthAddr(self.hwdst).toRaw(), IPAddr(self.protodst).toRaw())
+
+class ipv4(packet_base):
+    ICMP_PROTOCOL = 1
+    HEADER = struct.Struct('!BBHHHBBH4s4s')
+
+    def __init__(self, raw=None, prev=None, **kw):
+        self.tos = 0
+        self.id = 0
+        self.ttl = 64
+        self.protocol = 0
+        self.srcip = IP_ANY
+        self.dstip = IP_ANY
+        super().__init__(raw, prev, **kw)
+
+    def parse(self, raw):
+        if len(raw) < self.HEADER.size:
+            return
+        versionLength, self.tos, length, self.id, _, self.ttl, self.protocol, _, srcip, dstip = self.HEADER.unpack_from(raw)
+        self.srcip, self.dstip = IPAddr(srcip), IPAddr(dstip)
+        self.payload = raw[(versionLength & 0xf) * 4:length]
+        self.parsed = True
+
+    def hdr(self, payload):
+        fields = [0x45, self.tos, self.HEADER.size + len(payload), self.id, 0, self.ttl, self.protocol, 0,
+                  IPAddr(self.srcip).toRaw(), IPAddr(self.dstip).toRaw()]
+        words = struct.unpack('!10H', self.HEADER.pack(*fields))
+        checksum = sum(words)
+        checksum = (checksum & 0xffff) + (checksum >> 16)
+        fields[7] = ~((checksum & 0xffff) + (checksum >> 16)) & 0xffff
+        return self.HEADER.pack(*fields)
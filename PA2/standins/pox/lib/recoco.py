@@ -0,0 +1,11 @@
+# Stand-in for POX's timer. Nothing runs on its own offline: callers fire timers themselves.
+
+class Timer:
+    '''A timer that calls `callback` when `fire` is called.'''
+    def __init__(self, timeToWake, callback, recurring=False):
+        self.timeToWake = timeToWake
+        self.callback = callback
+        self.recurring = recurring
+
+    def fire(self):
+        self.callback()
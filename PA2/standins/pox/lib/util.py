@@ -0,0 +1,9 @@
+# Stand-ins for POX's datapath ID helpers.
+
+def dpid_to_str(dpid):
+    '''A datapath ID as a string like 00-00-00-00-00-01.'''
+    return '-'.join(f'{byte:02x}' for byte in dpid.to_bytes(6, 'big'))
+
+def str_to_dpid(s):
+    '''A datapath ID from a string like 00-00-00-00-00-01.'''
+    return int(s.replace('-', '').replace(':', ''), 16)
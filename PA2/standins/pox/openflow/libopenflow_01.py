@@ -0,0 +1,249 @@
+# Stand-ins for the OpenFlow 1.0 messages and actions of POX's libopenflow_01 that the load balancer sends.
+
+import itertools
+import struct
+
+from pox.lib.addresses import IPAddr, EthAddr, parse_cidr
+
+OFP_VERSION = 0x01
+OFP_DEFAULT_PRIORITY = 0x8000
+OFP_HEADER = struct.Struct('!BBHI') # Version, type, length, xid
+
+OFPT_PACKET_IN = 10
+OFPT_FLOW_REMOVED = 11
+OFPT_PACKET_OUT = 13
+OFPT_FLOW_MOD = 14
+OFPT_STATS_REQUEST = 16
+OFPT_BARRIER_REQUEST = 18
+
+OFPFC_ADD = 0
+OFPFC_MODIFY = 1
+OFPFC_MODIFY_STRICT = 2
+OFPFC_DELETE = 3
+OFPFC_DELETE_STRICT = 4
+
+OFPFF_SEND_FLOW_REM = 1
+
+OFPP_IN_PORT = 0xfff8
+OFPP_TABLE = 0xfff9
+OFPP_CONTROLLER = 0xfffd
+OFPP_NONE = 0xffff
+
+OFPR_NO_MATCH = 0
+OFPR_ACTION = 1
+
+OFPRR_IDLE_TIMEOUT = 0
+OFPRR_HARD_TIMEOUT = 1
+OFPRR_DELETE = 2
+
+OFPST_FLOW = 1
+OFPST_PORT = 4
+
+NO_BUFFER = 0xffffffff
+
+_xids = itertools.count(0x80000000)
+
+def generate_xid():
+    return next(_xids)
+
+class ofp_match:
+    '''Fields to match, any left as None being wildcarded. `nw_src` and `nw_dst` may be given as
+    CIDR strings; `get_nw_src` and `get_nw_dst` return the address and prefix length.'''
+    FIELDS = ('in_port', 'dl_src', 'dl_dst', 'dl_vlan', 'dl_vlan_pcp', 'dl_type', 'nw_tos', 'nw_proto',
+              'nw_src', 'nw_dst', 'tp_src', 'tp_dst')
+    WILDCARDS = {'in_port': 1 << 0, 'dl_vlan': 1 << 1, 'dl_src': 1 << 2, 'dl_dst': 1 << 3, 'dl_type': 1 << 4,
+                 'nw_proto': 1 << 5, 'tp_src': 1 << 6, 'tp_dst': 1 << 7, 'dl_vlan_pcp': 1 << 20, 'nw_tos': 1 << 21}
+    NW_SRC_SHIFT = 8
+    NW_DST_SHIFT = 14
+    LAYOUT = struct.Struct('!IH6s6sHBxHBBxxIIHH')
+
+    def __init__(self, **kw):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        for field, value in kw.items():
+            setattr(self, field, value)
+
+    def __setattr__(self, name, value):
+        if name in ('nw_src', 'nw_dst'):
+            bits = 32
+            if isinstance(value, str):
+                value, bits = parse_cidr(value) if '/' in value else (IPAddr(value), 32)
+            elif value is not None:
+                value = IPAddr(value)
+            object.__setattr__(self, '_' + name + '_bits', bits)
+        object.__setattr__(self, name, value)
+
+    def get_nw_src(self):
+        return (self.nw_src, self._nw_src_bits) if self.nw_src is not None else (None, 0)
+
+    def get_nw_dst(self):
+        return (self.nw_dst, self._nw_dst_bits) if self.nw_dst is not None else (None, 0)
+
+    def pack(self):
+        wildcards = sum(bit for field, bit in self.WILDCARDS.items() if getattr(self, field) is None)
+        wildcards |= (32 - self.get_nw_src()[1]) << self.NW_SRC_SHIFT
+        wildcards |= (32 - self.get_nw_dst()[1]) << self.NW_DST_SHIFT
+        def value(field, default=0):
+            return default if getattr(self, field) is None else getattr(self, field)
+        return self.LAYOUT.pack(wildcards, value('in_port'), EthAddr(value('dl_src', bytes(6))).toRaw(),
+                                EthAddr(value('dl_dst', bytes(6))).toRaw(), value('dl_vlan'), value('dl_vlan_pcp'),
+                                value('dl_type'), value('nw_tos'), value('nw_proto'),
+                                value('nw_src', IPAddr(0)).toUnsigned(), value('nw_dst', IPAddr(0)).toUnsigned(),
+                                value('tp_src'), value('tp_dst'))
+
+    def __eq__(self, other):
+        return isinstance(other, ofp_match) and self.pack() == other.pack()
+
+    def __hash__(self):
+        return hash(self.pack())
+
+class ofp_action_output:
+    def __init__(self, port, max_len=0xffff):
+        self.port = port
+        self.max_len = max_len
+
+    def pack(self):
+        return struct.pack('!HHHH', 0, 8, self.port, self.max_len)
+
+class ofp_action_dl_addr:
+    def __init__(self, type, dl_addr):
+        self.type = type
+        self.dl_addr = EthAddr(dl_addr)
+
+    @classmethod
+    def set_src(cls, dl_addr):
+        return cls(4, dl_addr)
+
+    @classmethod
+    def set_dst(cls, dl_addr):
+        return cls(5, dl_addr)
+
+    def pack(self):
+        return struct.pack('!HH6s6x', self.type, 16, self.dl_addr.toRaw())
+
+class ofp_action_nw_addr:
+    def __init__(self, type, nw_addr):
+        self.type = type
+        self.nw_addr = IPAddr(nw_addr)
+
+    @classmethod
+    def set_src(cls, nw_addr):
+        return cls(6, nw_addr)
+
+    @classmethod
+    def set_dst(cls, nw_addr):
+        return cls(7, nw_addr)
+
+    def pack(self):
+        return struct.pack('!HHI', self.type, 8, self.nw_addr.toUnsigned())
+
+class ofp_header:
+    '''An OpenFlow message, whose xid is generated when first needed.'''
+    header_type = None
+
+    def __init__(self, **kw):
+        self._xid = None
+        for name, value in kw.items():
+            setattr(self, name, value)
+
+    @property
+    def xid(self):
+        if self._xid is None:
+            self._xid = generate_xid()
+        return self._xid
+
+    @xid.setter
+    def xid(self, value):
+        self._xid = value
+
+    def pack(self):
+        body = self._pack_body()
+        return OFP_HEADER.pack(OFP_VERSION, self.header_type, OFP_HEADER.size + len(body), self.xid) + body
+
+    def _pack_body(self):
+        return b''
+
+class ofp_flow_mod(ofp_header):
+    header_type = OFPT_FLOW_MOD
+
+    def __init__(self, **kw):
+        self.match = ofp_match()
+        self.cookie = 0
+        self.command = OFPFC_ADD
+        self.idle_timeout = 0
+        self.hard_timeout = 0
+        self.priority = OFP_DEFAULT_PRIORITY
+        self.buffer_id = None
+        self.out_port = OFPP_NONE
+        self.flags = 0
+        self.actions = []
+        super().__init__(**kw)
+
+    def _pack_body(self):
+        return (self.match.pack() +
+                struct.pack('!QHHHHIHH', self.cookie, self.command, self.idle_timeout, self.hard_timeout, self.priority,
+                            NO_BUFFER if self.buffer_id is None else self.buffer_id, self.out_port, self.flags) +
+                b''.join(action.pack() for action in self.actions))
+
+class ofp_packet_in(ofp_header):
+    header_type = OFPT_PACKET_IN
+
+    def __init__(self, **kw):
+        self.buffer_id = None
+        self.in_port = OFPP_NONE
+        self.reason = OFPR_NO_MATCH
+        self.data = b''
+        super().__init__(**kw)
+
+class ofp_packet_out(ofp_header):
+    header_type = OFPT_PACKET_OUT
+
+    def __init__(self, **kw):
+        self.buffer_id = None
+        self.in_port = OFPP_NONE
+        self.data = b''
+        self.actions = []
+        super().__init__(**kw)
+
+    def _pack_body(self):
+        data, bufferId = self.data, self.buffer_id
+        if isinstance(data, ofp_packet_in): # Resend what the switch sent up
+            data, bufferId = (b'', data.buffer_id) if data.buffer_id is not None else (data.data, bufferId)
+        if not isinstance(data, bytes):
+            data = data.pack()
+        actions = b''.join(action.pack() for action in self.actions)
+        return struct.pack('!IHH', NO_BUFFER if bufferId is None else bufferId, self.in_port, len(actions)) + actions + data
+
+class ofp_barrier_request(ofp_header):
+    header_type = OFPT_BARRIER_REQUEST
+
+class ofp_flow_stats_request:
+    type = OFPST_FLOW
+
+    def __init__(self, match=None, table_id=0xff, out_port=OFPP_NONE):
+        self.match = match if match is not None else ofp_match()
+        self.table_id = table_id
+        self.out_port = out_port
+
+    def pack(self):
+        return self.match.pack() + struct.pack('!BxH', self.table_id, self.out_port)
+
+class ofp_port_stats_request:
+    type = OFPST_PORT
+
+    def __init__(self, port_no=OFPP_NONE):
+        self.port_no = port_no
+
+    def pack(self):
+        return struct.pack('!H6x', self.port_no)
+
+class ofp_stats_request(ofp_header):
+    header_type = OFPT_STATS_REQUEST
+
+    def __init__(self, **kw):
+        self.body = None
+        self.flags = 0
+        super().__init__(**kw)
+
+    def _pack_body(self):
+        return struct.pack('!HH', self.body.type, self.flags) + self.body.pack()
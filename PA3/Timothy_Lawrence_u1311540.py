@@ -4,8 +4,49 @@
 # Written by Tim Lawrence for CS4480, Spring 2025
 
 import argparse
+import json
 import os, subprocess
+import sys
 import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+DOCKER = os.environ.get('DOCKER', 'docker') # Docker CLI, e.g. fakedocker/docker to run without Docker
+DIAMOND = { # The network in docker-compose.yaml; others are made by topology.py, which writes this in topology.json
+    'routers': [f'r{i}' for i in range(1, 5)],
+    'hosts': ['ha', 'hb'],
+    'routeChecks': { # Routes each router must have learned over OSPF before the hosts can reach each other
+        'r1': ['10.0.15.0/24'],
+        'r3': ['10.0.14.0/24']
+    },
+    'paths': { # Interface costs that put traffic on each path, and the next hops towards the other host then
+        'north': { # eth1 leads north (r2), eth2 south (r4)
+            'costs': {'r1': {'eth2': 10}, 'r3': {'eth2': 10}},
+            'nextHops': {'r1': {'10.0.15.0/24': ['10.0.16.3']}, 'r3': {'10.0.14.0/24': ['10.0.16.19']}}
+        },
+        'south': {
+            'costs': {'r1': {'eth2': 1}, 'r3': {'eth2': 1}},
+            'nextHops': {'r1': {'10.0.15.0/24': ['10.0.16.11']}, 'r3': {'10.0.14.0/24': ['10.0.16.27']}}
+        }
+    }
+}
+CONVERGENCE_TIMEOUT = 120 # Seconds to wait for the routes between hosts, or for traffic to move
+POLL_INTERVAL_MIN = 0.05 # Seconds between convergence checks, doubling up to POLL_INTERVAL_MAX
+POLL_INTERVAL_MAX = 1.0
+COSTS_FILE = '.interface_costs.json' # interfaceCosts as last seeded or set, kept next to the compose file between runs
+
+topology = DIAMOND # The network being orchestrated
+composeArgs = [] # Selects its compose file, if not the one in the current directory
+networkDirectory = '.' # Holds its compose file and router configs
+timings = [] # (step, seconds) for each step run, in the order they finished
+interfaceCosts = {} # Current OSPF cost of each router's interfaces, as last read or set
+
+class StepError(Exception):
+    '''A command run by the orchestrator failed, in each of `containers` if it ran in some.'''
+    def __init__(self, message: str, containers: tuple[str, ...] = ()):
+        super().__init__(message)
+        self.containers = containers
 
 def parse_args() -> argparse.Namespace | None:
     '''Parse command line arguments. If no arguments are provided,
@@ -17,75 +58,296 @@ def parse_args() -> argparse.Namespace | None:
                        action='store_true')
     parser.add_argument('-r', '--route', help='set host routing',
                        action='store_true')
-    parser.add_argument('-p', '--path', help='set the preferred network traffic path',
-                       choices=('north', 'south'))
+    parser.add_argument('-p', '--path', help="set the preferred network traffic path, 'north' or 'south' for the "
+                       'default network (repeat to flip between paths)', action='append')
     parser.add_argument('-q', '--quit', help='shut down and deconstruct the network',
                         action='store_true')
+    parser.add_argument('-j', '--jobs', help='run per-container steps this many at a time (default: all at once)',
+                        type=int, default=0)
+    parser.add_argument('-t', '--topology', help='orchestrate the network generated by topology.py in this directory')
     
     args = parser.parse_args()
-    if not any(vars(args).values()): # If no option, print help message
+    if not any((args.construct, args.daemon, args.route, args.path, args.quit)): # If no option, print help message
         parser.print_help()
         return None
+    if args.topology:
+        try:
+            load_topology(args.topology)
+        except (OSError, ValueError) as e:
+            parser.error(f'cannot load the topology: {e}')
+    unknown = [path for path in args.path or [] if path not in topology['paths']]
+    if unknown:
+        parser.error(f"unknown path {', '.join(unknown)} (choose from {', '.join(topology['paths'])})")
     return args
 
+def load_topology(directory: str):
+    '''Orchestrates the network that topology.py generated in `directory` instead of the default one.'''
+    global topology, composeArgs, networkDirectory
+    with open(os.path.join(directory, 'topology.json')) as file:
+        topology = json.load(file)
+    composeArgs = ['-f', os.path.join(directory, 'docker-compose.yaml')]
+    networkDirectory = directory
+
+def run(*command: str, check: bool = True) -> subprocess.CompletedProcess:
+    '''Runs `command`, capturing its output. Raises `StepError` if it fails and `check` is set.'''
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if check and result.returncode != 0:
+        raise StepError(f"'{' '.join(command)}' exited with {result.returncode}: {result.stderr.strip()}")
+    return result
+
+def docker_exec(container: str, *command: str, check: bool = True) -> subprocess.CompletedProcess:
+    '''Runs `command` in `container`. See `run`.'''
+    return run(DOCKER, 'exec', container, *command, check=check)
+
+@contextmanager
+def timed(step: str):
+    '''Records how long the enclosed `step` takes, whether or not it succeeds.'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append((step, time.perf_counter() - start))
+
+def exec_all(step: str, commands: dict[str, list[str]], jobs: int) -> dict[str, subprocess.CompletedProcess]:
+    '''Runs each container's command concurrently, `jobs` at a time (all at once if 0), timing each.
+    Returns the results by container. Raises `StepError` listing the containers it failed in,
+    once they're all done.'''
+    def exec_one(container: str) -> subprocess.CompletedProcess:
+        with timed(f'{step} {container}'):
+            return docker_exec(container, *commands[container])
+    
+    if not commands: return {}
+    results, failures = {}, {}
+    with timed(step), ThreadPoolExecutor(jobs or len(commands)) as pool:
+        futures = [pool.submit(exec_one, container) for container in commands]
+        for container, future in zip(commands, futures):
+            try:
+                results[container] = future.result()
+            except StepError as e:
+                failures[container] = f'{container}: {e}'
+    if failures:
+        raise StepError(f'{step} failed in {len(failures)} of {len(commands)} containers:\n  ' +
+                        '\n  '.join(failures.values()), tuple(failures))
+    return results
+
 def construct_network():
     '''Constructs the network topology using Docker containers.'''
     print('ORCH: Constructing network')
     
-    os.system('docker compose up -d')
-    
-def start_ospf_daemon():
+    with timed('construct_network'):
+        run(DOCKER, 'compose', *composeArgs, 'up', '-d')
+
+def start_ospf_daemon(jobs: int = 0):
     '''Starts the OSPF daemon and sets configurations for each router.'''
     print('ORCH: Starting OSPF daemons')
     
-    for i in range(1, 5):
-        os.system(f'docker exec -it r{i} ./startdaemon.sh')
-        
-def set_host_routes():
+    try:
+        exec_all('start_ospf_daemon', {router: ['./startdaemon.sh'] for router in topology['routers']}, jobs)
+    except StepError:
+        forget_costs() # Unsure which daemons restarted with their configured costs
+        raise
+    seed_costs()
+
+def set_host_routes(jobs: int = 0):
     '''Sets routing for attached hosts.'''
     print('ORCH: Installing host routing')
     
-    for i in 'ab':
-        os.system(f'docker exec -it h{i} ./installroute.sh')
+    exec_all('set_host_routes', {host: ['./installroute.sh'] for host in topology['hosts']}, jobs)
     
-    print('ORCH: Waiting for route between hosts', end='')
-    while True:
-        result = subprocess.run(
-            'docker exec -it r1 vtysh -c \'show ip route\'',
-            shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        if '10.0.15.0' in result.stdout:
-            print('.done')
-            break
-        else:
-            print('.', end='', flush=True)
-            time.sleep(1)
-        
-def set_preferred_path(path: str):
-    '''Sets the preferred path for network traffic.'''
+    print('ORCH: Waiting for route between hosts', end='', flush=True)
+    wait_for('convergence', {router: ospf_routes(prefixes) for router, prefixes in topology['routeChecks'].items()}, jobs)
+
+def route_table(router: str) -> dict | None:
+    '''The routes installed on `router`, as reported by `show ip route json`, or `None` if it can't tell yet.'''
+    result = docker_exec(router, 'vtysh', '-c', 'show ip route json', check=False)
+    if result.returncode != 0: # The daemons may still be restarting
+        return None
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        return None
+
+def ospf_routes(prefixes: list[str]) -> Callable[[dict], bool]:
+    '''Check for installed routes to all `prefixes` learned over OSPF.'''
+    def check(routes: dict) -> bool:
+        return all(any(route.get('protocol') == 'ospf' and route.get('installed') for route in routes.get(prefix, []))
+                   for prefix in prefixes)
+    return check
+
+def next_hops(expected: dict[str, list[str]]) -> Callable[[dict], bool]:
+    '''Check that the installed route to each prefix in `expected` goes through exactly its next hops.'''
+    def installed(routes: list[dict]) -> set[str] | None:
+        for route in routes:
+            if route.get('installed'):
+                return {hop.get('ip') for hop in route.get('nexthops', []) if hop.get('active', True)}
+        return None
+    
+    def check(routes: dict) -> bool:
+        return all(installed(routes.get(prefix, [])) == set(addresses) for prefix, addresses in expected.items())
+    return check
+
+def wait_for(step: str, checks: dict[str, Callable[[dict], bool]], jobs: int = 0, start: float | None = None):
+    '''Waits until the route table of each router in `checks` passes its check, polling them all
+    concurrently, every POLL_INTERVAL_MIN seconds at first and backing off to POLL_INTERVAL_MAX.
+    The time since `start` (by default, now) is recorded as `step`.'''
+    if not checks: # Nothing to wait for
+        print('.done')
+        return
+    start = time.perf_counter() if start is None else start
+    pending = dict(checks)
+    interval = POLL_INTERVAL_MIN
+    deadline = time.perf_counter() + CONVERGENCE_TIMEOUT
+    with ThreadPoolExecutor(jobs or len(checks)) as pool:
+        try:
+            while True:
+                tables = pool.map(route_table, list(pending))
+                for router, routes in zip(list(pending), tables):
+                    if routes is not None and pending[router](routes): del pending[router]
+                if not pending:
+                    print('.done')
+                    return
+                if time.perf_counter() + interval > deadline:
+                    print('.timed out')
+                    raise StepError(f"{step} not reached after {CONVERGENCE_TIMEOUT}s on {', '.join(pending)}")
+                print('.', end='', flush=True)
+                time.sleep(interval)
+                interval = min(interval * 2, POLL_INTERVAL_MAX)
+        finally:
+            timings.append((step, time.perf_counter() - start))
+
+def seed_costs():
+    '''Sets `interfaceCosts` to the costs in each router's config, which its OSPF daemon has just loaded,
+    and saves them for later runs.'''
+    for router in topology['routers']:
+        costs, interface = {}, None
+        try:
+            with open(os.path.join(networkDirectory, 'configs', f'{router}.conf')) as file:
+                for line in file:
+                    words = line.split()
+                    if words[:1] == ['interface']: interface = words[1]
+                    elif words[:3] == ['ip', 'ospf', 'cost'] and interface: costs[interface] = int(words[3])
+        except (OSError, ValueError): # Read from the router when needed instead
+            interfaceCosts.pop(router, None)
+            continue
+        interfaceCosts[router] = costs
+    save_costs()
+
+def load_costs():
+    '''Adds the costs a previous run seeded or set to `interfaceCosts`, for the routers it doesn't know.'''
+    try:
+        with open(os.path.join(networkDirectory, COSTS_FILE)) as file:
+            saved = json.load(file)
+    except (OSError, ValueError):
+        return
+    for router, costs in saved.items():
+        interfaceCosts.setdefault(router, costs)
+
+def save_costs():
+    '''Saves `interfaceCosts` for later runs.'''
+    with open(os.path.join(networkDirectory, COSTS_FILE), 'w') as file:
+        json.dump(interfaceCosts, file)
+
+def forget_costs():
+    '''Forgets every router's costs, in this run and for later ones.'''
+    interfaceCosts.clear()
+    try:
+        os.remove(os.path.join(networkDirectory, COSTS_FILE))
+    except FileNotFoundError:
+        pass
+
+def read_costs(routers: list[str], jobs: int = 0):
+    '''Reads the OSPF cost of each of the routers' interfaces into `interfaceCosts`.'''
+    results = exec_all('read_costs', {router: ['vtysh', '-c', 'show ip ospf interface json'] for router in routers}, jobs)
+    for router, result in results.items():
+        try:
+            interfaces = json.loads(result.stdout)
+        except ValueError:
+            raise StepError(f'Unreadable interfaces from {router}: {result.stdout[:200]}')
+        interfaces = interfaces.get('interfaces', interfaces) # Newer FRR versions nest them
+        interfaceCosts[router] = {name: interface.get('cost') for name, interface in interfaces.items()
+                                  if isinstance(interface, dict)}
+    save_costs()
+
+def set_preferred_path(path: str, jobs: int = 0):
+    '''Sets the preferred path for network traffic, then waits for traffic to move.
+    Only the interface costs that differ from the current ones are changed, in a single vtysh
+    run per router, on all routers at once. The current costs are those seeded or set before,
+    by this run or an earlier one, and are only read from the routers that have none.
+    The time from the change until every router's next hop has moved is recorded as the
+    reconvergence time.'''
     print(f'ORCH: Moving traffic to {path} path')
     
-    if path == 'north': cost = 10
-    elif path == 'south': cost = 1
-    for i in (1, 3):
-        os.system(f'docker exec -it r{i} vtysh -c \'configure terminal\' ' +
-                  f'-c \'interface eth2\' -c\'ip ospf cost {cost}\' -c \'end\'')
-        
+    wanted = topology['paths'][path]['costs']
+    load_costs()
+    unknown = [router for router in wanted if router not in interfaceCosts]
+    if unknown: read_costs(unknown, jobs)
+    
+    changes = {}
+    for router, costs in wanted.items():
+        changed = {interface: cost for interface, cost in costs.items() if interfaceCosts[router].get(interface) != cost}
+        if changed: changes[router] = changed
+    if not changes:
+        print(f'ORCH: Traffic is already on the {path} path')
+        return
+    
+    commands = {}
+    for router, changed in changes.items():
+        commands[router] = ['vtysh', '-c', 'configure terminal']
+        for interface, cost in changed.items():
+            commands[router] += ['-c', f'interface {interface}', '-c', f'ip ospf cost {cost}']
+        commands[router] += ['-c', 'end']
+    start = time.perf_counter()
+    try:
+        exec_all(f'set_preferred_path {path}', commands, jobs)
+    except StepError as e:
+        for router, changed in changes.items():
+            if router in e.containers: interfaceCosts.pop(router, None) # Unsure which of its changes went through
+            else: interfaceCosts[router].update(changed)
+        save_costs()
+        raise
+    for router, changed in changes.items():
+        interfaceCosts[router].update(changed)
+    save_costs()
+    
+    print('ORCH: Waiting for traffic to move', end='', flush=True)
+    checks = {router: next_hops(expected) for router, expected in topology['paths'][path]['nextHops'].items()}
+    wait_for(f'reconvergence {path}', checks, jobs, start)
+
 def close_network():
     '''Shuts down the network and cleans up the docker setup.'''
     print('ORCH: Shutting down the network')
     
-    os.system('docker compose down')
+    with timed('close_network'):
+        run(DOCKER, 'compose', *composeArgs, 'down')
+    forget_costs()
+
+def report_timings():
+    '''Prints how long each step took, and the total.'''
+    if not timings: return
+    width = max(len(step) for step, _ in timings)
+    print('ORCH: Timings')
+    for step, seconds in timings:
+        print(f'  {step:<{width}} {seconds:7.2f}s')
+    steps = [seconds for step, seconds in timings # Not the per-container parts; reconvergence covers setting the path
+             if ' ' not in step or step.startswith('reconvergence')]
+    print(f"  {'total':<{width}} {sum(steps):7.2f}s")
 
-def main():
+def main() -> int:
     args = parse_args()
-    if args is None: return
+    if args is None: return 0
     
-    if args.construct: construct_network()
-    if args.daemon: start_ospf_daemon()
-    if args.route: set_host_routes()
-    if args.path: set_preferred_path(args.path)
-    if args.quit: close_network()
+    try:
+        if args.construct: construct_network()
+        if args.daemon: start_ospf_daemon(args.jobs)
+        if args.route: set_host_routes(args.jobs)
+        for path in args.path or []: set_preferred_path(path, args.jobs)
+        if args.quit: close_network()
+    except (StepError, OSError) as e: # OSError if docker itself can't be run
+        print(f'ORCH: {e}', file=sys.stderr)
+        return 1
+    finally:
+        report_timings()
+    return 0
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
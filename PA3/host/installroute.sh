@@ -1,7 +1,11 @@
 #!/bin/bash
 
 HOSTNAME=$(hostname)
-if [ "$HOSTNAME" = "ha" ]; then
+if [ -f "/etc/routes/${HOSTNAME}.routes" ]; then # Generated by topology.py
+    while read -r SUBNET GATEWAY; do
+        route add -net "$SUBNET" gw "$GATEWAY"
+    done < "/etc/routes/${HOSTNAME}.routes"
+elif [ "$HOSTNAME" = "ha" ]; then
     route add -net 10.0.15.0/24 gw 10.0.14.4
 elif [ "$HOSTNAME" = "hb" ]; then
     route add -net 10.0.14.0/24 gw 10.0.15.4
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Runs the orchestrator against the fake docker CLI, without Docker.
+
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+import Timothy_Lawrence_u1311540 as orchestrator
+
+here = os.path.dirname(os.path.abspath(__file__))
+state = tempfile.TemporaryDirectory()
+environment = {**os.environ, 'DOCKER': os.path.join(here, 'fakedocker', 'docker'), 'FAKE_DOCKER_STATE': state.name,
+               'FAKE_DOCKER_DELAY': '0.3', 'FAKE_DOCKER_CONVERGE': '0.2', 'FAKE_DOCKER_RECONVERGE': '0.1'}
+for name in ('FAKE_DOCKER_COMPOSE', 'FAKE_DOCKER_FAIL'):
+    environment.pop(name, None)
+
+def orchestrate(*args: str, **settings: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, os.path.join(here, 'Timothy_Lawrence_u1311540.py'), *args], cwd=here,
+                          env={**environment, **settings}, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+def timing(result: subprocess.CompletedProcess, step: str) -> float:
+    return float(re.search(rf'^  {re.escape(step)} +([\d.]+)s$', result.stdout, re.M).group(1))
+
+# Every step succeeds, and the per-container ones run all at once unless limited with -j
+parallel = orchestrate('-c', '-d', '-r', '-p', 'south', '-p', 'north', '-q') # The network starts on the north path
+assert parallel.returncode == 0, parallel.stderr
+assert 'reconvergence north' in parallel.stdout and 'reconvergence south' in parallel.stdout
+serial = orchestrate('-c', '-d', '-j', '1', '-q')
+assert serial.returncode == 0, serial.stderr
+assert timing(serial, 'start_ospf_daemon') > 4 * 0.3
+assert timing(parallel, 'start_ospf_daemon') < timing(serial, 'start_ospf_daemon') / 2
+for router in ('r1', 'r2', 'r3', 'r4'):
+    assert 0.3 <= timing(parallel, f'start_ospf_daemon {router}') < timing(serial, 'start_ospf_daemon')
+
+# A container that fails doesn't stop the others; the step then reports every failure and the run fails
+failed = orchestrate('-c', '-d', '-r', FAKE_DOCKER_FAIL='r2')
+assert failed.returncode == 1
+assert 'start_ospf_daemon failed in 1 of 4 containers:\n  r2: ' in failed.stderr, failed.stderr
+assert all(f'start_ospf_daemon {router}' in failed.stdout for router in ('r1', 'r3', 'r4')) # Ran to completion
+assert 'Installing host routing' not in failed.stdout
+assert orchestrate('-q').returncode == 0
+
+# Without options, it only prints its help
+assert orchestrate().returncode == 0
+
+# Steps with no containers to run in or wait for have nothing to do
+assert orchestrator.exec_all('nothing', {}, 0) == {}
+orchestrator.wait_for('nothing', {})
+
+# A route's next hops match when its installed route goes through exactly the active ones, in any order
+check = orchestrator.next_hops({'10.0.15.0/24': ['10.0.16.3', '10.0.16.11']})
+both = [{'ip': '10.0.16.11'}, {'ip': '10.0.16.3', 'active': True}]
+assert check({'10.0.15.0/24': [{'installed': True, 'nexthops': both}]})
+assert check({'10.0.15.0/24': [{'nexthops': both[:1]}, {'installed': True, 'nexthops': both}]})
+assert not check({'10.0.15.0/24': [{'installed': True, 'nexthops': both[:1]}]})
+assert not check({'10.0.15.0/24': [{'installed': True, 'nexthops': [both[0], {'ip': '10.0.16.3', 'active': False}]}]})
+assert not check({'10.0.15.0/24': [{'installed': True, 'nexthops': [*both, {'ip': '10.0.16.19'}]}]})
+assert not check({'10.0.15.0/24': [{'nexthops': both}]}) and not check({})
+
+# Setting a path sends only the costs that differ from the current ones. Starting the daemons seeds
+# those from the router configs, and they're kept for later runs until the network is shut down
+os.environ.update({name: value for name, value in environment.items() if name.startswith('FAKE_DOCKER')})
+orchestrator.DOCKER = environment['DOCKER']
+costsFile = os.path.join(here, orchestrator.COSTS_FILE)
+assert orchestrate('-c', '-d', '-r').returncode == 0
+with open(costsFile) as file:
+    assert json.load(file)['r1'] == {'eth0': 1, 'eth1': 5, 'eth2': 10}
+oneShot = orchestrate('-p', 'south')
+assert oneShot.returncode == 0 and 'read_costs' not in oneShot.stdout, oneShot.stdout
+assert orchestrate('-p', 'south').stdout.startswith('ORCH: Moving traffic to south path\nORCH: Traffic is already on the south path')
+sent = []
+def recording_exec_all(step, commands, jobs):
+    sent.append((step, commands))
+    return exec_all(step, commands, jobs)
+exec_all, orchestrator.exec_all = orchestrator.exec_all, recording_exec_all
+orchestrator.set_preferred_path('north')
+change = ['vtysh', '-c', 'configure terminal', '-c', 'interface eth2', '-c', 'ip ospf cost 10', '-c', 'end']
+assert sent == [('set_preferred_path north', {'r1': change, 'r3': change})]
+assert orchestrator.interfaceCosts['r1'] == {'eth0': 1, 'eth1': 5, 'eth2': 10}
+sent.clear()
+orchestrator.set_preferred_path('north')
+assert sent == []
+
+# Only the routers a cost change failed in are read again; the others keep what was set
+os.environ['FAKE_DOCKER_FAIL'] = 'r3'
+try:
+    orchestrator.set_preferred_path('south')
+except orchestrator.StepError as e:
+    assert e.containers == ('r3',)
+else:
+    raise AssertionError('a failed cost change went unnoticed')
+assert orchestrator.interfaceCosts['r1']['eth2'] == 1 and 'r3' not in orchestrator.interfaceCosts
+del os.environ['FAKE_DOCKER_FAIL']
+orchestrator.interfaceCosts.clear() # As in a later run
+sent.clear()
+orchestrator.set_preferred_path('north')
+assert sent == [('read_costs', {'r3': ['vtysh', '-c', 'show ip ospf interface json']}),
+                ('set_preferred_path north', {'r1': change})] # r3's change hadn't gone through
+orchestrator.exec_all = exec_all
+assert orchestrate('-q').returncode == 0 and not os.path.exists(costsFile)
+state.cleanup()
+print('orchestrator_test passed')
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+# Topology generator for the OSPF network orchestrator
+# Turns a topology description (routers, links with their OSPF costs, hosts, and the traffic paths
+# the orchestrator can switch between) into a directory the orchestrator can run:
+#   docker-compose.yaml    the containers and networks
+#   configs/<router>.conf  FRR config of each router
+#   configs/<host>.routes  routes each host installs, one '<subnet> <gateway>' per line
+#   topology.json          what the orchestrator needs to bring it up and switch paths
+# Usage: topology.py (DESCRIPTION.json | --ring N) -o DIRECTORY, see --help and topologies/diamond.json.
+
+import argparse
+import heapq
+import ipaddress
+import json
+import os
+import sys
+import time
+
+HOST_SUBNETS = ipaddress.ip_network('10.0.14.0/24') # First host network; hosts get consecutive /24s
+LINK_PREFIX = 29 # Router links get consecutive /29s, from the /24 after the last host network
+ADDRESS_SPACE = ipaddress.ip_network('10.0.0.0/8')
+HOST_COST = 1 # OSPF cost of the router interface towards a host
+HELLO_INTERVAL = 3
+FRR_VERSION = '10.3'
+SERVICE_OPTIONS = '''    stdin_open: true
+    tty: true
+    cap_add:
+      - ALL
+    privileged: true'''
+
+def load_description(path: str) -> dict:
+    '''Reads a topology description from the JSON file at `path`.'''
+    with open(path) as file:
+        return json.load(file)
+
+def ring_description(count: int) -> dict:
+    '''A ring of `count` routers, all links of cost 1, with ha on r1 and hb on the router opposite.
+    The 'north' path goes r1, r2, ... to hb and 'south' the other way round, made cheaper by
+    raising the cost of the first link of the other way on each side.'''
+    if count < 4 or count % 2:
+        raise ValueError(f'a ring needs an even number of at least 4 routers, not {count}')
+    routers = [f'r{i}' for i in range(1, count + 1)]
+    links = [{'routers': [routers[i], routers[(i + 1) % count]], 'costs': [1, 1]} for i in range(count)]
+    first, opposite = routers[0], routers[count // 2]
+    northward = {first: routers[1], opposite: routers[count // 2 - 1]} # Next router towards the other host
+    southward = {first: routers[-1], opposite: routers[count // 2 + 1]}
+    return {
+        'routers': routers,
+        'links': links,
+        'hosts': {'ha': first, 'hb': opposite},
+        'paths': {
+            'north': {router: {northward[router]: 1, southward[router]: 10} for router in (first, opposite)},
+            'south': {router: {northward[router]: 10, southward[router]: 1} for router in (first, opposite)}
+        }
+    }
+
+def network_name(subnet: ipaddress.IPv4Network) -> str:
+    '''Compose network name for `subnet`: 10.0.14.0/24 is net000_014, 10.0.16.8/29 is net000_016_008.
+    Compose attaches a container's networks in name order, so the octets are zero-padded to make
+    that the order of the subnets, which is the order of the router's interfaces.'''
+    octets = list(subnet.network_address.packed[1:])
+    if subnet.prefixlen == 24: octets.pop()
+    return 'net' + '_'.join(f'{octet:03}' for octet in octets)
+
+def allocate_subnets(hosts: int, links: int) -> tuple[list, list]:
+    '''Subnets for `hosts` host networks and `links` router links.'''
+    hostSubnets = [ipaddress.ip_network((int(HOST_SUBNETS.network_address) + (i << 8), 24)) for i in range(hosts)]
+    linkStart = int(HOST_SUBNETS.network_address) + (hosts << 8)
+    linkSize = 1 << (32 - LINK_PREFIX)
+    linkSubnets = [ipaddress.ip_network((linkStart + i * linkSize, LINK_PREFIX)) for i in range(links)]
+    last = (linkSubnets or hostSubnets or [HOST_SUBNETS])[-1]
+    if not last.subnet_of(ADDRESS_SPACE):
+        raise ValueError(f'{hosts} hosts and {links} links do not fit in {ADDRESS_SPACE}')
+    return hostSubnets, linkSubnets
+
+def build_network(description: dict) -> dict:
+    '''Resolves a topology description into the containers, networks and addresses to create.
+    Raises `ValueError` if the description is inconsistent.
+
+    Each link's first router gets the link network's second host address (the first being Docker's
+    gateway) and the other router the third; a host gets the third address of its network and its
+    router the fourth. Router interfaces are eth0, eth1, ... in the order of their subnets, and the
+    router-id is the address of eth0.'''
+    routers = description.get('routers')
+    if isinstance(routers, int): routers = [f'r{i}' for i in range(1, routers + 1)]
+    if not routers or len(set(routers)) != len(routers):
+        raise ValueError('routers must be a count or a list of distinct names')
+    hosts = description.get('hosts', {})
+    links = description.get('links', [])
+    if set(hosts) & set(routers):
+        raise ValueError(f"names used for both routers and hosts: {', '.join(sorted(set(hosts) & set(routers)))}")
+
+    network = {'routers': {router: {'interfaces': []} for router in routers}, 'hosts': {}, 'networks': {}}
+    hostSubnets, linkSubnets = allocate_subnets(len(hosts), len(links))
+
+    def attach(router: str, subnet: ipaddress.IPv4Network, address, cost: int, peer: str):
+        if router not in network['routers']:
+            raise ValueError(f'unknown router {router} linked to {peer}')
+        if not isinstance(cost, int) or not 1 <= cost <= 65535:
+            raise ValueError(f'cost of {router} towards {peer} must be from 1 to 65535, not {cost!r}')
+        network['routers'][router]['interfaces'].append(
+            {'network': network_name(subnet), 'subnet': subnet, 'address': address, 'cost': cost, 'peer': peer})
+
+    for (host, router), subnet in zip(hosts.items(), hostSubnets):
+        name = network_name(subnet)
+        network['networks'][name] = {'subnet': subnet, 'comment': f'{host}-{router}'}
+        network['hosts'][host] = {'network': name, 'subnet': subnet, 'address': subnet[3], 'router': router,
+                                  'gateway': subnet[4]}
+        attach(router, subnet, subnet[4], HOST_COST, host)
+    seen = set()
+    for link, subnet in zip(links, linkSubnets):
+        ends = link.get('routers', [])
+        costs = link.get('costs', 1)
+        if isinstance(costs, int): costs = [costs, costs]
+        if len(ends) != 2 or ends[0] == ends[1] or len(costs) != 2:
+            raise ValueError(f'a link needs two different routers and one or two costs: {link}')
+        if frozenset(ends) in seen:
+            raise ValueError(f'more than one link between {ends[0]} and {ends[1]}')
+        seen.add(frozenset(ends))
+        name = network_name(subnet)
+        network['networks'][name] = {'subnet': subnet, 'comment': f'{ends[0]}-{ends[1]}'}
+        attach(ends[0], subnet, subnet[2], costs[0], ends[1])
+        attach(ends[1], subnet, subnet[3], costs[1], ends[0])
+
+    for router, config in network['routers'].items():
+        if not config['interfaces']:
+            raise ValueError(f'router {router} is not linked to anything')
+        config['interfaces'].sort(key=lambda interface: interface['subnet'])
+        for i, interface in enumerate(config['interfaces']):
+            interface['name'] = f'eth{i}'
+        config['routerId'] = config['interfaces'][0]['address']
+    network['paths'] = resolve_paths(network, description.get('paths', {}))
+    return network
+
+def resolve_paths(network: dict, paths: dict) -> dict:
+    '''Turns each path's costs, given per router and neighbour, into costs per router and interface.
+    Every path sets every interface some path changes, so switching paths never leaves a cost
+    from the previous one behind.'''
+    touched = {}
+    for path, costs in paths.items():
+        for router, neighbours in costs.items():
+            if router not in network['routers']:
+                raise ValueError(f'path {path} sets costs on unknown router {router}')
+            interfaces = {interface['peer']: interface for interface in network['routers'][router]['interfaces']}
+            for neighbour in neighbours:
+                if neighbour not in interfaces:
+                    raise ValueError(f'path {path}: {router} is not linked to {neighbour}')
+                touched.setdefault(router, {})[neighbour] = interfaces[neighbour]
+    resolved = {}
+    for path, costs in paths.items():
+        resolved[path] = {router: {interface['name']: costs.get(router, {}).get(neighbour, interface['cost'])
+                                   for neighbour, interface in interfaces.items()}
+                          for router, interfaces in touched.items()}
+    return resolved
+
+def shortest_paths(network: dict, source: str, costs: dict) -> tuple[dict, dict]:
+    '''Distance from router `source` to every router, and the addresses of the first hops on all its
+    cheapest paths to each, as OSPF would find them with the interface `costs` ({router: {interface: cost}}).'''
+    routers = network['routers']
+    peers = {} # (router, neighbour) -> neighbour's address on their link
+    for router, config in routers.items():
+        for interface in config['interfaces']:
+            if interface['peer'] in routers: peers[interface['peer'], router] = interface['address']
+    distance, firstHops = {source: 0}, {source: set()}
+    queue, done = [(0, source)], set()
+    while queue:
+        cost, router = heapq.heappop(queue)
+        if router in done: continue
+        done.add(router)
+        for interface in routers[router]['interfaces']:
+            neighbour = interface['peer']
+            if neighbour not in routers: continue
+            via = cost + costs.get(router, {}).get(interface['name'], interface['cost'])
+            hops = firstHops[router] or {peers[router, neighbour]}
+            if via < distance.get(neighbour, float('inf')):
+                distance[neighbour], firstHops[neighbour] = via, set(hops)
+                heapq.heappush(queue, (via, neighbour))
+            elif via == distance[neighbour]:
+                firstHops[neighbour] |= hops # Equal-cost paths
+    return distance, firstHops
+
+def host_next_hops(network: dict, costs: dict) -> dict:
+    '''{router: {host subnet: [next hop addresses]}} for each router with a host, towards every other host,
+    with the interface `costs` in place.'''
+    hosts = network['hosts'].values()
+    nextHops = {}
+    for router in sorted({host['router'] for host in hosts}, key=list(network['routers']).index):
+        _, firstHops = shortest_paths(network, router, costs)
+        nextHops[router] = {str(host['subnet']): sorted(str(address) for address in firstHops.get(host['router'], ()))
+                            for host in hosts if host['router'] != router}
+    return nextHops
+
+def frr_config(network: dict, router: str) -> str:
+    '''The FRR config of `router`.'''
+    config = network['routers'][router]
+    lines = [f'frr version {FRR_VERSION}', 'frr defaults traditional', f'hostname {router}', 'log syslog informational',
+             'no ipv6 forwarding', 'service integrated-vtysh-config', '!']
+    for interface in config['interfaces']:
+        lines += [f"interface {interface['name']}", f" ip ospf cost {interface['cost']}",
+                  f' ip ospf hello-interval {HELLO_INTERVAL}', 'exit', '!']
+    lines += ['router ospf', f" ospf router-id {config['routerId']}", ' redistribute connected']
+    lines += [f" network {interface['subnet']} area 0" for interface in config['interfaces']]
+    lines += ['exit', '!', 'end']
+    return '\n'.join(lines) + '\n'
+
+def host_routes(network: dict, host: str) -> str:
+    '''The routes `host` installs: every other host's network, through its router.'''
+    gateway = network['hosts'][host]['gateway']
+    return ''.join(f"{other['subnet']} {gateway}\n" for name, other in network['hosts'].items() if name != host)
+
+def compose_file(network: dict, contexts: str) -> str:
+    '''The docker-compose.yaml for `network`; `contexts` is the directory holding the router and host images.'''
+    lines = ['services:']
+    containers = [(router, 'router', config['interfaces']) for router, config in network['routers'].items()]
+    containers += [(host, 'host', [{'network': config['network'], 'address': config['address'], 'peer': config['router']}])
+                   for host, config in network['hosts'].items()]
+    for name, image, interfaces in containers:
+        lines += [f'  {name}:', '    build:', f'      context: {contexts}/{image}', f'    container_name: {name}',
+                  f'    hostname: {name}', SERVICE_OPTIONS, '    volumes:',
+                  '      - ./configs:/etc/frr/config' if image == 'router' else '      - ./configs:/etc/routes',
+                  '    networks:']
+        for interface in interfaces:
+            lines += [f"      {interface['network']}:", f"        ipv4_address: {interface['address']} # to {interface['peer']}"]
+        lines.append('')
+    lines.append('networks:')
+    for name, config in network['networks'].items():
+        lines += [f"  {name}: # {config['comment']}", '    ipam:', '      driver: default', '      config:',
+                  f"        - subnet: {config['subnet']}"]
+    return '\n'.join(lines) + '\n'
+
+def orchestration(network: dict) -> dict:
+    '''What the orchestrator needs to drive `network`: its containers, the OSPF routes to wait for
+    before the hosts can reach each other, and the costs and next hops of each path.'''
+    hostSubnets = [str(host['subnet']) for host in network['hosts'].values()]
+    routeChecks = {}
+    for router, config in network['routers'].items():
+        connected = {str(interface['subnet']) for interface in config['interfaces']}
+        prefixes = [subnet for subnet in hostSubnets if subnet not in connected]
+        if prefixes: routeChecks[router] = prefixes
+    return {
+        'routers': list(network['routers']),
+        'hosts': list(network['hosts']),
+        'routeChecks': routeChecks,
+        'paths': {path: {'costs': costs, 'nextHops': host_next_hops(network, costs)}
+                  for path, costs in network['paths'].items()}
+    }
+
+def write_network(network: dict, output: str):
+    '''Writes the compose file, FRR configs, host routes and topology.json for `network` into `output`.'''
+    configs = os.path.join(output, 'configs')
+    os.makedirs(configs, exist_ok=True)
+    here, output = os.path.dirname(os.path.abspath(__file__)), os.path.abspath(output)
+    contexts = os.path.relpath(here, output) if output.startswith(here + os.sep) else here # Relative if it moves along
+    files = {os.path.join(output, 'docker-compose.yaml'): compose_file(network, contexts),
+             os.path.join(output, 'topology.json'): json.dumps(orchestration(network), indent=2) + '\n'}
+    files.update({os.path.join(configs, f'{router}.conf'): frr_config(network, router) for router in network['routers']})
+    files.update({os.path.join(configs, f'{host}.routes'): host_routes(network, host) for host in network['hosts']})
+    for path, text in files.items():
+        with open(path, 'w') as file:
+            file.write(text)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Generates a network for the OSPF network orchestrator')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('description', help='JSON topology description, see topologies/diamond.json', nargs='?')
+    source.add_argument('--ring', help='a ring of this many routers, with hosts on opposite sides', type=int)
+    parser.add_argument('-o', '--output', help='directory to write the network to', required=True)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        description = ring_description(args.ring) if args.ring else load_description(args.description)
+        network = build_network(description)
+        write_network(network, args.output)
+    except (OSError, ValueError) as e:
+        print(f'topology: {e}', file=sys.stderr)
+        return 1
+    print(f"Generated {len(network['routers'])} routers, {len(network['hosts'])} hosts and "
+          f"{len(network['networks'])} networks in {args.output} ({time.perf_counter() - start:.3f}s)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Checks the topology generator, without Docker.
+
+import ipaddress
+import json
+import os
+import re
+import tempfile
+import time
+
+from Timothy_Lawrence_u1311540 import DIAMOND
+from topology import (build_network, frr_config, load_description, network_name, orchestration, ring_description,
+                      write_network)
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+# The diamond description reproduces the hand-written network
+diamond = build_network(load_description(os.path.join(here, 'topologies', 'diamond.json')))
+for router in diamond['routers']:
+    with open(os.path.join(here, 'configs', f'{router}.conf')) as file:
+        assert frr_config(diamond, router).strip() == file.read().strip(), router
+with open(os.path.join(here, 'docker-compose.yaml')) as file:
+    handWritten = file.read()
+addresses = {str(interface['address']) for config in diamond['routers'].values() for interface in config['interfaces']}
+addresses |= {str(host['address']) for host in diamond['hosts'].values()}
+assert addresses == set(re.findall(r'ipv4_address: (\S+)', handWritten))
+assert {str(config['subnet']) for config in diamond['networks'].values()} == set(re.findall(r'subnet: (\S+)', handWritten))
+generated = orchestration(diamond)
+assert generated['paths'] == DIAMOND['paths']
+assert all(set(prefixes) >= set(DIAMOND['routeChecks'].get(router, [])) for router, prefixes in generated['routeChecks'].items())
+assert generated['routeChecks']['r2'] == ['10.0.14.0/24', '10.0.15.0/24'] # Every router waits for both hosts
+
+# Paths set every interface any path changes, and equal-cost paths have several next hops
+description = load_description(os.path.join(here, 'topologies', 'diamond.json'))
+description['paths'] = {'north': {'r1': {'r4': 10}}, 'even': {'r1': {'r2': 1, 'r4': 1}, 'r3': {'r2': 1, 'r4': 1}}}
+paths = orchestration(build_network(description))['paths']
+assert paths['north']['costs'] == {'r1': {'eth2': 10, 'eth1': 5}, 'r3': {'eth1': 5, 'eth2': 10}}
+assert paths['even']['nextHops'] == {'r1': {'10.0.15.0/24': ['10.0.16.11', '10.0.16.3']},
+                                     'r3': {'10.0.14.0/24': ['10.0.16.19', '10.0.16.27']}}
+
+# Large networks are quick to generate, with distinct addresses
+start = time.perf_counter()
+ring = build_network(ring_description(100))
+plan = orchestration(ring)
+assert time.perf_counter() - start < 1, 'generating 100 routers took too long'
+subnets = [config['subnet'] for config in ring['networks'].values()]
+assert len(subnets) == 102 and not any(a.overlaps(b) for i, a in enumerate(subnets) for b in subnets[i + 1:])
+routerIds = [config['routerId'] for config in ring['routers'].values()]
+assert len(set(routerIds)) == 100
+assert len(plan['routeChecks']) == 100 and plan['routeChecks']['r1'] == ['10.0.15.0/24']
+assert plan['paths']['north']['nextHops'] == {'r1': {'10.0.15.0/24': ['10.0.16.3']}, 'r51': {'10.0.14.0/24': ['10.0.17.138']}}
+assert plan['paths']['south']['nextHops'] == {'r1': {'10.0.15.0/24': ['10.0.19.26']}, 'r51': {'10.0.14.0/24': ['10.0.17.147']}}
+
+# Writes everything the orchestrator and containers need
+with tempfile.TemporaryDirectory(dir=here) as output:
+    write_network(ring, output)
+    with open(os.path.join(output, 'topology.json')) as file:
+        assert json.load(file) == json.loads(json.dumps(plan))
+    with open(os.path.join(output, 'docker-compose.yaml')) as file:
+        compose = file.read()
+    assert compose.count('context: ../router') == 100 and compose.count('context: ../host') == 2
+    with open(os.path.join(output, 'configs', 'ha.routes')) as file:
+        assert file.read() == '10.0.15.0/24 10.0.14.4\n'
+    assert len(os.listdir(os.path.join(output, 'configs'))) == 102
+
+# Compose attaches each container's networks in name order, which must be the order of its FRR interfaces
+for router in ('r1', 'r2', 'r51', 'r100'):
+    networks = re.search(rf'^  {router}:\n.*?    networks:\n((?:      [^\n]*\n)+)', compose, re.M | re.S).group(1)
+    attached = sorted(re.findall(r'^      (\w+):$', networks, re.M))
+    interfaces = ring['routers'][router]['interfaces']
+    assert attached == [interface['network'] for interface in interfaces], router
+    assert [interface['name'] for interface in interfaces] == [f'eth{i}' for i in range(len(interfaces))]
+subnets = [ipaddress.ip_network(subnet) for subnet in ('10.0.14.0/24', '10.0.16.8/29', '10.0.16.16/29', '10.0.255.248/29', '10.1.0.0/29')]
+assert sorted(subnets, key=network_name) == subnets
+
+# Inconsistent descriptions are refused
+for broken in ({'routers': 2, 'links': [{'routers': ['r1', 'r3']}]},
+               {'routers': 2, 'links': [{'routers': ['r1', 'r2']}, {'routers': ['r2', 'r1']}]},
+               {'routers': 2, 'links': [{'routers': ['r1', 'r2'], 'costs': [0, 1]}]},
+               {'routers': 2, 'links': [{'routers': ['r1', 'r1']}]},
+               {'routers': 3, 'links': [{'routers': ['r1', 'r2']}]},
+               {'routers': 2, 'links': [{'routers': ['r1', 'r2']}], 'hosts': {'r1': 'r2'}},
+               {'routers': 2, 'links': [{'routers': ['r1', 'r2']}], 'paths': {'x': {'r1': {'r3': 1}}}}):
+    try:
+        build_network(broken)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError(broken)
+for count in (3, 5):
+    try:
+        ring_description(count)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError(count)
+print('topology_test passed')